@@ -1,16 +1,27 @@
 # -*- coding: utf-8 -*-
 
-import subprocess
 import os
 from createJsonSetupFiles import generateAutoRunFiles
 from runStuff import realExperiment2
+from campaign import CampaignPool
+from climate import build_cube, ClimateCube
 import numpy as np
 import random
-import matlab.engine
 from dipTrend import dipTrendToCSV
 import pickle
 import time
 
+WEATHER_FOLDER  = '../dataPreparation/weatherInput' # Infodata.mat and the HH2018_<year>.mat files
+CLIMATE_CUBE    = './autoRunInput/climateCube.hdf5' # the gridded climate, by site (see climate.py)
+
+def climateCube():
+    '''
+    open the climate cube, building it from the .mat files the first time
+    '''
+    if not os.path.isfile(CLIMATE_CUBE):
+        build_cube(WEATHER_FOLDER, CLIMATE_CUBE)
+    return ClimateCube(CLIMATE_CUBE)
+
 def runAuto():
     
     try:
@@ -23,22 +34,19 @@ def runAuto():
         indices1 = random.sample(indexSet, len(indexSet))
         
     indices = [int(i) for i in indices1]
+    cube = climateCube()
+    pool = CampaignPool(timeout=3600) # the workers are kept for all of the sites
     for i in indices:
         print(i)
         istr = str(i)
         if not os.path.isfile('./setupAuto/'+istr+'_Setup_Goujon2003.json'):
-            coords = runMatlab(i)
-            generateAutoRunFiles(i)
-        realExperiment2(setupFolder='setupAuto', sites=[str(i)])
+            generateAutoRunFiles(i, climateCube=CLIMATE_CUBE) # the runs read the forcing of the site from the cube
+        coords = list(cube.coords(i))
+        realExperiment2(setupFolder='setupAuto', sites=[str(i)], pool=pool)
         
         dipTrendToCSV(str(i),coords)
-
-def runMatlab(i):
-    eng = matlab.engine.start_matlab()
-    lat,lon = eng.extractData2(i,nargout=2)
-    eng.quit()
-    coords = [lat, lon]
-    return coords
+    pool.close()
+    cube.close()
 
 
 def dipFromProcessedSites():
@@ -47,19 +55,21 @@ def dipFromProcessedSites():
     indices1 = random.sample(indexSet, len(indexSet))
         
     indices = [int(i) for i in indices1]
+    cube = climateCube()
     
     for i in indices:
         istr = str(i)
         
         if os.path.isfile('./CFMauto/CFM_'+istr+'_results_HLdynamic.hdf5'):
-            coords = runMatlab(i)
+            coords = list(cube.coords(i))
             print(i)
             print(coords)
             dipTrendToCSV(str(i),coords,rfolder='CFMauto')
         else:
             continue
+    cube.close()
 
-# get temp and smb from matlab
+# get temp and smb from the climate cube
 
 # generate json files
 
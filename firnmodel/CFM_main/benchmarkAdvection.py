@@ -0,0 +1,101 @@
+from solver import w
+from constants import *
+import numpy as np
+import time
+import sys
+
+'''
+Benchmark of the Christo advection of the firn air (solver.w).
+
+The advection used to build the whole (open nodes x open nodes) matrix of
+bubble pressure ratios Xi at every time step; now only the row of Xi at the
+close-off depth is used. This script times both on synthetic columns of
+increasing resolution and checks that they give the same advection rate.
+
+Usage: python benchmarkAdvection.py [depth of the column, m (default 120)]
+'''
+
+def w_christo_matrix(airdict, z_edges, Z_P):
+    '''
+    the Christo advection as it was computed with the full Xi matrix (reference)
+    '''
+    por_cl_edges        = np.interp(z_edges,Z_P,airdict['por_cl'])
+    por_op_edges        = np.interp(z_edges,Z_P,airdict['por_op'])
+    w_firn_edges        = np.interp(z_edges,Z_P,airdict['w_firn'])
+    T_edges             = np.interp(z_edges,Z_P,airdict['Tz'])
+    p_star              = por_op_edges * np.exp(M_AIR *GRAVITY*z_edges/(R*T_edges))
+    dscl                = np.gradient(por_cl_edges,z_edges)
+    C                   = np.exp(M_AIR*GRAVITY*z_edges/(R*T_edges))
+
+    op_ind              = np.where(z_edges<=airdict['z_co'])[0]
+    co_ind              = op_ind[-1]
+    cl_ind              = np.where(z_edges>airdict['z_co'])[0]
+
+    Xi_up               = por_op_edges[op_ind]/np.reshape(por_op_edges[op_ind], (-1,1))
+    Xi_down             = (1 + np.log( np.reshape(w_firn_edges[op_ind], (-1,1))/ w_firn_edges[op_ind] ))
+    Xi                  = Xi_up / Xi_down
+
+    integral_matrix     = (Xi.T*dscl[op_ind]*C[op_ind]).T
+    integral_matrix_sum = integral_matrix.sum(axis=1)
+
+    p_ratio             = np.zeros_like(z_edges)
+    p_ratio[op_ind]     = integral_matrix_sum
+    p_ratio[cl_ind]     = integral_matrix_sum[-1]
+
+    flux                = w_firn_edges[co_ind] * p_ratio[co_ind] * por_cl_edges[co_ind]
+    velocity            = flux / p_star / airdict['dt']
+    return velocity - w_firn_edges
+
+def synthetic_column(nz, depth):
+    '''
+    firn column with an exponential density profile and the porosities of FirnAir.porosity
+
+    :return airdict, z_edges, Z_P:
+    '''
+    Z_P         = np.linspace(0, depth, nz)
+    z_edges     = np.concatenate(([Z_P[0]], Z_P[0:-1] + np.diff(Z_P) / 2, [Z_P[-1]]))
+    rho         = RHO_I - (RHO_I - 350.0) * np.exp(-Z_P / 30.0)
+    Tz          = 240.0 * np.ones(nz)
+    bcoRho      = 1/( 1/(RHO_I) + Tz[0]*6.95E-7 - 4.3e-5)
+
+    por_tot     = 1 - rho / RHO_I
+    por_co      = 1 - bcoRho / RHO_I
+    por_cl      = 0.37 * por_tot * (por_tot / por_co)**(-7.6)
+    por_cl      = np.minimum(por_cl, por_tot)
+    por_op      = por_tot - por_cl
+    por_op[por_op<=0] = 1.0e-25
+
+    dt          = S_PER_YEAR
+    w_firn      = 0.25 * RHO_I / rho / S_PER_YEAR # m/s, for 0.25 m ice per year
+
+    airdict = {
+        'advection_type':   'Christo',
+        'por_tot':          por_tot,
+        'por_cl':           por_cl,
+        'por_op':           por_op,
+        'w_firn':           w_firn,
+        'Tz':               Tz,
+        'dt':               dt,
+        'z_co':             np.min(Z_P[rho>=bcoRho]),
+        }
+    return airdict, z_edges, Z_P
+
+def best_time(f, repeat=5):
+    best = np.inf
+    for k in range(repeat):
+        t0      = time.perf_counter()
+        out     = f()
+        best    = min(best, time.perf_counter() - t0)
+    return best, out
+
+if __name__ == '__main__':
+
+    depth = float(sys.argv[1]) if len(sys.argv) > 1 else 120.0
+
+    print('%8s %8s %14s %14s %10s %12s' %('nodes', 'dz (m)', 'matrix (ms)', 'row (ms)', 'speedup', 'max rel diff'))
+    for nz in [250, 500, 1000, 2000, 4000, 8000]:
+        airdict, z_edges, Z_P = synthetic_column(nz, depth)
+        t_matrix, w_matrix  = best_time(lambda: w_christo_matrix(airdict, z_edges, Z_P))
+        t_row, w_row        = best_time(lambda: w(airdict, z_edges, None, Z_P, None))
+        diff = np.max(np.abs(w_row - w_matrix) / np.abs(w_matrix))
+        print('%8d %8.3f %14.3f %14.3f %10.1f %12.2e' %(nz, depth / (nz - 1), 1e3 * t_matrix, 1e3 * t_row, t_matrix / t_row, diff))
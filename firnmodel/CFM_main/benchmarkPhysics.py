@@ -0,0 +1,254 @@
+from physics import DensificationEngine, PHYSICS
+from kernels import select_backend
+from hl_analytic import hl_analytic
+from constants import *
+import numpy as np
+import contextlib
+import platform
+import glob
+import json
+import time
+import io
+import os
+import sys
+
+'''
+Benchmark of the densification physics.
+
+Every physics in PHYSICS (and the grain growth and THistory) is timed on a
+synthetic column and on steady-state columns of the sites in CFMexp2 and
+autoRunInput, at several grid sizes. The physics run as in a model run, through
+DensificationEngine.compute of an engine bound to a ColumnModel (below), so the
+timings include the reused rate buffer, the per-step cache and the compiled
+kernels of kernels.py with kernelBackend numba. The cost of one time step is
+reported in microseconds and as throughput in node-steps per second (nodes /
+time per step).
+
+The results are also written to a .json file (with the kernel backend, the numpy
+and python versions and the machine), so that the speed of the physics can be
+compared between versions of the code.
+
+Usage: python benchmarkPhysics.py [results file (default benchmarkPhysics.json)] [kernelBackend (numpy or numba, default numpy)]
+'''
+
+GRID_SIZES  = [250, 1000, 4000] # nodes of the benchmark columns
+DEPTH       = 150.0 # m, depth of the benchmark columns
+RHOS0       = 360.0 # surface density, kg m^-3
+R2S0        = 1.0e-8 # surface grain radius squared, m^2
+MIN_TIME    = 0.05 # s, minimum duration of one timing loop
+REPEAT      = 3 # timing loops per physics; the fastest one is kept
+STEP        = 1 # time step that is computed
+
+class ColumnModel:
+    '''
+    The parts of a model run (FirnDensitySpin or FirnDensityNoSpin) that
+    DensificationEngine reads, for a column that does not change.
+    '''
+
+    def __init__(self, fields, physRho, kernelBackend, physGrain):
+        '''
+        :param fields: the column (see column_params)
+        :param physRho: name of the densification physics
+        :param kernelBackend: 'numpy' or 'numba'
+        :param physGrain: grain growth on or off
+        '''
+        for k, v in fields.items():
+            setattr(self, k, np.copy(v) if isinstance(v, np.ndarray) else v)
+        self.kernelBackend  = kernelBackend
+        self.c              = {
+            'physRho':          physRho,
+            'bdot_type':        'mean',
+            'physGrain':        physGrain,
+            'calcGrainSize':    False,
+            'r2s0':             R2S0,
+            'GrGrowPhysics':    'Arthern',
+        }
+
+def site_climate(tempFile, bdotFile):
+    '''
+    mean temperature and accumulation rate of the forcing files of a site
+
+    The first row of the files is the time; all of the other rows are data.
+
+    :return T: mean temperature, K
+    :return bdot: mean accumulation rate, m I.E. per year
+    '''
+    T       = np.mean(np.loadtxt(tempFile, delimiter=',')[1:])
+    bdot    = np.mean(np.loadtxt(bdotFile, delimiter=',')[1:])
+    if T < 0: # temperatures in C
+        T   = T + K_TO_C
+    return T, bdot
+
+def sites():
+    '''
+    :return sites: dictionary of site name -> (mean temperature, mean accumulation rate)
+    '''
+    folder  = os.path.dirname(os.path.abspath(__file__))
+    climate = {}
+    climate['CFMexp2'] = site_climate(os.path.join(folder, 'CFMexp2', 'tskin_const.csv'), os.path.join(folder, 'CFMexp2', 'bDot_const.csv'))
+    for tempFile in sorted(glob.glob(os.path.join(folder, 'autoRunInput', 'temp_*.csv'))):
+        siteName = os.path.basename(tempFile)[5:-4]
+        bdotFile = os.path.join(folder, 'autoRunInput', 'smb_' + siteName + '.csv')
+        if os.path.isfile(bdotFile):
+            climate['autoRun_' + siteName] = site_climate(tempFile, bdotFile)
+    return climate
+
+def synthetic_column(nz):
+    '''
+    firn column with an exponential density profile and a warm surface
+
+    :return fields: the fields of the column (see column_params)
+    '''
+    z           = np.linspace(0, DEPTH, nz)
+    rho         = RHO_I - (RHO_I - RHOS0) * np.exp(-z / 30.0)
+    rho[-5:]    = RHO_I
+    Tz          = 240.0 + 5.0 * np.exp(-z / 3.0)
+    bdot_mean   = 0.25 + 0.05 * np.sin(z / 10.0)
+    age         = z * RHO_I / rho / 0.25 * S_PER_YEAR
+    return column_params(z, rho, Tz, age, bdot_mean, 242.0, 0.25)
+
+def site_column(nz, T, bdot):
+    '''
+    steady-state (Herron and Langway) firn column of a site
+
+    :param T: mean temperature, K
+    :param bdot: mean accumulation rate, m I.E. per year
+
+    :return fields: the fields of the column (see column_params)
+    '''
+    z           = np.linspace(0, DEPTH, nz)
+    age, rho    = hl_analytic(RHOS0, z, T, bdot)
+    rho         = np.minimum(rho, RHO_I)
+    Tz          = T * np.ones(nz)
+    bdot_mean   = bdot * np.ones(nz)
+    return column_params(z, rho, Tz, age, bdot_mean, T, bdot)
+
+def column_params(z, rho, Tz, age, bdot_mean, T, bdot):
+    '''
+    the fields of a column that the physics read, with the grain size and
+    temperature history of a column at a constant temperature
+
+    :return fields: dictionary of the attributes of a ColumnModel
+    '''
+    nz      = len(z)
+    dz      = np.concatenate((np.diff(z), [z[-1] - z[-2]]))
+    mass    = rho * dz
+    dt      = S_PER_YEAR / 12.0
+
+    fields = {
+        'dt':               dt,
+        't':                dt / S_PER_YEAR,
+        'gridLen':          nz,
+        'bdotSec':          bdot / S_PER_YEAR * dt * np.ones(STEP + 1),
+        'bdot_mean':        bdot_mean,
+        'Tz':               Tz,
+        'T10m':             T,
+        'T_mean':           T,
+        'Ts':               T * np.ones(STEP + 1),
+        'rho':              rho,
+        'rhos0':            RHOS0 * np.ones(STEP + 1),
+        'z':                z,
+        'dz':               dz,
+        'mass':             mass,
+        'sigma':            (mass * GRAVITY).cumsum(axis = 0),
+        'age':              age,
+        'LWC':              np.zeros(nz),
+        'MELT':             False,
+        'r2':               R2S0 + 1.3e-7 * np.exp(-42.4e3 / (R * Tz)) * age,
+        'Hx':               np.exp(-110.0e3 / (R * Tz)) * (age + dt),
+    }
+    return fields
+
+def time_step(f, phys):
+    '''
+    time one call of f, with the per-step cache of phys (a DensificationEngine) cleared before each call
+
+    :return t: time per call (fastest of REPEAT loops), s
+    '''
+    phys.stepCache.clear()
+    t0      = time.perf_counter()
+    f()
+    t1      = time.perf_counter()
+    number  = max(1, int(MIN_TIME / max(t1 - t0, 1.0e-7)))
+    best    = np.inf
+    for k in range(REPEAT):
+        t0 = time.perf_counter()
+        for n in range(number):
+            phys.stepCache.clear()
+            f()
+        best = min(best, (time.perf_counter() - t0) / number)
+    return best
+
+def step_function(name, fields, kernelBackend):
+    '''
+    :param name: physics in PHYSICS, 'grainGrowth' or 'THistory'
+
+    :return f, engine: what is timed for one step of name, and its DensificationEngine
+    '''
+    if name in PHYSICS: # with grain growth only if the physics needs the grain size, so that the densification is timed alone
+        engine  = DensificationEngine(ColumnModel(fields, name, kernelBackend, 'r2' in PHYSICS[name]['state']))
+        return (lambda: engine.compute(STEP)), engine
+    engine      = DensificationEngine(ColumnModel(fields, 'HLdynamic', kernelBackend, True))
+    engine.iii  = STEP
+    if name == 'grainGrowth':
+        return (lambda: (engine.grainGrowthRate(), engine.grainSurface())), engine
+    return engine.THistory, engine
+
+def benchmark(columns, kernelBackend='numpy'):
+    '''
+    :param columns: dictionary of column name -> function of the number of nodes that gives the fields of the column
+    :param kernelBackend: 'numpy' or 'numba' (see kernels.py)
+
+    :return results: one dictionary per column, grid size and physics
+    '''
+    results = []
+    for columnName, makeColumn in columns.items():
+        for nz in GRID_SIZES:
+            fields = makeColumn(nz)
+            for name in list(PHYSICS) + ['grainGrowth', 'THistory']:
+                result  = {'column': columnName, 'nodes': nz, 'physics': name}
+                log     = io.StringIO()
+                try:
+                    with contextlib.redirect_stdout(log): # the physics print warnings at every call
+                        f, engine = step_function(name, fields, kernelBackend)
+                        t = time_step(f, engine)
+                    result['us_per_step']           = 1.0e6 * t
+                    result['node_steps_per_second'] = nz / t
+                    print('%-18s %6d %-20s %12.1f %16.3e' %(columnName, nz, name, 1.0e6 * t, nz / t))
+                except (Exception, SystemExit) as e: # some physics exit when they do not converge (e.g. Goujon2003)
+                    lines           = log.getvalue().strip().splitlines()
+                    result['error'] = '%s: %s' %(type(e).__name__, e if str(e) else (lines[-1] if lines else ''))
+                    print('%-18s %6d %-20s failed: %s' %(columnName, nz, name, result['error']))
+                results.append(result)
+    return results
+
+if __name__ == '__main__':
+
+    resultsFile     = sys.argv[1] if len(sys.argv) > 1 else 'benchmarkPhysics.json'
+    kernelBackend   = select_backend({'kernelBackend': sys.argv[2] if len(sys.argv) > 2 else 'numpy'})
+
+    climate = sites()
+    columns = {'synthetic': synthetic_column}
+    for siteName, (T, bdot) in climate.items():
+        columns[siteName] = lambda nz, T=T, bdot=bdot: site_column(nz, T, bdot)
+
+    print('kernelBackend is', kernelBackend)
+    print('%-18s %6s %-20s %12s %16s' %('column', 'nodes', 'physics', 'us per step', 'node-steps/s'))
+    results = benchmark(columns, kernelBackend)
+
+    info = {
+        'date':         time.strftime('%Y-%m-%d %H:%M:%S'),
+        'kernelBackend': kernelBackend,
+        'python':       platform.python_version(),
+        'numpy':        np.__version__,
+        'machine':      platform.machine(),
+        'processor':    platform.processor(),
+        'platform':     platform.platform(),
+        'grid_sizes':   GRID_SIZES,
+        'depth':        DEPTH,
+        'sites':        dict((siteName, {'T': T, 'bdot': bdot}) for siteName, (T, bdot) in climate.items()),
+        'results':      results,
+    }
+    with open(resultsFile, 'w') as f:
+        json.dump(info, f, indent = 4)
+    print('results written to', resultsFile)
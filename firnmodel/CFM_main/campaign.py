@@ -0,0 +1,254 @@
+from main import run_config
+import multiprocessing
+import collections
+import contextlib
+import traceback
+import queue
+import json
+import time
+import os
+import sys
+
+'''
+Campaign runner: many runs (sites x models x experiments) on a bounded pool of
+worker processes.
+
+The pool has one worker per core available to the process (or 'processes'),
+so a campaign uses the whole machine without running more models at once than
+there are cores. The workers stay alive between runs: the model is imported once
+per worker, not once per run. A job is a name and a json config (a dictionary; it
+is not read from a file by the worker), and is run as python main.py runs it
+(main.run_config).
+
+A job that takes longer than 'timeout' seconds is stopped (its worker is killed
+and replaced; a spin cache lock that it held is released with it, see spincache.py);
+a job that fails or times out is run again up to 'retries' times.
+Each job gives a result dictionary:
+
+    name:           name of the job
+    status:         'ok', 'failed' (the run raised an error) or 'timeout'
+    attempts:       number of times the job was run
+    seconds:        run time of the last attempt
+    resultsFile:    path of the results file ('ok' only)
+    error:          traceback of the error of the last attempt (None if 'ok')
+
+    with CampaignPool(timeout = 3600, retries = 1) as pool:
+        results = pool.run([config_job(f) for f in configFiles])
+    report(results)
+'''
+
+POLL = 1.0 # s, longest wait for a result before the workers are checked for timeouts and crashes
+
+def default_processes():
+    '''
+    :return processes: number of cores that this process can run on
+    '''
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError: # not on linux
+        return os.cpu_count() or 1
+
+def config_job(configName, name=None):
+    '''
+    :param configName: name of a json config file
+    :param name: name of the job; defaults to the name of the file without its extension
+
+    :return job: (name, config)
+    '''
+    with open(configName, 'r') as f:
+        c = json.loads(f.read())
+    if name is None:
+        name = os.path.splitext(os.path.basename(configName))[0]
+    return (name, c)
+
+@contextlib.contextmanager
+def job_log(logFolder, name):
+    '''
+    send the output of a job to <logFolder>/<name>.log (to the output of the worker if logFolder is None)
+    '''
+    if logFolder is None:
+        yield
+        return
+    with open(os.path.join(logFolder, name + '.log'), 'w') as f:
+        with contextlib.redirect_stdout(f), contextlib.redirect_stderr(f):
+            yield
+
+def worker(k, inbox, outbox, logFolder):
+    '''
+    worker process: runs the jobs that it gets from inbox until it gets None,
+    and puts (worker, job, status, resultsFile, error, seconds) in outbox after each job
+    '''
+    while True:
+        job = inbox.get()
+        if job is None:
+            return
+        jobId, name, c = job
+        t0 = time.time()
+        try:
+            with job_log(logFolder, name):
+                resultsFile = run_config(c)
+            outbox.put((k, jobId, 'ok', resultsFile, None, time.time() - t0))
+        except (Exception, SystemExit): # some physics exit when they do not converge (e.g. Goujon2003)
+            outbox.put((k, jobId, 'failed', None, traceback.format_exc(), time.time() - t0))
+
+class CampaignPool:
+    '''
+    Bounded pool of persistent worker processes that run json configs.
+    '''
+
+    def __init__(self, processes=None, timeout=None, retries=0, logFolder=None):
+        '''
+        :param processes: number of worker processes; defaults to the number of cores (default_processes)
+        :param timeout: s, longest run time of a job; None for no limit
+        :param retries: number of times that a failed or timed out job is run again
+        :param logFolder: folder for the output of each job (<name>.log); if None, the workers print to the terminal
+        '''
+        self.processes  = processes or default_processes()
+        self.timeout    = timeout
+        self.retries    = retries
+        self.logFolder  = logFolder
+        if logFolder is not None and not os.path.exists(logFolder):
+            os.makedirs(logFolder)
+
+        self.ctx        = multiprocessing.get_context()
+        self.outbox     = self.ctx.Queue()
+        self.workers    = [] # (process, inbox) of each worker
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def start_worker(self, k):
+        '''
+        start worker k (again, if it was killed or died)
+        '''
+        inbox   = self.ctx.Queue()
+        process = self.ctx.Process(target = worker, args = (k, inbox, self.outbox, self.logFolder), daemon = True)
+        process.start()
+        if k < len(self.workers):
+            self.workers[k] = (process, inbox)
+        else:
+            self.workers.append((process, inbox))
+
+    def stop_worker(self, k):
+        '''
+        kill worker k; the operating system releases the locks that it held (e.g. of the spin cache)
+        '''
+        process, inbox = self.workers[k]
+        if process.is_alive():
+            process.kill()
+        process.join()
+
+    def close(self):
+        '''
+        stop the workers
+        '''
+        for process, inbox in self.workers:
+            if process.is_alive():
+                inbox.put(None)
+        for process, inbox in self.workers:
+            process.join()
+        self.workers = []
+
+    def run(self, jobs):
+        '''
+        Run jobs on the pool, and wait for all of them.
+
+        :param jobs: list of (name, config) (e.g. from config_job), or dictionary of name -> config
+
+        :return results: the result dictionary of each job, in the order of the jobs
+        '''
+        if isinstance(jobs, dict):
+            jobs = list(jobs.items())
+        if len(set(name for name, c in jobs)) != len(jobs):
+            raise ValueError('the jobs of a campaign need different names')
+
+        while len(self.workers) < min(self.processes, len(jobs)):
+            self.start_worker(len(self.workers))
+
+        results = [{'name': name, 'status': None, 'attempts': 0, 'seconds': None, 'resultsFile': None, 'error': None} for name, c in jobs]
+        pending = collections.deque(range(len(jobs)))
+        busy    = {} # worker -> (job, start time)
+        done    = 0
+
+        while done < len(jobs):
+            ### give the next jobs to the idle workers
+            for k in range(len(self.workers)):
+                if pending and k not in busy:
+                    jobId = pending.popleft()
+                    self.workers[k][1].put((jobId,) + tuple(jobs[jobId]))
+                    results[jobId]['attempts'] += 1
+                    busy[k] = (jobId, time.time())
+
+            ### wait for a result, or until the next timeout
+            wait = POLL
+            if self.timeout is not None:
+                wait = min([wait] + [max(t0 + self.timeout - time.time(), 0.0) for jobId, t0 in busy.values()])
+            try:
+                message = self.outbox.get(timeout = wait)
+            except queue.Empty:
+                message = None
+            finished = []
+            if message is not None:
+                k, jobId, status, resultsFile, error, seconds = message
+                if k in busy and busy[k][0] == jobId: # not from a worker that was just stopped
+                    del busy[k]
+                    finished.append((jobId, status, resultsFile, error, seconds))
+
+            ### stop the jobs that timed out, and replace the workers that died
+            for k, (jobId, t0) in list(busy.items()):
+                process = self.workers[k][0]
+                if self.timeout is not None and time.time() - t0 > self.timeout:
+                    finished.append((jobId, 'timeout', None, 'no result after %g s' %self.timeout, time.time() - t0))
+                elif not process.is_alive():
+                    finished.append((jobId, 'failed', None, 'worker died (exit code %s)' %process.exitcode, time.time() - t0))
+                else:
+                    continue
+                del busy[k]
+                self.stop_worker(k)
+                self.start_worker(k)
+
+            for jobId, status, resultsFile, error, seconds in finished:
+                result = results[jobId]
+                result.update({'status': status, 'seconds': seconds, 'resultsFile': resultsFile, 'error': error})
+                if status != 'ok' and result['attempts'] <= self.retries:
+                    print('campaign: %s %s (attempt %d); running it again' %(result['name'], status, result['attempts']))
+                    pending.append(jobId)
+                    continue
+                done += 1
+                print('campaign: [%d/%d] %s %s in %.1f s' %(done, len(jobs), result['name'], status, seconds))
+
+        return results
+
+def run_campaign(jobs, **kwargs):
+    '''
+    Run jobs on a new CampaignPool (see CampaignPool for the keyword arguments).
+
+    :return results: the result dictionary of each job, in the order of the jobs
+    '''
+    with CampaignPool(**kwargs) as pool:
+        return pool.run(jobs)
+
+def report(results, reportFile=None):
+    '''
+    print the jobs that did not succeed, and write all of the results to a .json file
+
+    :param results: from CampaignPool.run
+    :param reportFile: .json file for the results; not written if None
+    '''
+    failed = [result for result in results if result['status'] != 'ok']
+    print('campaign: %d of %d jobs ok' %(len(results) - len(failed), len(results)))
+    for result in failed:
+        print('%s %s after %d attempts:' %(result['name'], result['status'], result['attempts']))
+        print(result['error'])
+    if reportFile is not None:
+        with open(reportFile, 'w') as f:
+            json.dump(results, f, indent = 4)
+
+if __name__ == '__main__':
+
+    ### usage: python campaign.py config1.json config2.json ...
+    results = run_campaign([config_job(configName) for configName in sys.argv[1:]])
+    report(results)
@@ -0,0 +1,92 @@
+from firn_density_spin import FirnDensitySpin
+from firn_density_nospin import FirnDensityNoSpin
+from forcing import Forcing
+from reader import read_spin
+from spincache import spin_up
+from writer import nospin_outputs
+import copy
+import json
+
+'''
+Python interface to the CFM: the spin up and the main run of a column in one
+call, without files in between.
+
+    import cfm
+    results = cfm.run(c, {'Temp': (temp, years), 'bdot': (bdot, years)})
+    rho     = results['density'] # (write times x nodes+1); the first column is the model time
+
+The forcing can be given as arrays; the forcing that is not given is read from
+the input files of the .json, as in main.py. The spin up hands its final column
+to the main run in memory (reader.SpinState), and the outputs of the main run are
+returned as arrays with the names of the datasets of the results file. Nothing is
+written unless write=True, which writes the spin file and the results file as
+main.py does.
+
+A run can start from the spun-up column of an earlier run (Results.spinState),
+e.g. to run many forcing scenarios from one spin up. With 'spinCacheFolder' in
+the .json the spin up goes through the spin cache (see spincache.py), which keeps
+its spin files on disk.
+'''
+
+class Results:
+    '''
+    Outputs of cfm.run.
+
+    : outputs: dictionary of output name -> array, as the datasets of the results file
+    : spinState: the spun-up column that the main run started from (reader.SpinState)
+    : firn: the FirnDensityNoSpin at the end of the run
+    '''
+
+    def __init__(self, outputs, spinState, firn):
+        self.outputs    = outputs
+        self.spinState  = spinState
+        self.firn       = firn
+
+    def __getitem__(self, name):
+        return self.outputs[name]
+
+    def __contains__(self, name):
+        return name in self.outputs
+
+    def keys(self):
+        return self.outputs.keys()
+
+def run(config, forcing=None, write=False, spinState=None):
+    '''
+    Spin up and main run of a column.
+
+    :param config: dictionary of the json config (or name of the json file)
+    :param forcing: dictionary of 'Temp', 'bdot', 'melt', 'Iso' or 'srho' -> (input_data, input_year);
+                    the forcing that is not in it is read from the input files of the json
+    :param write: if True, the spin file and the results file are written as by main.py
+    :param spinState: spun-up column to start from (e.g. the spinState of the Results of an earlier run);
+                      the spin up is run if None
+
+    :return results: Results
+    '''
+
+    if isinstance(config, dict):
+        c = copy.deepcopy(config)
+    else:
+        with open(config, 'r') as f:
+            c = json.loads(f.read())
+
+    if isinstance(c['physRho'], list):
+        raise ValueError('cfm.run runs one model; give physRho as a string (several models over the same forcing: see multiphysics.py)')
+
+    c['writeSpinFile']  = write
+    c['streamOutput']   = False # the outputs are returned in memory
+
+    if spinState is None:
+        if 'spinCacheFolder' in c:
+            spin_up(c, inputs = forcing)
+            spinState   = read_spin(c['resultsFolder'], c['spinFileName'])
+        else:
+            firnS       = FirnDensitySpin(c, forcing)
+            firnS.time_evolve()
+            spinState   = firnS.spinState
+
+    firn = FirnDensityNoSpin(c, Forcing(c, forcing), spinState = spinState)
+    firn.time_evolve(write = write)
+
+    return Results(nospin_outputs(firn), spinState, firn)
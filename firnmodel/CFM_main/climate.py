@@ -0,0 +1,157 @@
+import numpy as np
+import scipy.io
+import h5py
+import os
+
+'''
+Gridded climate forcing for site campaigns (replaces extractData2.m).
+
+build_cube reads the yearly HH2018_<year>.mat files (monthly temperature 'Temp'
+and surface mass balance 'smb', one row per grid cell) and the coordinates of
+the cells (Infodata.mat) once, and writes them into one HDF5 file, chunked by
+site, so that the forcing of one site (or of a batch of sites) is read without
+loading the whole grid.
+
+ClimateCube serves the forcing of a site in the layout of the temp_<i>.csv and
+smb_<i>.csv files that extractData2.m wrote (first row the years, then one row per
+month). Sites are numbered as in MATLAB, starting from 1.
+
+A run reads its forcing directly from the cube if the .json has 'climateCube'
+(path of the cube) and 'climateSite' (index of the site); see reader.read_climate.
+'''
+
+CUBE_VARIABLES = {'temp': 'Temp', 'smb': 'smb'} # name in the cube -> variable in the HH2018 .mat files
+JSON_VARIABLES = {'Temp': 'temp', 'bdot': 'smb'} # InputFileName<...> in the .json -> name in the cube
+MONTHS = 12
+
+def load_mat(filename):
+    '''
+    :param filename: .mat file (any version; v7.3 files are read with h5py)
+
+    :return variables: dictionary of variable name -> array
+    '''
+    try:
+        return scipy.io.loadmat(filename)
+    except NotImplementedError: # v7.3 .mat files are HDF5 files, with the dimensions of the arrays reversed
+        with h5py.File(filename, 'r') as f:
+            return dict((k, np.asarray(f[k]).T) for k in f.keys() if isinstance(f[k], h5py.Dataset))
+
+def build_cube(weatherFolder, cubeFile, years=range(2003, 2009), chunkSites=256):
+    '''
+    Convert the yearly gridded climate into one HDF5 cube indexed by site.
+
+    :param weatherFolder: folder of Infodata.mat and the HH2018_<year>.mat files
+    :param cubeFile: path of the cube
+    :param years: years to put in the cube (default: the ICESat years of extractData2.m)
+    :param chunkSites: number of sites in an HDF5 chunk
+    '''
+
+    years   = list(years)
+    info    = load_mat(os.path.join(weatherFolder, 'Infodata.mat'))
+    lat     = np.round(np.ravel(info['lat']), 2)
+    lon     = np.round(np.ravel(info['lon']), 2)
+    nSites  = len(lat)
+    chunks  = (min(chunkSites, nSites), len(years), MONTHS)
+
+    tmp = cubeFile + '.%d.tmp' %os.getpid()
+    with h5py.File(tmp, 'w') as f5:
+        f5.create_dataset('year', data = np.array(years, dtype = float))
+        f5.create_dataset('lat', data = lat)
+        f5.create_dataset('lon', data = lon)
+        cube = dict((name, f5.create_dataset(name, (nSites, len(years), MONTHS), dtype = float, chunks = chunks)) for name in CUBE_VARIABLES)
+
+        for k, year in enumerate(years):
+            yearFile = load_mat(os.path.join(weatherFolder, 'HH2018_%d.mat' %year))
+            for name, variable in CUBE_VARIABLES.items():
+                field = np.asarray(yearFile[variable], dtype = float)
+                if field.shape != (nSites, MONTHS):
+                    raise ValueError('%s in HH2018_%d.mat has shape %s; expected %s' %(variable, year, field.shape, (nSites, MONTHS)))
+                cube[name][:, k, :] = field
+            print('added', year, 'to the climate cube')
+    os.replace(tmp, cubeFile)
+
+class ClimateCube:
+    '''
+    Forcing of the sites of a cube written by build_cube.
+    '''
+
+    def __init__(self, cubeFile):
+        '''
+        :param cubeFile: path of the cube
+        '''
+        self.f5         = h5py.File(cubeFile, 'r')
+        self.years      = self.f5['year'][:]
+        self.nSites     = self.f5['lat'].shape[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.f5.close()
+
+    def rows(self, sites):
+        '''
+        :param sites: site indices, from 1
+
+        :return rows: row of each site in the cube
+        '''
+        rows = np.asarray(sites, dtype = int) - 1
+        if np.any(rows < 0) or np.any(rows >= self.nSites):
+            raise ValueError('site indices go from 1 to %d' %self.nSites)
+        return rows
+
+    def coords(self, site):
+        '''
+        :param site: site index, from 1
+
+        :return lat, lon: coordinates of the site (rounded to 2 decimals)
+        '''
+        row = self.rows([site])[0]
+        return float(self.f5['lat'][row]), float(self.f5['lon'][row])
+
+    def table(self, site, name):
+        '''
+        :param site: site index, from 1
+        :param name: 'temp' or 'smb'
+
+        :return table: (months + 1) x years array, as in the csv files of extractData2.m
+        '''
+        return self.tables([site], name)[0]
+
+    def tables(self, sites, name):
+        '''
+        Forcing of a batch of sites, read from the cube in one selection.
+
+        :param sites: site indices, from 1
+        :param name: 'temp' or 'smb'
+
+        :return tables: (sites x (months + 1) x years) array
+        '''
+        rows            = self.rows(sites)
+        order           = np.unique(rows) # h5py reads increasing indices
+        data            = self.f5[name][order, :, :]
+        data            = data[np.searchsorted(order, rows)]
+        tables          = np.empty((len(rows), MONTHS + 1, len(self.years)))
+        tables[:, 0, :] = self.years
+        tables[:, 1:, :] = np.transpose(data, (0, 2, 1))
+        return tables
+
+    def read_input(self, site, name):
+        '''
+        :param site: site index, from 1
+        :param name: 'temp' or 'smb'
+
+        :return input_data, input_year: as reader.read_input returns them for the csv file of the site
+        '''
+        table = self.table(site, name)
+        return table[1, :], table[0, :]
+
+    def write_csv(self, site, folder):
+        '''
+        write temp_<site>.csv and smb_<site>.csv into folder, as extractData2.m did
+        '''
+        for name in CUBE_VARIABLES:
+            np.savetxt(os.path.join(folder, '%s_%d.csv' %(name, site)), self.table(site, name), delimiter = ',', fmt = '%.17g')
@@ -0,0 +1,105 @@
+import numpy as np
+
+'''
+Preallocated storage for the per-node fields of a firn column.
+
+All fields share one 2-D block (field x capacity). The column occupies
+block[:, head:head+gridLen]; adding a new layer at the surface moves the
+head up by one node, which also drops the bottom node, so accumulation
+does not allocate or copy the column. When the head reaches the start of
+the block, the column is moved back to the end of the block once
+(amortized O(1) per step).
+
+The model classes expose the fields as ordinary attributes (self.rho,
+self.dz, ...) through ColumnField, so physics, diffusion, melt and regrid
+read views of the block without copying. Assigning to one of these
+attributes copies the new values into the block.
+'''
+
+class ColumnState:
+
+    def __init__(self, fields, capacity=None):
+        '''
+        :param fields: dictionary of field name -> initial array (all the same length)
+        :param capacity: number of nodes to allocate for each field; defaults to twice the grid length
+        '''
+
+        self.names      = list(fields.keys())
+        self.gridLen    = len(fields[self.names[0]])
+        if capacity is None:
+            capacity    = 2 * self.gridLen
+        self.capacity   = max(int(capacity), self.gridLen + 1)
+        self.index      = dict((name, ii) for ii, name in enumerate(self.names))
+
+        self.block      = np.zeros((len(self.names), self.capacity))
+        self.head       = self.capacity - self.gridLen
+        for name in self.names:
+            self.block[self.index[name], self.head:] = fields[name]
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __getitem__(self, name):
+        '''
+        returns a view of the current values of a field
+        '''
+        return self.block[self.index[name], self.head:self.head + self.gridLen]
+
+    def push(self, **top):
+        '''
+        Add a new node at the surface and drop the bottom node.
+
+        :param top: value of the new surface node for every field in the column
+        '''
+        if self.head == 0:
+            self.block[:, self.capacity - self.gridLen:] = self.block[:, 0:self.gridLen]
+            self.head = self.capacity - self.gridLen
+
+        self.head = self.head - 1
+        for name in self.names:
+            self.block[self.index[name], self.head] = top[name]
+
+
+class ColumnField:
+    '''
+    Attribute that maps a model field (e.g. self.rho) onto the column state.
+    Before the column state exists (i.e. during __init__) the field is a plain attribute.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        col = obj.__dict__.get('col')
+        if col is not None and self.name in col:
+            return col[self.name]
+        try:
+            return obj.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+
+    def __set__(self, obj, value):
+        col = obj.__dict__.get('col')
+        if col is not None and self.name in col:
+            current = col[self.name]
+            if isinstance(value, np.ndarray) and value.base is col.block and value.ctypes.data == current.ctypes.data:
+                return # value is already the column field (e.g. returned by regrid)
+            current[...] = value
+        else:
+            obj.__dict__[self.name] = value
+
+
+def init_column(self, names, capacity=None):
+    '''
+    Move the per-node fields of a model instance into a ColumnState.
+    Called at the end of __init__ in both firn_density_spin and firn_density_nospin.
+
+    :param names: names of the fields to keep in the column state
+    '''
+
+    fields      = dict((name, np.array(self.__dict__.pop(name), dtype=float)) for name in names)
+    self.col    = ColumnState(fields, capacity)
+
+    return self.col
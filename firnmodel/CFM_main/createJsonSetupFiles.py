@@ -56,7 +56,9 @@ def generateDataFile(expNum, modelname):
     "outputs": ["density", "depth", "compaction","DIP","BCO","temperature","LWC","gasses"],
     #"output_options": ["density", "depth", "temperature", "age", "dcon", "bdot_mean", "climate", "compaction", "grainsize", "temp_Hx", "isotopes", "BCO", "LIZ", "DIP","LWC","gasses"],
     "resultsFileName": "CFM"+expNum+"results"+modelname+".hdf5",
-    "spinFileName": "CFM"+expNum+"spin"+smodelname+".hdf5",
+    "spinFileName": "CFM"+expNum+"spin"+modelname+".hdf5",
+    "spinPhysRho": smodelname, # physics of the spin up
+    "spinCacheFolder": "./CFMspinCache", # spin ups with the same inputs are only run once, see spincache.py
     "doublegrid": 0, # use 0 and 1 instead of true/false
     "nodestocombine": 50,
     "grid1bottom": 10.0
@@ -123,7 +125,9 @@ def generate15000ExperimentFile(expNum, modelname):
     "outputs": ["density", "depth", "compaction","DIP","BCO","temperature","LWC","gasses"],
     #"output_options": ["density", "depth", "temperature", "age", "dcon", "bdot_mean", "climate", "compaction", "grainsize", "temp_Hx", "isotopes", "BCO", "LIZ", "DIP","LWC","gasses"],
     "resultsFileName": "CFM"+expNum+"results"+modelname+".hdf5",
-    "spinFileName": "CFM"+expNum+"spin"+smodelname+".hdf5",
+    "spinFileName": "CFM"+expNum+"spin"+modelname+".hdf5",
+    "spinPhysRho": smodelname, # physics of the spin up
+    "spinCacheFolder": "./CFMspinCache", # spin ups with the same inputs are only run once, see spincache.py
     "doublegrid": 0, # use 0 and 1 instead of true/false
     "nodestocombine": 50,
     "grid1bottom": 10.0
@@ -183,6 +187,7 @@ def generate15000Input2File(siteName, modelname):
     #"output_options": ["density", "depth", "temperature", "age", "dcon", "bdot_mean", "climate", "compaction", "grainsize", "temp_Hx", "isotopes", "BCO", "LIZ", "DIP","LWC","gasses"],
     "resultsFileName": "CFM_"+siteName+"_results_"+modelname+".hdf5",
     "spinFileName": "CFM_"+siteName+"_spin_"+modelname+".hdf5",
+    "spinCacheFolder": "./CFMspinCache", # spin ups with the same inputs are only run once, see spincache.py
     "doublegrid": 0, # use 0 and 1 instead of true/false
     "nodestocombine": 50,
     "grid1bottom": 10.0
@@ -193,7 +198,7 @@ def generate15000Input2File(siteName, modelname):
         #json.dumps(data, outfile, indent=4)
         outfile.write(json.dumps(data, indent=4))
         
-def generateAutoRunFile(siteName, modelname):        
+def generateAutoRunFile(siteName, modelname, climateCube=None):        
     bDotFile = 'smb_'+siteName+'.csv'
     tskinFile = 'temp_'+siteName+'.csv'
 
@@ -240,10 +245,14 @@ def generateAutoRunFile(siteName, modelname):
     #"output_options": ["density", "depth", "temperature", "age", "dcon", "bdot_mean", "climate", "compaction", "grainsize", "temp_Hx", "isotopes", "BCO", "LIZ", "DIP","LWC","gasses"],
     "resultsFileName": "CFM_"+siteName+"_results_"+modelname+".hdf5",
     "spinFileName": "CFM_"+siteName+"_spin_"+modelname+".hdf5",
+    "spinCacheFolder": "./CFMspinCache", # spin ups with the same inputs are only run once, see spincache.py
     "doublegrid": 0, # use 0 and 1 instead of true/false
     "nodestocombine": 50,
     "grid1bottom": 10.0
     }
+    if climateCube is not None: # read the forcing of the site from the climate cube (climate.py) instead of the csv files
+        data["climateCube"] = climateCube
+        data["climateSite"] = int(siteName)
 
 
     with open('setupAuto/'+siteName+'_Setup_'+modelname+'.json', 'w') as outfile:
@@ -278,8 +287,8 @@ def generateSetupFilesInput2():
         for m in models:
                 generate15000Input2File(s, m)
                 
-def generateAutoRunFiles(siteIndex):
+def generateAutoRunFiles(siteIndex, climateCube=None):
     siteName = str(siteIndex)
     for m in models:
-        generateAutoRunFile(siteName,m)
+        generateAutoRunFile(siteName,m,climateCube)
     
\ No newline at end of file
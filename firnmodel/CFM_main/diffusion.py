@@ -1,4 +1,6 @@
 from solver import transient_solve_TR
+from solver import transient_solve_batch
+from solver import grid_geometry
 from constants import *
 import numpy as np
 from scipy import interpolate
@@ -22,17 +24,8 @@ def heatDiff(self,iii):
     :returns self.T10m:
     '''
 
-    nz_P             = len(self.z)
-    nz_fv             = nz_P - 2
-    nt                 = 1
-
-    # z_edges_vec     = self.z[1:-2] + self.dz[2:-1] / 2
-    # z_edges_vec     = np.concatenate(([self.z[0]], z_edges_vec, [self.z[-1]]))
-    # z_P_vec         = self.z
-
-    z_edges_vec1 = self.z[0:-1] + np.diff(self.z) / 2
-    z_edges_vec = np.concatenate(([self.z[0]], z_edges_vec1, [self.z[-1]]))
-    z_P_vec     = self.z
+    nt                 = self.heatSubSteps # the matrix is factorized once and reused for every sub-step
+    geom             = grid_geometry(self) # shared with the other diffusion solves of this time step
     
     phi_s             = self.Tz[0]
     phi_0             = self.Tz
@@ -48,7 +41,7 @@ def heatDiff(self,iii):
     tot_rho         = self.rho
     
 
-    self.Tz         = transient_solve_TR(z_edges_vec, z_P_vec, nt, self.dt, Gamma_P, phi_0, nz_P, nz_fv, phi_s, tot_rho)
+    self.Tz         = transient_solve_TR(geom, nt, self.dt / nt, Gamma_P, phi_0, phi_s, tot_rho, backend = self.kernelBackend)
 
     fT10m             = interpolate.interp1d(self.z, self.Tz)    #TODO: added fill_value="extrapolate", remove if things go very wrong
     self.T10m         = fT10m(10)
@@ -62,6 +55,45 @@ def heatDiff(self,iii):
 ### end heat diffusion
 ######################
 
+def heatDiffBatch(self,iii):
+    '''
+    Heat diffusion for a batch of columns (see ensemble.py); same physics as heatDiff.
+    The fields are 2-D arrays (columns x nodes) and column j uses its first self.nz[j] nodes.
+
+    :returns self.Tz:
+    :returns self.T10m: (columns x 1)
+    '''
+
+    geom             = grid_geometry(self)
+
+    phi_s             = self.Tz[:, 0]
+    phi_0             = self.Tz
+
+    K_ice             = 9.828 * np.exp(-0.0057 * phi_0)
+    K_firn             = K_ice * (self.rho / 1000) ** (2 - 0.5 * (self.rho / 1000))
+    c_firn             = 152.5 + 7.122 * phi_0
+
+    Gamma_P         = K_firn / (c_firn)
+    tot_rho         = self.rho
+
+    self.Tz         = transient_solve_batch(geom, self.dt, Gamma_P, phi_0, phi_s, tot_rho, self.nz)
+
+    ### linear interpolation of the temperature at 10 m in each column
+    cols             = np.arange(self.Tz.shape[0])
+    i10             = np.sum((self.z < 10) & self.valid, axis = 1)
+    z_lo, z_hi         = self.z[cols, i10 - 1], self.z[cols, i10]
+    T_lo, T_hi         = self.Tz[cols, i10 - 1], self.Tz[cols, i10]
+    self.T10m         = ((T_hi - T_lo) / (z_hi - z_lo) * (10 - z_lo) + T_lo)[:, None] # columns x 1, like the other per-column values
+
+    if np.any(self.Tz[self.valid]>273.15):
+        print('WARNING: TEMPERATURE EXCEEDS MELTING TEMPERATURE')
+        print('WARM TEMPERATURES HAVE BEEN SET TO 273.15; MODEL RUN IS CONTINUING')
+        self.Tz[self.Tz>=273.15]=273.15
+
+    return self.Tz, self.T10m
+### end batch heat diffusion
+############################
+
 def enthalpyDiff(self,iii):
     '''
     enthalpy diffusion function
@@ -94,16 +126,8 @@ def enthalpyDiff(self,iii):
 
     # enthalpy = enthalpy*tot_rho
 
-    nz_P     = len(self.z)
-    nz_fv     = nz_P - 2
     nt         = 1
-
-    ## this is the older, (semi) working bit.
-    z_edges_vec1 = self.z[0:-1] + np.diff(self.z) / 2
-    z_edges_vec = np.concatenate(([self.z[0]], z_edges_vec1, [self.z[-1]]))
-    z_P_vec     = self.z
-    
-    ##
+    geom     = grid_geometry(self)
 
     # z_edges_vec = self.z
     # z_edges_vec = np.concatenate(([z_edges_vec[0]], z_edges_vec, [z_edges_vec[-1]]))
@@ -164,7 +188,7 @@ def enthalpyDiff(self,iii):
     #     print('tot_rho',tot_rho[ind1-3:ind1+4])
     #     input()
 
-    enthalpy = transient_solve_TR(z_edges_vec, z_P_vec, nt, self.dt, Gamma_P, phi_0, nz_P, nz_fv, phi_s, tot_rho)
+    enthalpy = transient_solve_TR(geom, nt, self.dt, Gamma_P, phi_0, phi_s, tot_rho, backend = self.kernelBackend)
 
     e_less                 = np.where(enthalpy<Hs)[0]
     e_great             = np.where(enthalpy>=Hs)[0]
@@ -206,13 +230,8 @@ def isoDiff(self,iii):
 
     :returns self.phi_t:
     '''
-    nz_P         = len(self.z)                                           # number of nodes in z
-    nz_fv         = nz_P - 2                                              # number of finite volumes in z
     nt             = 1                                                     # number of time steps
-
-    z_edges_vec = self.z[1:-2] + self.dz[2:-1] / 2                        # uniform edge spacing of volume edges
-    z_edges_vec = np.concatenate(([self.z[0]], z_edges_vec, [self.z[-1]]))
-    z_P_vec     = self.z
+    geom         = grid_geometry(self)                                   # same volumes as the heat diffusion
 
     ### Node positions
     phi_s         = self.del_z[0]                                            # isotope value at surface
@@ -245,11 +264,11 @@ def isoDiff(self,iii):
     if self.c['iso'] == '18':
         D             = m * pz * invtau * Da_18 * (1 / self.rho - 1 / RHO_I) / (R * self.Tz * alpha_18_z)
         D             = D + 1.5e-15
-        self.del_z     = transient_solve_TR(z_edges_vec, z_P_vec, nt, self.dt, D, phi_0, nz_P, nz_fv, phi_s)
+        self.del_z     = transient_solve_TR(geom, nt, self.dt, D, phi_0, phi_s, np.ones_like(D), backend = self.kernelBackend) # no storage factor: d(del)/dt = d/dz(D d(del)/dz)
     elif self.c['iso'] == 'D':
         D             = m * pz * invtau * Da_D * (1 / self.rho - 1 / RHO_I) / (R * self.Tz * alpha_D_z)
         D[D<=0.0]     = 1.0e-20
-        self.del_z     = transient_solve_TR(z_edges_vec, z_P_vec, nt, self.dt, D, phi_0, nz_P, nz_fv, phi_s)
+        self.del_z     = transient_solve_TR(geom, nt, self.dt, D, phi_0, phi_s, np.ones_like(D), backend = self.kernelBackend) # no storage factor: d(del)/dt = d/dz(D d(del)/dz)
     elif self.c['iso'] == 'NoDiffusion':
         pass
         
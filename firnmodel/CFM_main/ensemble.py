@@ -0,0 +1,365 @@
+from diffusion import heatDiffBatch
+from writer import write_ensemble_hdf5
+from writer import WriteSchedule
+from reader import read_spin
+from forcing import Forcing
+from constants import *
+from spincache import spin_up
+from physics import PHYSICS, physics_spec, DensificationEngine
+import numpy as np
+import os
+import sys
+import time
+import h5py
+import json
+
+'''
+Ensemble of firn columns (e.g. many sites of a regional climate model grid)
+that are evolved together in one process.
+
+Every field is a 2-D array (columns x nodes). Columns can have different
+numbers of nodes: the arrays are padded to the longest column and column j
+uses its first nz[j] nodes (self.valid). A new surface node moves the column
+down by one node, so the bottom node of each column drops into the padding.
+
+Each column is set up from its own .json file as in a regular run
+(FirnDensityNoSpin), i.e. from its own spin-up file and forcing files, but only
+its initial state and forcing are kept. All of the columns must use the same
+physics and the same model time.
+
+The densification physics are the FirnPhysics methods (physics.py), run by a
+DensificationEngine on the whole batch; the per-column values (T10m, T_mean
+and the forcing of a step) have shape (columns x 1) or (columns) so that they
+broadcast over the nodes.
+
+Supported: the physics registered with batch = True, heat diffusion and
+grain growth (Arthern). Not supported: melt, firn air, isotope diffusion,
+strain, doublegrid, Morris2014 (temperature history), heat diffusion
+sub-steps (heatSubSteps) and write times per output (outputSchedule).
+
+usage: python ensemble.py results.hdf5 config1.json config2.json ...
+'''
+
+def pad_columns(fields, nz, extend=False):
+    '''
+    stack 1-D fields of different lengths into a (columns x max(nz)) array
+
+    :param fields: list of 1-D arrays
+    :param nz: length of each field
+    :param extend: if True, the padding continues the field with its last step (e.g. depth); otherwise the last value is repeated
+
+    :return padded:
+    '''
+    padded = np.empty((len(fields), max(nz)))
+    for jj, field in enumerate(fields):
+        padded[jj, :nz[jj]] = field
+        npad = max(nz) - nz[jj]
+        if extend:
+            padded[jj, nz[jj]:] = field[-1] + (field[-1] - field[-2]) * np.arange(1, npad + 1)
+        else:
+            padded[jj, nz[jj]:] = field[-1]
+    return padded
+
+def push_columns(field, top, accumulate):
+    '''
+    new node on top of the columns where accumulate is True; the bottom node drops off
+    '''
+    field[:, 1:] = np.where(accumulate[:, None], field[:, :-1], field[:, 1:])
+    field[:, 0]  = np.where(accumulate, top, field[:, 0])
+
+class FirnEnsemble:
+    '''
+    A batch of firn columns that are evolved together (see the top of this file).
+
+    : nz: number of nodes in each column
+    : gridLen: shape of the fields, (columns x nodes)
+    : valid: (columns x nodes) mask of the nodes that belong to each column
+    : rho, dz, Tz, age, mass, z, sigma, mass_sum, bdot_mean, r2: (columns x nodes) fields
+    : T10m, T_mean: one value per column (columns x 1)
+    : Ts, bdotSec, bdot, rhos0: forcing (time steps x columns)
+    '''
+
+    def __init__(self, configNames, resultsFile):
+        '''
+        :param configNames: list of json config files, one per column
+        :param resultsFile: name of the hdf5 file for the ensemble results
+        '''
+
+        self.configNames    = list(configNames)
+        self.resultsFile    = resultsFile
+        ncol                = len(self.configNames)
+        print('Ensemble run starting with %s columns' %ncol)
+
+        ### initial state of each column (one value per node) from its spin file; the forcing is copied
+        ### into the (time steps x columns) arrays, so no more than one column's forcing is held at a time
+        init = dict((name, []) for name in ['rho', 'dz', 'Tz', 'age', 'z', 'mass', 'bdot_mean', 'r2'])
+        for jj, configName in enumerate(self.configNames):
+            with open(configName, 'r') as f:
+                c = json.load(f)
+            forcing = Forcing(c)
+            if jj == 0:
+                self.setup(c, forcing, ncol)
+            self.check_column(c, forcing)
+
+            self.Ts[:, jj]      = forcing.Ts
+            self.bdot[:, jj]    = forcing.bdot
+            self.bdotSec[:, jj] = forcing.bdotSec
+            self.rhos0[:, jj]   = forcing.rhos0
+            self.iceout[jj]     = forcing.iceout
+
+            spinState   = read_spin(c['resultsFolder'], c['spinFileName'])
+            z           = spinState.depth[1:]
+            age         = spinState.age[1:]
+            rho         = spinState.density[1:]
+            dz          = np.diff(z)
+            dz          = np.append(dz, dz[-1])
+            mass        = rho * dz
+            mass_sum    = mass.cumsum()
+            init['z'].append(z)
+            init['age'].append(age)
+            init['rho'].append(rho)
+            init['dz'].append(dz)
+            init['mass'].append(mass)
+            init['Tz'].append(spinState.temp[1:])
+            init['bdot_mean'].append((np.concatenate(([mass_sum[0] / (RHO_I * S_PER_YEAR)], mass_sum[1:] / (age[1:] * RHO_I / self.t))))*c['stpsPerYear']*S_PER_YEAR)
+            if self.physGrain:
+                init['r2'].append(spinState.need('r2')[1:])
+
+        ### grid
+        self.nz             = np.array([len(z) for z in init['z']])
+        self.valid          = np.arange(max(self.nz))[None, :] < self.nz[:, None]
+        self.dx             = 1.0
+
+        self.rho            = pad_columns(init['rho'], self.nz)
+        self.dz             = pad_columns(init['dz'], self.nz)
+        self.Tz             = pad_columns(init['Tz'], self.nz)
+        self.age            = pad_columns(init['age'], self.nz, extend=True)
+        self.mass           = pad_columns(init['mass'], self.nz)
+        self.z              = pad_columns(init['z'], self.nz, extend=True)
+        self.sigma          = np.cumsum(self.mass * self.dx * GRAVITY, axis = 1)
+        self.mass_sum       = np.cumsum(self.mass, axis = 1)
+        self.bdot_mean      = pad_columns(init['bdot_mean'], self.nz)
+        self.gridLen        = self.rho.shape
+        if self.physGrain:
+            self.r2         = pad_columns(init['r2'], self.nz)
+            self.dr2_dt     = np.zeros_like(self.r2)
+
+        shallow             = (self.z < 50) & self.valid
+        self.T_mean         = (np.sum(self.Tz * shallow, axis = 1) / np.sum(shallow, axis = 1))[:, None]
+        self.T10m           = self.T_mean
+
+        self.dzNew          = np.zeros(ncol)
+        self.dHtot          = np.zeros(ncol)
+
+        self.densification  = DensificationEngine(self, outputs = self.output_list) # densification physics chosen by physRho
+
+    def setup(self, c, forcing, ncol):
+        '''
+        settings shared by all of the columns, from the first column
+
+        :param c: dictionary of the json config of the first column
+        :param forcing: its Forcing
+        :param ncol: number of columns
+        '''
+
+        self.c              = c
+        self.bdot_type      = c['bdot_type']
+        self.physGrain      = bool(c['physGrain'])
+        self.heatDiff       = bool(c['heatDiff'])
+        self.output_list    = c['outputs']
+        self.MELT           = False
+        self.kernelBackend  = 'numpy' # the compiled kernels (kernels.py) work on one column
+
+        ### time
+        self.dt             = forcing.dt
+        self.t              = forcing.t
+        self.stp            = forcing.stp
+        self.modeltime      = forcing.modeltime
+        self.schedule       = WriteSchedule(self.modeltime, c['TWriteInt'])
+        self.steps          = 1 / self.t
+
+        ### forcing
+        self.Ts             = np.empty((self.stp, ncol))
+        self.bdot           = np.empty((self.stp, ncol))
+        self.bdotSec        = np.empty((self.stp, ncol))
+        self.rhos0          = np.empty((self.stp, ncol))
+        self.iceout         = np.empty(ncol)
+
+    def check_column(self, c, forcing):
+        '''
+        make sure that a column can be run as part of the ensemble
+        '''
+
+        if not physics_spec(c['physRho'])['batch']:
+            raise ValueError('physRho = %s cannot be run as an ensemble; options are: %s' %(c['physRho'], ', '.join(name for name, spec in PHYSICS.items() if spec['batch'])))
+        for key in ['MELT', 'FirnAir', 'isoDiff', 'strain', 'doublegrid', 'outputSchedule']:
+            if bool(c.get(key, False)):
+                raise ValueError('%s is not supported in ensemble runs' %key)
+        if int(c.get('heatSubSteps', 1)) != 1:
+            raise ValueError('heatSubSteps is not supported in ensemble runs')
+        if bool(c['physGrain']) and c['GrGrowPhysics'] != 'Arthern':
+            raise ValueError('only Arthern grain growth is supported in ensemble runs')
+        for key in ['physRho', 'bdot_type', 'physGrain', 'heatDiff', 'calcGrainSize']:
+            if c[key] != self.c[key]:
+                raise ValueError('all columns in an ensemble need the same %s' %key)
+        if not np.array_equal(forcing.modeltime, self.modeltime):
+            raise ValueError('all columns in an ensemble need the same model time')
+
+    def time_evolve(self):
+        '''
+        Evolve all of the columns through time; same time step as FirnDensityNoSpin.time_evolve
+        '''
+        start_time  = time.time()
+        f4          = h5py.File(self.resultsFile, 'w')
+        f4.create_dataset('gridLen', data = self.nz)
+        f4.create_dataset('configName', data = np.array(self.configNames, dtype='S'))
+
+        nWrite      = self.schedule.nrows()
+        self.WTracker = 0
+        self.write_results(f4, nWrite, self.modeltime[0], np.zeros(len(self.nz)))
+        self.WTracker = 1
+
+        ####################################
+        ##### START TIME-STEPPING LOOP #####
+        ####################################
+
+        for iii in range(self.stp):
+            mtime       = self.modeltime[iii]
+
+            ### densification and grain growth rate from the columns at the start of the step
+            drho_dt         = self.densification.compute(iii)
+
+            self.rho        = self.rho + self.dt * drho_dt
+            sdz_old         = np.sum(self.dz * self.valid, axis = 1) # old total column thickness
+            self.dz         = self.mass / self.rho * self.dx # new dz after compaction
+
+            ### heat diffusion
+            if self.heatDiff:
+                self.Tz, self.T10m = heatDiffBatch(self, iii)
+
+            shallow         = (self.z < 50) & self.valid
+            self.T_mean     = (np.sum(self.Tz * shallow, axis = 1) / np.sum(shallow, axis = 1))[:, None]
+
+            sdz_new         = np.sum(self.dz * self.valid, axis = 1) # total column thickness after densification, before new snow added
+
+            ### new box on top of the columns with accumulation, bottom box drops off
+            accumulate      = self.bdotSec[iii] > 0
+            dzNew           = self.bdotSec[iii] * RHO_I / self.rhos0[iii] * S_PER_YEAR
+            massNew         = self.bdotSec[iii] * S_PER_YEAR * RHO_I
+            self.dzNew      = np.where(accumulate, dzNew, self.dzNew)
+            push_columns(self.age, 0, accumulate)
+            push_columns(self.dz, dzNew, accumulate)
+            push_columns(self.rho, self.rhos0[iii], accumulate)
+            push_columns(self.Tz, self.Ts[iii], accumulate)
+            push_columns(self.mass, massNew, accumulate)
+            self.age        = self.age + self.dt
+
+            znew            = np.cumsum(self.dz, axis = 1)
+            self.z          = np.where(accumulate[:, None], np.concatenate((np.zeros((len(self.nz), 1)), znew[:, :-1]), axis = 1), znew - znew[:, 0:1])
+
+            self.sigma      = np.cumsum(self.mass * self.dx * GRAVITY, axis = 1)
+            self.mass_sum   = np.cumsum(self.mass, axis = 1)
+            self.bdot_mean  = (np.concatenate((self.mass_sum[:, 0:1] / (RHO_I * S_PER_YEAR), self.mass_sum[:, 1:] * self.t / (self.age[:, 1:] * RHO_I)), axis = 1))*self.c['stpsPerYear']*S_PER_YEAR
+
+            if self.physGrain: # update grain radius
+                self.dr2_dt = self.densification.dr2_dt
+                r2          = self.r2 + self.dr2_dt * self.dt
+                r2_surface  = np.broadcast_to(self.densification.r2_surface, (len(self.nz),))
+                self.r2     = np.concatenate((r2_surface[:, None], r2[:, :-1]), axis = 1)
+
+            ### write results as often as specified in the .json (see writer.WriteSchedule)
+            row = self.schedule.row(iii)
+            if row is not None:
+                dH          = (sdz_new - sdz_old) + self.dzNew - (self.iceout * self.t)
+                self.dHtot  = self.dHtot + dH
+                self.WTracker = row
+                self.write_results(f4, nWrite, mtime, dH)
+
+        #################################
+        ##### END TIME-STEPPING LOOP #####
+        ##################################
+
+        f4.close()
+        print('ensemble run time =', time.time() - start_time, 'seconds')
+
+    ###########################
+    ##### END time_evolve #####
+    ###########################
+
+    def write_results(self, f4, nWrite, mtime, dH):
+        '''
+        write the outputs in the output list for all of the columns at one write time
+        '''
+
+        fields = {}
+        if 'density' in self.output_list:
+            fields['density']       = self.rho
+        if 'temperature' in self.output_list:
+            fields['temperature']   = self.Tz
+        if 'age' in self.output_list:
+            fields['age']           = self.age / S_PER_YEAR
+        if 'depth' in self.output_list:
+            fields['depth']         = self.z
+        if 'bdot_mean' in self.output_list:
+            fields['bdot']          = self.bdot_mean
+        if 'grainsize' in self.output_list and self.physGrain:
+            fields['r2']            = self.r2
+            fields['dr2_dt']        = self.dr2_dt
+        if 'DIP' in self.output_list:
+            intPhi, intPhi_c        = self.update_DIP()
+            fields['DIP']           = np.stack((intPhi, dH, self.dHtot), axis = 1)
+            fields['DIPc']          = intPhi_c
+        if 'BCO' in self.output_list:
+            fields['BCO']           = self.update_BCO()
+
+        write_ensemble_hdf5(f4, self.WTracker, nWrite, mtime, fields, self.valid)
+
+    def update_DIP(self):
+        '''
+        depth-integrated porosity of each column (see FirnDensityNoSpin.update_DIP)
+        '''
+        phi         = 1 - self.rho / RHO_I  # total porosity
+        phi[phi <= 0] = 1e-16
+        intPhi_c    = np.cumsum(phi * self.dz * self.valid, axis = 1)
+        intPhi      = intPhi_c[np.arange(len(self.nz)), self.nz - 1]
+
+        return intPhi, intPhi_c
+
+    def update_BCO(self):
+        '''
+        bubble close-off and lock-in age and depth of each column (see FirnDensityNoSpin.update_BCO);
+        columns that do not reach all of the densities get -9999
+        '''
+        bcoMartRho  = 1 / (1 / (917.0) + self.T10m * 6.95E-7 - 4.3e-5)
+        LIZMartRho  = bcoMartRho - 14.0
+
+        def first(values, reached):
+            return np.min(np.where(reached & self.valid, values, np.inf), axis = 1)
+
+        BCO = np.stack((
+            first(self.age, self.rho >= bcoMartRho) / S_PER_YEAR,
+            first(self.z, self.rho >= bcoMartRho),
+            first(self.age, self.rho >= 830.0) / S_PER_YEAR,
+            first(self.z, self.rho >= 830.0),
+            first(self.age, self.rho > LIZMartRho) / S_PER_YEAR,
+            first(self.z, self.rho >= LIZMartRho),
+            first(self.age, self.rho >= RHO_2) / S_PER_YEAR,
+            first(self.z, self.rho >= RHO_2)), axis = 1)
+        BCO[~np.all(np.isfinite(BCO), axis = 1)] = -9999
+
+        return BCO
+
+if __name__ == '__main__':
+
+    resultsFile = sys.argv[1]
+    configNames = sys.argv[2:]
+
+    tic = time.time()
+    for configName in configNames: # spin up any column that does not have a spin file yet (see spincache.py)
+        with open(configName, 'r') as f:
+            c = json.load(f)
+        spin_up(c)
+
+    ens = FirnEnsemble(configNames, resultsFile)
+    ens.time_evolve()
+    print('run time =' , time.time()-tic , 'seconds')
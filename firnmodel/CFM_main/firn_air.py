@@ -13,6 +13,15 @@ class FirnAir:
 	def __init__(self,air_config,input_year_gas,z,modeltime,Tz, rho, dz, gaschoice):
 		'''
 		Initialize Firn Air class
+
+		One instance transports all of the gases of a column. Everything but the
+		gas constants (gam_x, deltaM, omega) is the same for every gas, so the
+		porosity, diffusivity profile, advection and grid geometry are found once
+		per time step and the gases are solved together as a batch of tridiagonal
+		systems. The gas constants are (gases x 1) arrays and the gas profiles
+		(self.Gz) are (gases x nodes) arrays.
+
+		:param gaschoice: name of a gas, or a list of gases
 		'''
 		# with open(AirconfigName, "r") as f:
 		# 	jsonString 		= f.read()
@@ -22,18 +31,20 @@ class FirnAir:
 		# nogas=len(gaschoice_all)
 
 		self.cg = air_config
+		self.gaschoice 		= [gaschoice] if isinstance(gaschoice, str) else list(gaschoice)
 		# self.gaschoice = self.cg["gaschoice"]
 		# input_gas, input_year_gas = read_input(os.path.join(self.c['InputFileFolder'],self.c['InputFileNamebdot']))
 		input_gas 			= np.ones_like(input_year_gas)
 		Gsf			 		= interpolate.interp1d(input_year_gas,input_gas,'linear',fill_value='extrapolate')
 		self.Gs 			= Gsf(modeltime)
-		self.Gz				= self.Gs[0]*np.ones_like(z)
+		self.Gz				= self.Gs[0]*np.ones((len(self.gaschoice), len(z)))
 		self.Tz 			= Tz
 		self.z 				= z
 		self.rho 			= rho
 
 		# self.gam_x, self.M, self.deltaM, self.d_0, self.omega = gasses(self.cg['gaschoice'], Tz[0], P_0, M_AIR)
-		self.gam_x, self.M, self.deltaM, self.d_0, self.omega = gasses(gaschoice, Tz[0], P_0, M_AIR)
+		constants 			= [gasses(gas, Tz[0], P_0, M_AIR) for gas in self.gaschoice]
+		self.gam_x, self.M, self.deltaM, self.d_0, self.omega = [np.reshape(np.array(v, dtype = float), (-1, 1)) for v in zip(*constants)]
 
 		self.czd 			= self.cg['ConvectiveZoneDepth']
 		self.p_a 			= 1.0e5
@@ -85,15 +96,13 @@ class FirnAir:
 			pp 				= "/Users/maxstev/Documents/Grad_School/Research/FIRN/CFM/CommunityFirnModel/gasmodel/DataImport"
 			diffu_data 		= np.loadtxt(os.path.join(pp,'c_diffu_NEEM.txt'))
 			h 				= diffu_data[:,0]
-			diffu_full_data = self.gam_x*self.d_0*diffu_data[:,1]
-
-			diffu_full 		= np.interp(self.z,h,diffu_full_data)
+			diffu_full 		= self.gam_x*self.d_0*np.interp(self.z,h,diffu_data[:,1])
 		
 		diffu_full[diffu_full<0] = 1.e-40
 						
 		###### Add in high diffusivity in convective zone and low diffusivity below LIZ		
 		### Convective zone###
-		d_eddy 			= np.zeros(np.size(diffu_full))
+		d_eddy 			= np.zeros(np.shape(diffu_full))
 		ind 			= np.nonzero(self.z<self.czd)
 		d_eddy_surf		= 2.426405E-5 #Kawamura, 2006
 		# H_scale 		= czd
@@ -109,8 +118,8 @@ class FirnAir:
 
 			# diffu_full[ind4] = diffu_full[ind4]-diffu_full[ind4[-1]] #re-scale diffusivity so it becomes zero at LIZ
 
-			d_eddy[ind3] 	= diffu_full[ind3] 		# set eddy diffusivity in LIZ equal to diffusivity at LIZ
-			diffu_full[ind]	= 1e-40 				# set molecular diffusivity equal to zero for "main" diffusivity after LIZ - eddy diffusivity term drives diffusion below
+			d_eddy[..., ind3] 	= diffu_full[..., ind3] 		# set eddy diffusivity in LIZ equal to diffusivity at LIZ
+			diffu_full[..., ind]	= 1e-40 				# set molecular diffusivity equal to zero for "main" diffusivity after LIZ - eddy diffusivity term drives diffusion below
 			d_eddy 			= d_eddy + d_eddy_up #make eddy diffusivity vector have convective and lock-in zone values
 			
 		else:
@@ -149,19 +158,21 @@ class FirnAir:
 
 
 	def firn_air_diffusion(self,AirParams,iii):
+		'''
+		one time step of the transport of all of the gases
+
+		:return Gz: dictionary of gas -> gas profile
+		:return diffu: diffusivity profile of each gas (gases x nodes)
+		:return w_p: advection rate of the air
+		'''
 
 		for k,v in list(AirParams.items()):
 			setattr(self,k,v)
 
-		nz_P 		= len(self.z)
-		nz_fv 		= nz_P - 2
 		nt 			= 1
-
-		z_edges1 = self.z[0:-1] + np.diff(self.z) / 2
-		z_edges = np.concatenate(([self.z[0]], z_edges1, [self.z[-1]]))
-		z_P_vec 	= self.z
+		geom 		= self.geometry # GridGeometry of the column, shared by all of the gases
 		# phi_s 	= self.Ts[iii]
-		phi_s 		= self.Gz[0]
+		phi_s 		= self.Gz[:, 0]
 		phi_0 		= self.Gz
 
 		# K_ice 	= 9.828 * np.exp(-0.0057 * phi_0)
@@ -228,13 +239,13 @@ class FirnAir:
 		# print(self.air_pressure[msk-10:msk+1])
 		# print(volfrac[msk-10:msk+1])
 		# print(self.z[msk-10:msk+1])
-		self.Gz, w_p = transient_solve_TR(z_edges, z_P_vec, nt, self.dt, self.diffu, phi_0, nz_P, nz_fv, phi_s, self.rho, airdict)
-		self.Gz = np.concatenate(([self.Gs[iii]], self.Gz[:-1]))
+		self.Gz, w_p = transient_solve_TR(geom, nt, self.dt, self.diffu, phi_0, phi_s, self.rho, airdict)
+		self.Gz = np.concatenate((self.Gs[iii] * np.ones((len(self.gaschoice), 1)), self.Gz[:, :-1]), axis = 1)
 		# if ((iii>500) & (iii<510)):
 		# 	print(iii)
 		# 	bb=((self.z>60) & (self.z<80))
 		# 	print('w_p',w_p[bb])
-		return self.Gz, self.diffu, w_p
+		return dict(zip(self.gaschoice, self.Gz)), self.diffu, w_p
 
 def gasses(gaschoice, T, p_a, M_air):
 	
@@ -245,7 +256,7 @@ def gasses(gaschoice, T, p_a, M_air):
 	D_ref_CO2 = 5.75E-10*T**1.81*(101325/p_a) #Christo Thesis, appendix A3
 	print('gas choice is ', gaschoice)
 	
-	if gaschoice == ['CO2']:
+	if gaschoice in ('CO2', ['CO2']):
 		gam_x = 1. #free-air diffusivity relative to CO2. Unitless (gamma in Buizert thesis, page 13).
 		M = 44.01e-3 # molecular mass, kg/mol
 		decay = 0.
@@ -266,7 +277,7 @@ def gasses(gaschoice, T, p_a, M_air):
 		#    #conc1=conc1[0:1996,:] # May or may not need this to get time to work...
 		
 			
-	elif gaschoice == ['CH4']:
+	elif gaschoice in ('CH4', ['CH4']):
 		gam_x = 1.367
 		M = 16.04e-3
 		decay = 0.
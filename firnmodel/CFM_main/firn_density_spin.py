@@ -1,13 +1,15 @@
 from diffusion import heatDiff
 from diffusion import isoDiff
 from hl_analytic import hl_analytic
-from reader import read_input
+from reader import read_forcing, SpinState
 from writer import write_spin_hdf5
 from physics import *
+from kernels import select_backend
 from constants import *
 import numpy as np
 import csv
 import json
+import copy
 import sys
 import math
 from shutil import rmtree
@@ -16,6 +18,8 @@ import shutil
 import time
 import h5py
 from regrid import *
+from column import ColumnField, init_column
+from steadystate import steady_spin
 
 class FirnDensitySpin:
     '''
@@ -53,32 +57,47 @@ class FirnDensitySpin:
                 (unit: ???, type: array of floats)
     :returns D_surf: diffusivity tracker
                 (unit: ???, type: array of floats)
+
+    The per-node fields (age, dz, rho, Tz, LWC, mass, gridtrack) are stored in a
+    preallocated ColumnState (self.col; see column.py)
     '''
 
-    def __init__(self, configName):
+    ### per-node fields that are kept in the column state
+    age         = ColumnField('age')
+    dz          = ColumnField('dz')
+    rho         = ColumnField('rho')
+    Tz          = ColumnField('Tz')
+    LWC         = ColumnField('LWC')
+    mass        = ColumnField('mass')
+    gridtrack   = ColumnField('gridtrack')
+
+    def __init__(self, configName, inputs=None):
         '''
         Sets up the initial spatial grid, time grid, accumulation rate, age, density, mass, stress, and temperature of the model run
-        :param configName: name of json config file containing model configurations
+        :param configName: name of json config file containing model configurations (or the config dictionary itself)
+        :param inputs: forcing given in memory instead of the input files (see reader.read_forcing)
         '''
 
         ### load in json config file and parses the user inputs to a dictionary
         self.spin=False
-        with open(configName, "r") as f:
-            jsonString     = f.read()
-            self.c         = json.loads(jsonString)
+        if isinstance(configName, dict):
+            self.c     = copy.deepcopy(configName)
+        else:
+            with open(configName, "r") as f:
+                jsonString     = f.read()
+                self.c         = json.loads(jsonString)
+
+        if 'spinPhysRho' in self.c: # spin up with other physics than the main run (e.g. Arthern2010S for Arthern2010T)
+            self.c['physRho'] = self.c['spinPhysRho']
 
         print('Spin run started')
         print("physics are", self.c['physRho'])
 
-        ### create directory to store results
-        if not os.path.exists(self.c['resultsFolder']):
-            os.makedirs(self.c['resultsFolder'])
-
         ############################
         ##### load input files #####
         ############################
         ### temperature
-        input_temp, input_year_temp = read_input(os.path.join(self.c['InputFileFolder'],self.c['InputFileNameTemp']))
+        input_temp, input_year_temp = read_forcing(self.c, 'Temp', inputs)
         if input_temp[0] < 0.0:
             input_temp                 = input_temp + K_TO_C
         #self.temp0                     = np.mean(input_temp) #Make sure that this is what we want!
@@ -87,7 +106,7 @@ class FirnDensitySpin:
 
         
         ### accumulation rate
-        input_bdot, input_year_bdot = read_input(os.path.join(self.c['InputFileFolder'],self.c['InputFileNamebdot']))
+        input_bdot, input_year_bdot = read_forcing(self.c, 'bdot', inputs)
         #self.bdot0                     = np.mean(input_bdot) #Make sure that this is what we want!
         self.bdot0                     = input_bdot[0]
         
@@ -141,9 +160,41 @@ class FirnDensitySpin:
         self.dt     = S_PER_YEAR / self.c['stpsPerYearSpin']
         self.stp     = int(self.years*S_PER_YEAR/self.dt)
         self.t         =  1.0 / self.c['stpsPerYearSpin'] # years per time step
+        try:
+            self.heatSubSteps = int(self.c['heatSubSteps']) # implicit heat diffusion sub-steps per time step
+        except:
+            self.heatSubSteps = 1
+        self.kernelBackend = select_backend(self.c) # 'numba' for the compiled kernels of kernels.py
 
         
         print('Spin time is ', self.years, 'years')
+
+        ### solver for the spin up: 'timestep' (default) or 'steady' (see steadystate.py)
+        try:
+            self.spinUpSolver   = self.c['spinUpSolver']
+        except:
+            self.spinUpSolver   = 'timestep'
+        try:
+            self.yearSpinPolish = self.c['yearSpinPolish'] # years of time stepping after the steady solver
+        except:
+            self.yearSpinPolish = 0
+
+        ### stop the spin up early once it has converged (see verifySpin)
+        self.spinTol        = self.c.get('spinTol') # largest relative change of DIP, BCO and density between checks
+        if self.spinTol is not None:
+            if 'spinCheckInt' not in self.c:
+                raise ValueError('spinTol is set, but spinCheckInt (years between convergence checks) is not')
+            self.spinCheckStp   = max(int(self.c['spinCheckInt'] * self.c['stpsPerYearSpin']), 1) # steps between checks
+        self.spinCheck      = None
+        self.spinResidual   = None
+
+        ### the final column is kept as self.spinState; with "writeSpinFile": false it is not written to
+        ### the spin file, for a main run in the same process (the spin cache always needs the file)
+        try:
+            self.writeSpinFile  = bool(self.c['writeSpinFile']) or ('spinCacheFolder' in self.c)
+        except:
+            self.writeSpinFile  = True
+        self.spinState      = None
         ############################
         ### Initial and boundary conditions
         ############################
@@ -166,7 +217,7 @@ class FirnDensitySpin:
         ### Surface isotope values for each time step
         if bool(self.c['isoDiff']):
             try:
-                input_iso, input_year_iso = read_input(self.c['InputFileNameIso'])
+                input_iso, input_year_iso = read_forcing(self.c, 'Iso', inputs)
                 del_s0     = input_iso[0]
             except:
                 print('No external file for surface isotope values found, but you specified in the config file that isotope diffusion is on. The model will generate its own synthetic isotope data for you.')
@@ -211,8 +262,8 @@ class FirnDensitySpin:
         else:
             self.r2 = None
 
-        ### "temperature history" if using Morris physics
-        if self.c['physRho']=='Morris2014':
+        ### "temperature history" if the physics need it (e.g. Morris)
+        if 'Hx' in physics_spec(self.c['physRho'])['state']:
             # initial temperature history function (units seconds)
             self.Hx     = np.exp(-110.0e3/(R*init_Tz))*(self.age+self.dt)
             self.THist     = True
@@ -221,6 +272,12 @@ class FirnDensitySpin:
 
         self.LWC = np.zeros_like(self.z)
         self.MELT = bool(self.c['MELT'])
+
+        ### column state: preallocated storage for the per-node fields
+        colfields = ['age', 'dz', 'rho', 'Tz', 'LWC', 'mass']
+        if self.doublegrid:
+            colfields.append('gridtrack')
+        init_column(self, colfields)
     ############################
     ##### END INIT #############
     ############################
@@ -231,71 +288,29 @@ class FirnDensitySpin:
         based on the user specified number of timesteps in the model run. Updates the firn density using a user specified 
         '''
         self.steps = 1 / self.t # this is time steps per year
+        self.densification = DensificationEngine(self) # densification physics chosen by physRho
+
+        if self.spinUpSolver == 'steady' and steady_spin(self):
+            ### the column is already in its steady state; time step it only for the polish
+            stpPolish = min(int(self.yearSpinPolish * S_PER_YEAR / self.dt), self.stp)
+            if stpPolish == 0:
+                self.write_spin(self.stp - 1)
+                return
+            self.stp = stpPolish
 
         ####################################
         ##### START TIME-STEPPING LOOP #####
         ####################################
 
         for iii in range(self.stp):
-            ### create dictionary of the parameters that get passed to physics
-            PhysParams = {
-                'iii':          iii,
-                'steps':        self.steps,
-                'gridLen':      self.gridLen,
-                'bdotSec':      self.bdotSec,
-                'bdot_mean':    self.bdot_mean,
-                'bdot_type':    self.c['bdot_type'],
-                'Tz':           self.Tz,
-                'T_mean':       self.T_mean,
-                'T10m':         self.T10m,
-                'rho':          self.rho,
-                'mass':         self.mass,
-                'sigma':        self.sigma,
-                'dt':           self.dt,
-                'Ts':           self.Ts,
-                'r2':           self.r2,
-                'age':          self.age,
-                'physGrain':    bool(self.c['physGrain']),
-                'calcGrainSize': bool(self.c['calcGrainSize']),
-                'r2s0':            self.c['r2s0'],
-                'GrGrowPhysics':self.c['GrGrowPhysics'], #TODO: had to uncomment this to make the model run
-                'z':            self.z,
-                'rhos0':        self.rhos0[iii],
-                'dz':           self.dz,
-                'LWC':          self.LWC,
-                'MELT':         self.MELT,
-            }
+            ### densification (and grain growth rate) from the column at the start of the step
+            drho_dt = self.densification.compute(iii)
 
-            if self.THist:
-                PhysParams['Hx'] = self.Hx
-
-            ### choose densification-physics based on user input
-            physicsd = {
-                'HLdynamic':            FirnPhysics(PhysParams).HL_dynamic,
-                'HLSigfus':             FirnPhysics(PhysParams).HL_Sigfus,
-                'Barnola1991':          FirnPhysics(PhysParams).Barnola_1991,
-                'Li2004':               FirnPhysics(PhysParams).Li_2004,
-                'Li2011':               FirnPhysics(PhysParams).Li_2011,
-                'Ligtenberg2011':       FirnPhysics(PhysParams).Ligtenberg_2011,
-                'Arthern2010S':         FirnPhysics(PhysParams).Arthern_2010S,
-                'Simonsen2013':         FirnPhysics(PhysParams).Simonsen_2013,
-                'Morris2014':           FirnPhysics(PhysParams).Morris_HL_2014,
-                'Helsen2008':           FirnPhysics(PhysParams).Helsen_2008,
-                'Arthern2010T':         FirnPhysics(PhysParams).Arthern_2010T,
-                'Goujon2003':           FirnPhysics(PhysParams).Goujon_2003,
-                'KuipersMunneke2015':   FirnPhysics(PhysParams).KuipersMunneke_2015,
-                'Crocus':               FirnPhysics(PhysParams).Crocus
-            }
-
-            RD         = physicsd[self.c['physRho']]()
-            drho_dt = RD['drho_dt']
-
-            ### update density and age of firn
-            self.age = np.concatenate(([0], self.age[:-1])) + self.dt
+            ### update density of firn (age is updated when the new box is added)
             self.rho = self.rho + self.dt * drho_dt
             
             if self.THist:
-                self.Hx = FirnPhysics(PhysParams).THistory()
+                self.Hx = self.densification.THistory()
 
             ### update temperature grid and isotope grid if user specifies
             if bool(self.c['heatDiff']):
@@ -304,7 +319,8 @@ class FirnDensitySpin:
             if bool(self.c['isoDiff']):
                 self.del_z     = isoDiff(self,iii)
 
-            self.T_mean     = np.mean(self.Tz[self.z<50])
+            if 'T_mean' in self.densification.fields:
+                self.T_mean = np.mean(self.Tz[self.z<50])
 
             if bool(self.c['strain']): # consider additional change in box height due to longitudinal strain rate
                 self.dz     = ((-self.du_dx)*self.dt + 1)*self.dz 
@@ -314,63 +330,111 @@ class FirnDensitySpin:
             dzNew             = self.bdotSec[iii] * RHO_I / self.rhos0[iii] * S_PER_YEAR
             self.dz         = self.mass / self.rho * self.dx
             self.dz_old     = self.dz    
-            self.dz         = np.concatenate(([dzNew], self.dz[:-1]))      
+            massNew         = self.bdotSec[iii] * S_PER_YEAR * RHO_I
+            ### new box on top, bottom box drops off (gridtrack is only in the column if doublegrid is on)
+            self.col.push(age=0, dz=dzNew, rho=self.rhos0[iii], LWC=0, Tz=self.Ts[iii], mass=massNew, gridtrack=1)
+            self.age        += self.dt
             self.z             = self.dz.cumsum(axis = 0)
             self.z             = np.concatenate(([0], self.z[:-1]))
-            self.rho          = np.concatenate(([self.rhos0[iii]], self.rho[:-1]))
-            self.Tz         = np.concatenate(([self.Ts[iii]], self.Tz[:-1]))
-            massNew         = self.bdotSec[iii] * S_PER_YEAR * RHO_I
-            self.mass         = np.concatenate(([massNew], self.mass[:-1]))
-            self.sigma         = self.mass * self.dx * GRAVITY
-            self.sigma         = self.sigma.cumsum(axis = 0)
+            if 'sigma' in self.densification.fields:
+                self.sigma     = self.mass * self.dx * GRAVITY
+                self.sigma     = self.sigma.cumsum(axis = 0)
             self.mass_sum      = self.mass.cumsum(axis = 0)
-            self.bdot_mean     = (np.concatenate(([self.mass_sum[0] / (RHO_I * S_PER_YEAR)], self.mass_sum[1:] * self.t / (self.age[1:] * RHO_I))))*self.c['stpsPerYear']*S_PER_YEAR
+            if 'bdot_mean' in self.densification.fields:
+                self.bdot_mean = (np.concatenate(([self.mass_sum[0] / (RHO_I * S_PER_YEAR)], self.mass_sum[1:] * self.t / (self.age[1:] * RHO_I))))*self.c['stpsPerYear']*S_PER_YEAR
                 
             # update grain radius
             if bool(self.c['physGrain']):
-                self.r2, self.dr2_dt     = FirnPhysics(PhysParams).grainGrowth()
+                self.r2, self.dr2_dt     = self.densification.growGrains()
 
             if self.doublegrid:
-                self.gridtrack = np.concatenate(([1],self.gridtrack[:-1]))
                 if self.gridtrack[-1]==2:
                     self.dz, self.z, self.rho, self.Tz, self.mass, self.sigma, self. mass_sum, self.age, self.bdot_mean, self.LWC, self.gridtrack, self.r2 = regrid(self)
 
+            ### check the convergence every spinCheckInt years
+            converged = (self.spinTol is not None) and ((iii + 1) % self.spinCheckStp == 0) and self.verifySpin()
+
             # write results at the end of the time evolution
-            if (iii == (self.stp - 1)):
-
-                rho_time        = np.concatenate(([self.t * iii + 1], self.rho))
-                Tz_time         = np.concatenate(([self.t * iii + 1], self.Tz))
-                age_time        = np.concatenate(([self.t * iii + 1], self.age))
-                z_time          = np.concatenate(([self.t * iii + 1], self.z))
-
-                if bool(self.c['physGrain']):
-                    r2_time     = np.concatenate(([self.t * iii + 1], self.r2))
-                else:
-                    r2_time     = None
-                if self.THist:                
-                    Hx_time     = np.concatenate(([self.t * iii + 1], self.Hx))
-                else:
-                    Hx_time     = None
-                if bool(self.c['isoDiff']):
-                    iso_time    = np.concatenate(([self.t * iii + 1], self.del_z))
-                else:
-                    iso_time    = None
-
-                if self.doublegrid:
-                    grid_time    = np.concatenate(([self.t * iii + 1], self.gridtrack))
-                else:
-                    grid_time     = None
-
-                write_spin_hdf5(self.c['resultsFolder'], self.c['spinFileName'], bool(self.c['physGrain']), self.THist, bool(self.c['isoDiff']), self.doublegrid, rho_time, Tz_time, age_time, z_time, r2_time, Hx_time, iso_time, grid_time)
+            if (iii == (self.stp - 1)) or converged:
+                self.write_spin(iii)
+
+            if converged:
+                print('Spin up converged after', self.t * (iii + 1), 'years; residual is', self.spinResidual)
+                break
 
             ####################################
             ##### END TIME-STEPPING LOOP #####
             ####################################
             
 
-    def verifySpin():
-      # read data
-      # evolve one time step
-      # check if dip remains constant
-      # if not, redo spin
-      return True
+    def write_spin(self, iii):
+        '''
+        Keep the spin-up column as self.spinState and write it to the spin file
+
+        :param iii: time step at which the column is written
+        '''
+
+        rho_time        = np.concatenate(([self.t * iii + 1], self.rho))
+        Tz_time         = np.concatenate(([self.t * iii + 1], self.Tz))
+        age_time        = np.concatenate(([self.t * iii + 1], self.age))
+        z_time          = np.concatenate(([self.t * iii + 1], self.z))
+
+        if bool(self.c['physGrain']):
+            r2_time     = np.concatenate(([self.t * iii + 1], self.r2))
+        else:
+            r2_time     = None
+        if self.THist:                
+            Hx_time     = np.concatenate(([self.t * iii + 1], self.Hx))
+        else:
+            Hx_time     = None
+        if bool(self.c['isoDiff']):
+            iso_time    = np.concatenate(([self.t * iii + 1], self.del_z))
+        else:
+            iso_time    = None
+
+        if self.doublegrid:
+            grid_time    = np.concatenate(([self.t * iii + 1], self.gridtrack))
+        else:
+            grid_time     = None
+        if self.spinResidual is not None:
+            residual_time = np.array([self.t * iii + 1, self.spinResidual])
+        else:
+            residual_time = None
+
+        self.spinState = SpinState(z_time, age_time, rho_time, Tz_time, r2 = r2_time, Hx = Hx_time, iso = iso_time, grid = grid_time, residual = residual_time)
+        if self.writeSpinFile:
+            ### create directory to store results
+            if not os.path.exists(self.c['resultsFolder']):
+                os.makedirs(self.c['resultsFolder'])
+            write_spin_hdf5(self.c['resultsFolder'], self.c['spinFileName'], bool(self.c['physGrain']), self.THist, bool(self.c['isoDiff']), self.doublegrid, rho_time, Tz_time, age_time, z_time, r2_time, Hx_time, iso_time, grid_time, residual_time)
+
+    def verifySpin(self):
+        '''
+        Checks if the spin up has converged. The depth-integrated porosity (DIP), the
+        close-off depth (815 kg m^-3) and the density profile are compared with the
+        previous check; the residual is the largest relative change of the three.
+
+        :return converged: True if the residual is smaller than spinTol
+        '''
+
+        phi             = 1 - self.rho / RHO_I  # total porosity
+        phi[phi <= 0]   = 1e-16
+        intPhi          = np.sum(phi * self.dz)  # depth-integrated porosity
+        if np.any(self.rho >= RHO_2):
+            bcoDep815   = np.min(self.z[self.rho >= RHO_2])
+        else:
+            bcoDep815   = np.nan # close-off is not in the column yet
+
+        previous        = self.spinCheck
+        self.spinCheck  = (intPhi, bcoDep815, self.z.copy(), self.rho.copy())
+        if previous is None:
+            return False
+
+        intPhi0, bcoDep0, z0, rho0 = previous
+        zz              = z0 <= self.z[-1] # only the depths that are in both profiles
+        rhoDiff         = np.max(np.abs(np.interp(z0[zz], self.z, self.rho) - rho0[zz])) / RHO_I
+        self.spinResidual = np.max([abs(intPhi - intPhi0) / intPhi0, abs(bcoDep815 - bcoDep0) / bcoDep0, rhoDiff])
+        if np.isnan(self.spinResidual):
+            self.spinResidual = np.inf
+
+        return self.spinResidual < self.spinTol
@@ -0,0 +1,139 @@
+from reader import read_forcing
+from constants import *
+import numpy as np
+import os
+import scipy.interpolate as interpolate
+
+class Forcing:
+    '''
+    Surface boundary conditions of a (main, i.e. not spin-up) model run: temperature,
+    accumulation, melt, isotopes and surface density, read from the input files and
+    interpolated to the model time.
+
+    The forcing does not depend on the densification physics, so one instance can be
+    shared by several columns that are run with the same .json (see multiphysics.py).
+    The arrays are only read by the model, never changed.
+    '''
+
+    def __init__(self, c, inputs=None):
+        '''
+        :param c: dictionary of the json config
+        :param inputs: forcing given in memory, dictionary of 'Temp', 'bdot', 'melt', 'Iso' or 'srho' -> (input_data, input_year);
+                       the rest of the forcing is read from the input files (see reader.read_forcing)
+        '''
+
+        ### get temperature and accumulation rate from input csv file
+        input_temp, input_year_temp = read_forcing(c, 'Temp', inputs)
+        if input_temp[0] < 0.0:
+            input_temp         = input_temp + K_TO_C
+        input_temp[input_temp>T_MELT] = T_MELT
+
+        input_bdot, input_year_bdot = read_forcing(c, 'bdot', inputs)
+
+        self.input_temp         = input_temp
+        self.input_year_temp    = input_year_temp
+        self.input_bdot         = input_bdot
+        self.input_year_bdot    = input_year_bdot
+
+        try:
+            if bool(c['MELT']):
+                input_snowmelt, input_year_snowmelt = read_forcing(c, 'melt', inputs)
+                self.MELT             = True
+                print("Melt is initialized")
+            else:
+                self.MELT             = False
+                print("No melt")
+                input_snowmelt         = None
+                input_year_snowmelt = None
+
+        except:
+            self.MELT                 = False
+            print("No melt; json does not include a melt field")
+            input_snowmelt             = None
+            input_year_snowmelt     = None
+
+        #####################
+        ### time ############
+        # year to start and end, from the input file. If inputs have different start/finish, take only the overlapping times
+        yr_start        = max(input_year_temp[0], input_year_bdot[0])   # start year
+        yr_end          = min(input_year_temp[-1], input_year_bdot[-1]) # end year
+
+        self.years      = np.ceil((yr_end - yr_start) * 1.0)
+        self.dt         = S_PER_YEAR / c['stpsPerYear']
+        self.stp        = int(self.years * S_PER_YEAR/self.dt)       # total number of time steps, as integer
+
+        # self.modeltime  = np.linspace(yr_start, yr_end, self.stp + 1)   # vector of time of each model step
+        self.modeltime  = np.linspace(yr_start, yr_end, self.stp)
+        self.t          = 1.0 / c['stpsPerYear']                   # years per time step
+        #####################
+
+        int_type            = c['int_type']
+        print('Climate interpolation method is %s' %int_type)
+
+        ### Temperature #####
+        Tsf                 = interpolate.interp1d(input_year_temp,input_temp,int_type,fill_value='extrapolate') # interpolation function
+        self.Ts             = Tsf(self.modeltime) # surface temperature interpolated to model time
+        if bool(c['SeasonalTcycle']): #impose seasonal temperature cycle of amplitude 'TAmp'
+            # self.Ts         = self.Ts + c['TAmp'] * (np.cos(2 * np.pi * np.linspace(0, self.years, self.stp)) + 0.3 * np.cos(4 * np.pi * np.linspace(0, self.years, self.stp))) # Orsi
+            self.Ts         = self.Ts - c['TAmp'] * (np.cos(2 * np.pi * np.linspace(0, self.years, self.stp))) # This is basic for Greenland (for Antarctica the it should be a plus instead of minus)
+        #####################
+
+        ### Accumulation ####
+        bsf                 = interpolate.interp1d(input_year_bdot,input_bdot,int_type,fill_value='extrapolate') # interpolation function
+        self.bdot             = bsf(self.modeltime)
+        self.bdotSec           = self.bdot / S_PER_YEAR / c['stpsPerYear'] # accumulation for each time step (meters i.e. per second)
+        self.iceout         = np.mean(self.bdot) # this is the rate of ice flow advecting out of the column, units m I.E. per year.
+        #####################
+
+        ### Melt ############
+        if self.MELT:
+            ssf                 = interpolate.interp1d(input_year_snowmelt,input_snowmelt,int_type,fill_value='extrapolate')
+            self.snowmelt         = ssf(self.modeltime)
+            self.snowmeltSec    = self.snowmelt / S_PER_YEAR / c['stpsPerYear'] # melt for each time step (meters i.e. per second)
+        #####################
+
+        ### Isotopes ########
+        if bool(c['isoDiff']):
+            try:
+                input_iso, input_year_iso = read_forcing(c, 'Iso', inputs)
+                self.del_s      = np.interp(self.modeltime, input_year_iso, input_iso)
+            except:
+                print('No external file for surface isotope values found, but you specified in the config file that isotope diffusion is on. The model will generate its own synthetic isotope data for you.')
+                ar1             = 0.9   # red noise memory coefficient
+                std_rednoise     = 2    # red noise standard deviation
+                self.del_s         = std_rednoise*np.random.randn(self.stp)    # white noise
+
+                for x in range(1,self.stp):
+                    self.del_s[x] = self.del_s[x-1]*ar1 + np.random.randn()  # create red noise from white
+
+                self.del_s         = self.del_s - 50
+                #impose seasonal isotope cycle
+                # self.del_s     = self.del_s + 5 * (np.cos(2 * np.pi * np.linspace(0, self.years, self.stp )) + 0.3 * np.cos(4 * np.pi * np.linspace(0, self.years, self.stp )))
+        #####################
+
+        ### Surface Density #
+        try:
+            if bool(c['variable_srho']):
+                if c['srho_type']=='userinput':
+                    input_srho, input_year_srho = read_forcing(c, 'srho', inputs)
+                    self.rhos0      = np.interp(self.modeltime, input_year_srho, input_srho)
+                elif c['srho_type']=='param':
+                    print('srho_type is param')
+                    self.rhos0        = 481.0 + 4.834 * (self.Ts - T_MELT) # Kuipers Munneke, 2015
+                elif c['srho_type']=='noise':
+                    rho_stdv         = 100 # the standard deviation of the surface density (I made up 25)
+                    self.rhos0      = np.random.normal(c['rhos0'], rho_stdv, self.stp)
+                    self.rhos0[self.rhos0>600]=600
+                    self.rhos0[self.rhos0<300]=300
+                elif c['srho_type']=='reeh':
+                    print('srho_type is reeh')
+                    T_f1 = (self.Ts - T_MELT)
+                    self.rhos0 = 625.0 + (18.7*T_f1) + (0.293*(T_f1**2))
+
+            else:
+                self.rhos0      = c['rhos0'] * np.ones(self.stp)       # density at surface
+
+        except:
+            print("you should alter the json to include all variable surface rho fields")
+            self.rhos0          = c['rhos0'] * np.ones(self.stp)       # density at surface
+        #####################
@@ -0,0 +1,244 @@
+from constants import *
+import numpy as np
+
+try:
+    import numba
+    NUMBA = True
+except ImportError:
+    NUMBA = False
+
+'''
+Optional compiled kernels for the per-node work of a time step.
+
+The NumPy code of the physics, the diffusion solves and the bucket melt scheme
+makes many small temporary arrays (masks, Arrhenius terms, coefficients) on
+columns of a few thousand nodes, where allocation and interpreter overhead cost
+more than the arithmetic. The kernels below do the same work in single loops
+compiled with Numba.
+
+Set "kernelBackend": "numba" in the .json to use them (default "numpy"). If
+Numba is not installed, the run falls back to the NumPy code. The kernels follow
+the operations of the NumPy code in the same order, so they give the same
+results to within the last bit of the exponentials; test_kernels.py checks each
+kernel against the NumPy code.
+'''
+
+BACKENDS = ['numpy', 'numba']
+
+def jit(f):
+    '''
+    compile f with Numba if it is installed (the plain Python function is kept otherwise)
+    '''
+    if NUMBA:
+        return numba.njit(cache = True)(f)
+    return f
+
+def select_backend(c):
+    '''
+    :param c: dictionary of the json config
+
+    :return backend: 'numpy' or 'numba'
+    '''
+    try:
+        backend = c['kernelBackend']
+    except:
+        backend = 'numpy'
+    if backend not in BACKENDS:
+        raise ValueError('kernelBackend = %s is not a valid option; options are: %s' %(backend, ', '.join(BACKENDS)))
+    if backend == 'numba' and not NUMBA:
+        print('kernelBackend is numba, but numba is not installed; using numpy')
+        backend = 'numpy'
+    return backend
+
+###################################
+### densification ###
+###################################
+
+@jit
+def hl_rate(rho, Tz, A, out):
+    '''
+    Herron and Langway (1980) densification (FirnPhysics.HL_dynamic)
+
+    :param A: accumulation rate at each node, m W.E. per year
+    :param out: drho_dt, zeroed
+    '''
+    Q1  = 10160.0
+    Q2  = 21400.0
+    k1  = 11.0
+    k2  = 575.0
+    aHL = 1.0
+    bHL = 0.5
+    for i in range(rho.shape[0]):
+        if rho[i] < RHO_1:
+            out[i] = k1 * np.exp(-Q1 / (R * Tz[i])) * (RHO_I_MGM - rho[i] / 1000) * A[i]**aHL * 1000 / S_PER_YEAR
+        elif rho[i] >= RHO_1:
+            out[i] = k2 * np.exp(-Q2 / (R * Tz[i])) * (RHO_I_MGM - rho[i] / 1000) * A[i]**bHL * 1000 / S_PER_YEAR
+    return out
+
+@jit
+def arthern_rate(rho, Tz, T10m, A, M0a, M0b, M1a, M1b, withM, capIce, out):
+    '''
+    Arthern et al. (2010) densification and its recalibrations with the factors
+    M = max(0.25, Ma - Mb * log(A)): Ligtenberg et al. (2011) and Kuipers Munneke et al. (2015)
+
+    :param A: accumulation rate at each node, kg m^-2 per year
+    :param withM: use the M factors (False for Arthern2010S)
+    :param capIce: no densification at or above the ice density
+    :param out: drho_dt, zeroed
+    '''
+    ar1 = 0.07
+    ar2 = 0.03
+    Ec  = 60.0e3
+    Eg  = 42.4e3
+    EgT = Eg / (R * T10m)
+    for i in range(rho.shape[0]):
+        if rho[i] < RHO_1:
+            M = 1.0
+            if withM:
+                M = M0a - M0b * np.log(A[i])
+                if M < 0.25:
+                    M = 0.25
+            out[i] = (RHO_I - rho[i]) * M * ar1 * A[i] * GRAVITY * np.exp(-Ec / (R * Tz[i]) + EgT) / S_PER_YEAR
+        elif rho[i] >= RHO_1:
+            M = 1.0
+            if withM:
+                M = M1a - M1b * np.log(A[i])
+                if M < 0.25:
+                    M = 0.25
+            out[i] = (RHO_I - rho[i]) * M * ar2 * A[i] * GRAVITY * np.exp(-Ec / (R * Tz[i]) + EgT) / S_PER_YEAR
+        if capIce and rho[i] >= RHO_I:
+            out[i] = 0.0
+    return out
+
+@jit
+def crocus_rate(rho, Tz, sigma, out):
+    '''
+    Crocus densification (FirnPhysics.Crocus)
+    '''
+    f1      = 1.0
+    f2      = 4.0
+    nu_0    = 7.62237e6
+    a_n     = 0.1
+    b_n     = 0.023
+    c_n     = 250
+    for i in range(rho.shape[0]):
+        if rho[i] >= RHO_I:
+            out[i] = 0.0
+        else:
+            viscosity = f1 * f2 * nu_0 * rho[i] / c_n * np.exp(a_n * (273.15 - Tz[i]) + b_n * rho[i])
+            out[i] = rho[i] * sigma[i] / viscosity
+    return out
+
+###################################
+### diffusion ###
+###################################
+
+@jit
+def gtsv(dl, d, du, b):
+    '''
+    tridiagonal solve with partial pivoting, in the order of LAPACK gtsv/gttrf.
+    dl[i] is the sub-diagonal of row i+1; all of the arrays are overwritten.
+
+    :return b: the solution
+    '''
+    n = d.shape[0]
+    for i in range(n - 1):
+        if abs(d[i]) >= abs(dl[i]): # no row interchange
+            fact        = dl[i] / d[i]
+            d[i+1]      = d[i+1] - fact * du[i]
+            b[i+1]      = b[i+1] - fact * b[i]
+            dl[i]       = 0.0
+        else: # interchange rows i and i+1
+            fact        = d[i] / dl[i]
+            d[i]        = dl[i]
+            temp        = d[i+1]
+            d[i+1]      = du[i] - fact * temp
+            if i < n - 2:
+                dl[i]       = du[i+1]
+                du[i+1]     = -fact * dl[i]
+            else:
+                dl[i]       = 0.0
+            du[i]       = temp
+            temp        = b[i]
+            b[i]        = b[i+1]
+            b[i+1]      = temp - fact * b[i+1]
+    b[n-1] = b[n-1] / d[n-1]
+    if n > 1:
+        b[n-2] = (b[n-2] - du[n-2] * b[n-1]) / d[n-2]
+    for i in range(n - 3, -1, -1):
+        b[i] = (b[i] - du[i] * b[i+1] - dl[i] * b[i+2]) / d[i]
+    return b
+
+@jit
+def diffusion_solve(dZ, dZ_u, dZ_d, f_u, f_d, g_u, g_d, Gamma_P, tot_rho, phi_0, phi_s, dt, nt):
+    '''
+    transient_solve_TR for heat and isotope diffusion: assembles the operator in one
+    pass and solves it nt times (see transient_solve_TR for the equations)
+
+    :return phi_t:
+    '''
+    n       = phi_0.shape[0]
+    dl      = np.empty(n - 1)
+    d       = np.empty(n)
+    du      = np.empty(n - 1)
+    a_P_0   = np.empty(n)
+    for i in range(n):
+        G_U         = Gamma_P[max(i - 1, 0)]
+        G_D         = Gamma_P[min(i + 1, n - 1)]
+        a_U         = (1 / (g_u[i] / Gamma_P[i] + f_u[i] / G_U)) / dZ_u[i]
+        a_D         = (1 / (g_d[i] / Gamma_P[i] + f_d[i] / G_D)) / dZ_d[i]
+        a_P_0[i]    = tot_rho[i] * dZ[i] / dt
+        a_P         = a_U + a_D + a_P_0[i]
+        if i == 0: # upper boundary
+            a_P     = 1.0
+            a_D     = 0.0
+        elif i == n - 1: # lower boundary (zero gradient)
+            a_P     = 1.0
+            a_U     = 1.0
+        d[i] = -a_P
+        if i > 0:
+            dl[i-1] = a_U
+        if i < n - 1:
+            du[i]   = a_D
+
+    phi_t = phi_0.copy()
+    for k in range(nt):
+        b = np.empty(n)
+        for i in range(n):
+            b[i] = -(a_P_0[i] * phi_t[i])
+        b[0]    = -phi_s
+        b[n-1]  = -0.0
+        phi_t   = gtsv(dl.copy(), d.copy(), du.copy(), b)
+    return phi_t
+
+###################################
+### melt ###
+###################################
+
+@jit
+def bucket_potentials(mass, dz, Tz):
+    '''
+    what each node of the bucket scheme (melt.percolation_bucket) could refreeze and hold
+
+    :return refreeze_mass_pot: mass of meltwater that the cold content can refreeze
+    :return irreducible_mass_pot: mass of irreducible water after that refreeze
+    :return maxLWC_pot: largest volume of water after that refreeze
+    '''
+    n                       = mass.shape[0]
+    refreeze_mass_pot       = np.empty(n)
+    irreducible_mass_pot    = np.empty(n)
+    maxLWC_pot              = np.empty(n)
+    for i in range(n):
+        cold_content            = CP_I * mass[i] * (T_MELT - Tz[i])
+        refreeze_mass_pot[i]    = cold_content / LF_I
+        rho_pot                 = (mass[i] + refreeze_mass_pot[i]) / dz[i]
+        porosity_pot            = 1 - rho_pot / RHO_I
+        porespace_vol_pot       = porosity_pot * dz[i]
+        Wmi                     = 0.057 * (RHO_I - rho_pot) / rho_pot + 0.017
+        Swi                     = Wmi / (1 - Wmi) * (rho_pot * RHO_I) / (1000 * (RHO_I - rho_pot))
+        maxpore                 = Swi * 2.0
+        maxLWC1_pot             = porespace_vol_pot * maxpore
+        maxLWC2_pot             = ((917.0 * dz[i]) - (mass[i] + refreeze_mass_pot[i])) / RHO_W_KGM
+        maxLWC_pot[i]           = min(maxLWC1_pot, maxLWC2_pot)
+        irreducible_mass_pot[i] = Swi * porespace_vol_pot * RHO_W_KGM
+    return refreeze_mass_pot, irreducible_mass_pot, maxLWC_pot
@@ -3,9 +3,36 @@ import os
 # from string import join
 from firn_density_spin import FirnDensitySpin
 from firn_density_nospin import FirnDensityNoSpin
+from multiphysics import run_multiphysics
+from spincache import spin_up
 import time
 import json
 
+def run_config(c, force=False):
+    '''
+    spin up and main run of a config, as python main.py does
+
+    :param c: dictionary of the json config ('physRho' can be a list, see multiphysics.py)
+    :param force: if True, always run the spin up (main.py -n)
+
+    :return resultsFile: path of the results file
+    '''
+    if isinstance(c['physRho'], list): # several models over the same forcing, see multiphysics.py
+        run_multiphysics(c, spin = force)
+
+    else:
+        if not spin_up(c, force = force): # spin file exists already or is in the spin cache (see spincache.py)
+            try:
+                os.remove(c['resultsFolder']+'/'+c['resultsFileName'])
+                print('deleted', c['resultsFolder']+'/'+c['resultsFileName'])
+            except:
+                pass
+    
+        firn = FirnDensityNoSpin(c)
+        firn.time_evolve()
+
+    return os.path.join(c['resultsFolder'], c['resultsFileName'])
+
 if __name__ == '__main__':
     if len(sys.argv) >= 2:
         configName = os.path.join(os.path.dirname(__file__), sys.argv[1])
@@ -29,20 +56,6 @@ if __name__ == '__main__':
     print("---------------------------------------------------------------------")
     print("")
     
-    if os.path.isfile(c['resultsFolder']+'/'+c['spinFileName']) and '-n' not in sys.argv:
-        print('Skipping Spin-Up run;', c['resultsFolder']+'/'+c['spinFileName'], 'exists already')
-        try:
-            os.remove(c['resultsFolder']+'/'+c['resultsFileName'])
-            print('deleted', c['resultsFolder']+'/'+c['resultsFileName'])
-        except:
-            pass
-
-    else:
-
-        firnS = FirnDensitySpin(configName)
-        firnS.time_evolve()
-    
-    firn = FirnDensityNoSpin(configName)
-    firn.time_evolve()
+    run_config(c, force = '-n' in sys.argv)
     
     print('run time =' , time.time()-tic , 'seconds')
@@ -1,4 +1,5 @@
 from constants import *
+from kernels import bucket_potentials
 import numpy as np
 
 def percolation_noliquid(self, iii):
@@ -198,38 +199,43 @@ def percolation_bucket(self, iii):
 	##########################################
 	### now working all with the new grid ####
 	##########################################
-	porosity 				= 1 - self.rho / RHO_I 		# porosity (unitless)
-	porespace_vol 			= porosity * self.dz 		# pore space volume (meters) of each box - volume of air + water
-	porespace_air			= porespace_vol - self.LWC 	# pore space that is filled with air (meters)
-
-	cold_content			= CP_I * self.mass * (T_MELT - self.Tz) # cold content of each box, i.e. how much heat to bring it to 273K (kJ)
-	cold_content_sum 		= cold_content.cumsum(axis=0)
-	refreeze_mass_pot 		= cold_content / LF_I 					# how much mass of the meltwater could be refrozen due to cold content
-	refreeze_mass_pot_sum 	= refreeze_mass_pot.cumsum(axis=0) 
-
-	### calculate what the values will be after refreeze happens (pot stands for potential)
-	rho_pot					= (self.mass + refreeze_mass_pot) / self.dz # what the mass of the boxes would be if the refreezemass refroze
-	porosity_pot			= 1 - rho_pot / RHO_I
-	porespace_vol_pot		= porosity_pot * self.dz
-	porespace_air_pot		= porespace_vol_pot - self.LWC
-
-	Wmi 					= 0.057 * (RHO_I - rho_pot) / rho_pot + 0.017 # water per snow-plus- water mass irreducible liquid water content, Langen eqn 3 unitless)
-	Swi						= Wmi / (1 - Wmi) * (rho_pot * RHO_I) / (1000 * (RHO_I - rho_pot)) 	#irreducible water saturation, volume of water per porespace volume (unitless), Colbeck 1972
-
-	maxpore 				= Swi * 2.0 # upper limit on what percentage of the porosity can be filled with water.
-
-	maxLWC1					= porespace_vol * maxpore 	# maximum volume of water that can be stored in each node (meters)
-	maxLWC2					= ((917.0 * self.dz) - self.mass) / RHO_W_KGM # double check that the LWC does not get too large. 
-	maxLWC 					= np.minimum(maxLWC1 , maxLWC2)
-	maxLWC[self.rho>impermeable_rho] = 0
-	maxLWC_mass 			= maxLWC * RHO_W_KGM		# mass of the maximum volume of water
-	maxLWC1_pot				= porespace_vol_pot * maxpore 	# maximum volume of water that can be stored in each node (meters)
-	maxLWC2_pot				= ((917.0 * self.dz) - (self.mass + refreeze_mass_pot)) / RHO_W_KGM # double check that the LWC does not get too large. 
-	maxLWC_pot 				= np.minimum(maxLWC1_pot , maxLWC2_pot)
-	# maxLWC_pot[rho_pot>impermeable_rho] = 0
-	maxLWC_mass_pot 		= maxLWC_pot * RHO_W_KGM		# mass of the maximum volume of water
-
-	irreducible_mass_pot 	= Swi * porespace_vol_pot * RHO_W_KGM # mass of irreducible water for each volume (potential - does not separate how much is already there)
+	if self.kernelBackend == 'numba': # same potentials as below, in one loop (kernels.py)
+		refreeze_mass_pot, irreducible_mass_pot, maxLWC_pot = bucket_potentials(self.mass, self.dz, self.Tz)
+		maxLWC_mass_pot 		= maxLWC_pot * RHO_W_KGM
+	else:
+		porosity 				= 1 - self.rho / RHO_I 		# porosity (unitless)
+		porespace_vol 			= porosity * self.dz 		# pore space volume (meters) of each box - volume of air + water
+		porespace_air			= porespace_vol - self.LWC 	# pore space that is filled with air (meters)
+
+		cold_content			= CP_I * self.mass * (T_MELT - self.Tz) # cold content of each box, i.e. how much heat to bring it to 273K (kJ)
+		cold_content_sum 		= cold_content.cumsum(axis=0)
+		refreeze_mass_pot 		= cold_content / LF_I 					# how much mass of the meltwater could be refrozen due to cold content
+		refreeze_mass_pot_sum 	= refreeze_mass_pot.cumsum(axis=0) 
+
+		### calculate what the values will be after refreeze happens (pot stands for potential)
+		rho_pot					= (self.mass + refreeze_mass_pot) / self.dz # what the mass of the boxes would be if the refreezemass refroze
+		porosity_pot			= 1 - rho_pot / RHO_I
+		porespace_vol_pot		= porosity_pot * self.dz
+		porespace_air_pot		= porespace_vol_pot - self.LWC
+
+		Wmi 					= 0.057 * (RHO_I - rho_pot) / rho_pot + 0.017 # water per snow-plus- water mass irreducible liquid water content, Langen eqn 3 unitless)
+		Swi						= Wmi / (1 - Wmi) * (rho_pot * RHO_I) / (1000 * (RHO_I - rho_pot)) 	#irreducible water saturation, volume of water per porespace volume (unitless), Colbeck 1972
+
+		maxpore 				= Swi * 2.0 # upper limit on what percentage of the porosity can be filled with water.
+
+		maxLWC1					= porespace_vol * maxpore 	# maximum volume of water that can be stored in each node (meters)
+		maxLWC2					= ((917.0 * self.dz) - self.mass) / RHO_W_KGM # double check that the LWC does not get too large. 
+		maxLWC 					= np.minimum(maxLWC1 , maxLWC2)
+		maxLWC[self.rho>impermeable_rho] = 0
+		maxLWC_mass 			= maxLWC * RHO_W_KGM		# mass of the maximum volume of water
+		maxLWC1_pot				= porespace_vol_pot * maxpore 	# maximum volume of water that can be stored in each node (meters)
+		maxLWC2_pot				= ((917.0 * self.dz) - (self.mass + refreeze_mass_pot)) / RHO_W_KGM # double check that the LWC does not get too large. 
+		maxLWC_pot 				= np.minimum(maxLWC1_pot , maxLWC2_pot)
+		# maxLWC_pot[rho_pot>impermeable_rho] = 0
+		maxLWC_mass_pot 		= maxLWC_pot * RHO_W_KGM		# mass of the maximum volume of water
+
+		irreducible_mass_pot 	= Swi * porespace_vol_pot * RHO_W_KGM # mass of irreducible water for each volume (potential - does not separate how much is already there)
+
 	irreducible_vol_pot		= irreducible_mass_pot / RHO_W_KGM
 	liquid_storage_vol_pot	= irreducible_vol_pot - self.LWC
 	liquid_storage_mass_pot = liquid_storage_vol_pot * RHO_W_KGM
@@ -0,0 +1,85 @@
+from spincache import spin_up
+from firn_density_nospin import FirnDensityNoSpin
+from forcing import Forcing
+from writer import write_nospin_hdf5
+import os
+import copy
+import time
+import h5py
+
+'''
+Run several densification models over the same forcing in one pass.
+
+If 'physRho' in the .json is a list (e.g. ["HLdynamic", "Li2011", "Crocus"]),
+main.py calls run_multiphysics. The input files are read and interpolated once
+(Forcing), one column per model is stepped in lockstep, and the results of all
+of the models go into one results file with one group per model
+(e.g. f['HLdynamic/density']).
+
+Each model still needs its own spin-up; the spin file of each model is the
+spinFileName from the .json with the model name added (see spin_file_name).
+If the .json has 'spinPhysRho', each model is spun up with its own physics,
+or with the physics in SPIN_PHYSICS.
+'''
+
+### physics that are spun up with other physics (as in createJsonSetupFiles.py)
+SPIN_PHYSICS = {'Arthern2010T': 'Arthern2010S'}
+
+def spin_file_name(c, physRho):
+    '''
+    name of the spin file for one of the models of a multi-physics run
+
+    :param c: dictionary of the json config
+    :param physRho: name of the densification physics
+    '''
+    stem, ext = os.path.splitext(c['spinFileName'])
+    return stem + '_' + physRho + ext
+
+def model_configs(c):
+    '''
+    one config dictionary per model of a multi-physics run
+
+    :param c: dictionary of the json config, with a list for 'physRho'
+
+    :return configs: dictionary of physRho -> config
+    '''
+    configs = {}
+    for physRho in c['physRho']:
+        cm                  = copy.deepcopy(c)
+        cm['physRho']       = physRho
+        cm['spinFileName']  = spin_file_name(c, physRho)
+        if 'spinPhysRho' in c: # the spinPhysRho of the .json is for the model it was written for, not for all of them
+            cm['spinPhysRho']   = SPIN_PHYSICS.get(physRho, physRho)
+        configs[physRho]    = cm
+    return configs
+
+def run_multiphysics(c, spin=True):
+    '''
+    :param c: dictionary of the json config, with a list for 'physRho'
+    :param spin: if False, the spin-up is only run for models that do not have a spin file yet (see spincache.py)
+
+    :return firn: dictionary of physRho -> FirnDensityNoSpin at the end of the run
+    '''
+
+    configs = model_configs(c)
+
+    for physRho, cm in configs.items():
+        spin_up(cm, force = spin)
+
+    ### the forcing is read and interpolated once and shared by all of the models
+    forcing = Forcing(c)
+    f4      = h5py.File(os.path.join(c['resultsFolder'], c['resultsFileName']), 'w')
+    firn    = dict((physRho, FirnDensityNoSpin(cm, forcing, f4.create_group(physRho))) for physRho, cm in configs.items())
+
+    start_time = time.time()
+    for iii in range(forcing.stp):
+        for physRho in firn:
+            firn[physRho].step(iii)
+    print('multi-physics time stepping took', time.time() - start_time, 'seconds')
+
+    for physRho in firn:
+        firn[physRho].profiler.report()
+        write_nospin_hdf5(firn[physRho], f4[physRho])
+    f4.close()
+
+    return firn
@@ -1,11 +1,61 @@
 import numpy as np
 from constants import *
+from kernels import hl_rate, arthern_rate, crocus_rate
 from scipy import interpolate
+from scipy.optimize import brentq
 import sys
 
 # The standard parameters that get passed are:
 # (iii, steps, gridLen, bdotSec, bdot_mean, bdot_type, Tz, T10m, rho, sigma, dt, Ts, r2, physGrain):
-# if you want to add physics that require more parameters, you need to change the 'PhysParams' dictionary in both the spin and nospin classes.
+# The model runs use DensificationEngine (below), which reads these directly from the spin or nospin class,
+# so physics that require more parameters only need to use them. To add a new model, write the method
+# in FirnPhysics and register it with the densification decorator, listing the fields that it reads.
+
+### fields derived from the column every time step that a physics can read (T10m comes from the heat diffusion and is always kept)
+DERIVED_FIELDS = ['sigma', 'bdot_mean', 'T_mean', 'T10m']
+### fields that a physics carries from one time step to the next (grain size and temperature history)
+STATE_FIELDS = ['r2', 'Hx']
+
+### densification physics: name used for 'physRho' in the .json -> {'method', 'inputs', 'state', 'batch'}, filled in by densification()
+PHYSICS = {}
+
+def densification(physRho, inputs=(), state=(), batch=False):
+    '''
+    Decorator that registers a FirnPhysics method as the densification physics physRho.
+    The model runs only update the fields that the physics in use (and the outputs) need,
+    e.g. the stress is not summed every step for physics that do not read sigma.
+
+    :param physRho: name of the physics in the .json
+    :param inputs: fields of DERIVED_FIELDS that the physics reads. 'bdot_mean' is only needed with bdot_type 'mean' (see accumulation)
+    :param state: fields of STATE_FIELDS that the physics needs
+    :param batch: True if the method also works on a batch of columns (see ensemble.py)
+    '''
+
+    for field in inputs:
+        if field not in DERIVED_FIELDS:
+            raise ValueError('%s: %s is not one of the derived fields (%s)' %(physRho, field, ', '.join(DERIVED_FIELDS)))
+    for field in state:
+        if field not in STATE_FIELDS:
+            raise ValueError('%s: %s is not one of the state fields (%s)' %(physRho, field, ', '.join(STATE_FIELDS)))
+
+    def register(method):
+        PHYSICS[physRho] = {'method': method.__name__, 'inputs': frozenset(inputs), 'state': frozenset(state), 'batch': batch}
+        return method
+    return register
+
+def physics_spec(physRho):
+    '''
+    :param physRho: name of the densification physics
+
+    :return spec: the PHYSICS entry of physRho
+    '''
+
+    try:
+        return PHYSICS[physRho]
+    except KeyError:
+        print('physRho = %s is not a valid option' %physRho)
+        print('valid options are: %s' %', '.join(PHYSICS))
+        raise
 
 class FirnPhysics:
 
@@ -20,7 +70,108 @@ class FirnPhysics:
         for k,v in list(PhysParams.items()):
             setattr(self,k,v)
         self.RD = {} # RD = Return Dictionary, set up this way so that more things can be returned easily if needed.
+        self.stepCache = {} # fields derived from the column, found once per time step (see zones, arrhenius and accumulation)
 
+    def rateBuffer(self):
+        '''
+        array for drho_dt (one value per node), zeroed
+        '''
+        return np.zeros(self.gridLen)
+
+    def zones(self, rho_t=RHO_1, closed=False):
+        '''
+        The nodes above and below a density threshold.
+        The density increases with depth almost everywhere, so the zones are usually found
+        with searchsorted and returned as slices; if the column crosses the threshold more
+        than once, they are boolean masks instead. Either can index the column arrays.
+        For a batch of columns (rho is columns x nodes, see ensemble.py) they are always masks.
+
+        :param rho_t: threshold density
+        :param closed: if True, zone 1 is rho <= rho_t and zone 2 is rho > rho_t; otherwise rho < rho_t and rho >= rho_t
+
+        :return zone1, zone2:
+        '''
+
+        key = ('zones', rho_t, closed)
+        if key not in self.stepCache:
+            rho = self.rho
+            if 'sorted' not in self.stepCache:
+                self.stepCache['sorted'] = rho.ndim == 1 and (rho[1:] >= rho[:-1]).all() # False if there is a NaN
+            if self.stepCache['sorted']:
+                ind = np.searchsorted(rho, rho_t, side = 'right' if closed else 'left')
+                self.stepCache[key] = (slice(0, ind), slice(ind, None))
+            elif closed:
+                self.stepCache[key] = (rho <= rho_t, rho > rho_t)
+            else:
+                self.stepCache[key] = (rho < rho_t, rho >= rho_t)
+        return self.stepCache[key]
+
+    def arrhenius(self, Q, zone=slice(None)):
+        '''
+        :param Q: activation energy, J/mol
+        :param zone: nodes at which the factor is needed (e.g. from zones); all of them by default
+
+        :return exp(-Q / (R * Tz)): at the nodes of zone
+        '''
+
+        if not isinstance(zone, slice): # a mask: only the nodes in it, unless the whole column is already known
+            key = ('arrhenius', Q, None, None)
+            if key in self.stepCache:
+                return self.stepCache[key][zone]
+            return np.exp(-Q / (R * self.Tz[zone]))
+        key = ('arrhenius', Q, zone.start, zone.stop)
+        if key not in self.stepCache:
+            self.stepCache[key] = np.exp(-Q / (R * self.Tz[zone]))
+        return self.stepCache[key]
+
+    def accumulation(self, *factors):
+        '''
+        Accumulation rate in the units of the physics.
+
+        :param factors: conversions from m I.E. per year, applied in order (e.g. RHO_I_MGM for m W.E. per year)
+
+        :return A: A_instant (one value, or columns x 1 for a batch) for bdot_type 'instant', A_mean (one value per node) otherwise
+        '''
+
+        key = ('accumulation',) + factors
+        if key not in self.stepCache:
+            if self.bdot_type == 'instant':
+                A = self.bdotSec[self.iii] * self.steps * S_PER_YEAR
+                if np.ndim(A): # one value per column of a batch
+                    A = A[:, None]
+            else:
+                A = self.bdot_mean
+            for f in factors:
+                A = A * f
+            self.stepCache[key] = A
+        return self.stepCache[key]
+
+    def atZone(self, x, zone):
+        '''
+        :param x: one value per node, or one value per column (a single value, or columns x 1 for a batch)
+        :param zone: nodes from zones
+
+        :return x: at the nodes of zone; a single value is returned as it is
+        '''
+
+        if np.ndim(x) == 0:
+            return x
+        if np.shape(x) != np.shape(self.rho):
+            x = np.broadcast_to(x, np.shape(self.rho))
+        return x[zone]
+
+    def columnMean(self, x):
+        '''
+        :param x: one value per node
+
+        :return mean: mean of x over the nodes of the column (columns x 1 for a batch, without the padding)
+        '''
+
+        if np.ndim(self.rho) == 1:
+            return np.mean(x)
+        return (np.sum(x * self.valid, axis = 1) / self.nz)[:, None]
+
+    @densification('HLdynamic', inputs = ['bdot_mean'], batch = True)
     def HL_dynamic(self):
         '''
 
@@ -42,23 +193,24 @@ class FirnPhysics:
         aHL = 1.0
         bHL = 0.5
 
-        A_instant = self.bdotSec[self.iii] * self.steps * S_PER_YEAR * RHO_I_MGM # Accumulation in units m W.E. per year
-        A_mean = self.bdot_mean * RHO_I_MGM
+        A       = self.accumulation(RHO_I_MGM) # Accumulation in units m W.E. per year
+        z1, z2  = self.zones()
 
-        drho_dt = np.zeros(self.gridLen)
+        drho_dt = self.rateBuffer()
 
         if self.bdot_type == 'instant':
-            drho_dt[self.rho < RHO_1]     = k1 * np.exp(-Q1 / (R * self.Tz[self.rho < RHO_1])) * (RHO_I_MGM - self.rho[self.rho < RHO_1] / 1000) * A_instant**aHL * 1000 / S_PER_YEAR
-            drho_dt[self.rho >= RHO_1]    = k2 * np.exp(-Q2 / (R * self.Tz[self.rho >= RHO_1])) * (RHO_I_MGM - self.rho[self.rho >= RHO_1] / 1000) * A_instant**bHL * 1000 / S_PER_YEAR
+            drho_dt[z1]     = k1 * self.arrhenius(Q1, z1) * (RHO_I_MGM - self.rho[z1] / 1000) * self.atZone(A, z1)**aHL * 1000 / S_PER_YEAR
+            drho_dt[z2]     = k2 * self.arrhenius(Q2, z2) * (RHO_I_MGM - self.rho[z2] / 1000) * self.atZone(A, z2)**bHL * 1000 / S_PER_YEAR
 
         elif self.bdot_type == 'mean':
-            drho_dt[self.rho < RHO_1]     = k1 * np.exp(-Q1 / (R * self.Tz[self.rho < RHO_1])) * (RHO_I_MGM - self.rho[self.rho < RHO_1] / 1000) * (A_mean[self.rho < RHO_1])**aHL * 1000 / S_PER_YEAR
-            drho_dt[self.rho >= RHO_1]    = k2 * np.exp(-Q2 / (R * self.Tz[self.rho >= RHO_1])) * (RHO_I_MGM - self.rho[self.rho >= RHO_1] / 1000) * (A_mean[self.rho >= RHO_1])**bHL * 1000 / S_PER_YEAR
+            drho_dt[z1]     = k1 * self.arrhenius(Q1, z1) * (RHO_I_MGM - self.rho[z1] / 1000) * (A[z1])**aHL * 1000 / S_PER_YEAR
+            drho_dt[z2]     = k2 * self.arrhenius(Q2, z2) * (RHO_I_MGM - self.rho[z2] / 1000) * (A[z2])**bHL * 1000 / S_PER_YEAR
 
         self.RD['drho_dt'] = drho_dt
         return self.RD
         # return drho_dt
 
+    @densification('HLSigfus', inputs = ['bdot_mean', 'sigma'])
     def HL_Sigfus(self):
         '''
 
@@ -79,10 +231,11 @@ class FirnPhysics:
         k2  = 575.0
         aHL = 1.0
 
-        A_instant = self.bdotSec[self.iii] * self.steps * S_PER_YEAR * RHO_I_MGM
-        A_mean = self.bdot_mean * RHO_I_MGM
+        A       = self.accumulation(RHO_I_MGM)
+        z1, z2  = self.zones()
+        z2i     = self.zones(RHO_I)[0] # below the ice density
 
-        drho_dt = np.zeros(self.gridLen)
+        drho_dt = self.rateBuffer()
         f550 = interpolate.interp1d(self.rho, self.sigma)
         sigma550 = f550(RHO_1)
         rhoDiff = (RHO_I_MGM - self.rho / 1000)
@@ -90,21 +243,19 @@ class FirnPhysics:
         #print('drhodt HLSigfus')
         #print(drho_dt)
 
+        if isinstance(z2, slice) and isinstance(z2i, slice):
+            z2 = slice(z2.start, max(z2.start, z2i.stop)) # rho >= RHO_1 and rho < RHO_I
+        else:
+            z2 = (self.rho >= RHO_1) & (self.rho < RHO_I)
 
-
-        k = np.power(k2 * np.exp(-Q2 / (R * self.Tz[(self.rho >= RHO_1) & (self.rho < RHO_I)])), 2) / S_PER_YEAR
-        sigmaDiff = (self.sigma[(self.rho >= RHO_1) & (self.rho < RHO_I)] - sigma550)
+        k = np.power(k2 * self.arrhenius(Q2, z2), 2) / S_PER_YEAR
+        sigmaDiff = (self.sigma[z2] - sigma550)
         # print('sigmaDiff',len(sigmaDiff))
         if self.bdot_type == 'instant':
-            drho_dt[self.rho < RHO_1] = k1 * np.exp(-Q1 / (R * self.Tz[self.rho < RHO_1])) * (RHO_I_MGM - self.rho[self.rho < RHO_1] / 1000) * A_instant**aHL * 1000 / S_PER_YEAR
+            drho_dt[z1] = k1 * self.arrhenius(Q1, z1) * (RHO_I_MGM - self.rho[z1] / 1000) * A**aHL * 1000 / S_PER_YEAR
         elif self.bdot_type == 'mean':
-            drho_dt[self.rho < RHO_1] = k1 * np.exp(-Q1 / (R * self.Tz[self.rho < RHO_1])) * (RHO_I_MGM - self.rho[self.rho < RHO_1] / 1000) * (A_mean[self.rho < RHO_1])**aHL * 1000 / S_PER_YEAR
-        # print('rhoDiff',len(rhoDiff[(self.rho >= RHO_1) & (self.rho < RHO_I)]))
-        # print('drho',len(drho_dt[(self.rho >= RHO_1) & (self.rho < RHO_I)]))
-        # print('k',len(k))
-        drho_dt[(self.rho >= RHO_1) & (self.rho < RHO_I)]  = k * (sigmaDiff * rhoDiff[(self.rho >= RHO_1) & (self.rho < RHO_I)]) / (GRAVITY * np.log((RHO_I_MGM - RHO_1 / 1000) / (rhoDiff[(self.rho >= RHO_1) & (self.rho < RHO_I)])))
-
-        drho_dt[(self.rho >= RHO_1) & (self.rho >= RHO_I)] = 0
+            drho_dt[z1] = k1 * self.arrhenius(Q1, z1) * (RHO_I_MGM - self.rho[z1] / 1000) * (A[z1])**aHL * 1000 / S_PER_YEAR
+        drho_dt[z2]  = k * (sigmaDiff * rhoDiff[z2]) / (GRAVITY * np.log((RHO_I_MGM - RHO_1 / 1000) / (rhoDiff[z2])))
 
         # drho_dt[self.rho >= RHO_1]  = k * (sigmaDiff * rhoDiff[self.rho >= RHO_1]) / (GRAVITY * np.log((RHO_I_MGM - RHO_1 / 1000) / (rhoDiff[self.rho >= RHO_1])))
         
@@ -116,6 +267,7 @@ class FirnPhysics:
 
         # return drho_dt
 
+    @densification('Li2004', inputs = ['bdot_mean', 'T10m'], batch = True)
     def Li_2004(self):
         '''
         Accumulation units are m W.E. per year (?)
@@ -134,17 +286,16 @@ class FirnPhysics:
         :return drho_dt:
         '''
 
-        A_instant = self.bdotSec[self.iii] * self.steps * S_PER_YEAR * RHO_I_MGM
-        A_mean = self.bdot_mean * RHO_I_MGM
+        A = self.accumulation(RHO_I_MGM)
 
         # dr_dt = np.zeros(self.gridLen)
         
         if self.bdot_type == 'instant':
             if self.iii==0:
                 print("It is not recommended to use instant accumulation with Li and Zwally 2004 physics")
-            dr_dt = (RHO_I - self.rho) * A_instant * (139.21 - 0.542 * self.T10m) * 8.36 * (K_TO_C - self.Tz) ** -2.061
+            dr_dt = (RHO_I - self.rho) * A * (139.21 - 0.542 * self.T10m) * 8.36 * (K_TO_C - self.Tz) ** -2.061
         elif self.bdot_type == 'mean':
-            dr_dt = (RHO_I - self.rho) * A_mean * (139.21 - 0.542 * self.T10m) * 8.36 * (K_TO_C - self.Tz) ** -2.061   
+            dr_dt = (RHO_I - self.rho) * A * (139.21 - 0.542 * self.T10m) * 8.36 * (K_TO_C - self.Tz) ** -2.061   
 
         drho_dt = dr_dt / S_PER_YEAR
 
@@ -153,6 +304,7 @@ class FirnPhysics:
         return self.RD
         # return drho_dt
 
+    @densification('Li2011', inputs = ['bdot_mean', 'T_mean'], batch = True)
     def Li_2011(self):
         '''
         Accumulation units are m W.E. per year (?)
@@ -170,9 +322,8 @@ class FirnPhysics:
         :return drho_dt:
         '''
 
-        A_instant     = self.bdotSec[self.iii] * self.steps * S_PER_YEAR * RHO_I_MGM
-        A_mean = self.bdot_mean * RHO_I_MGM
-
+        A       = self.accumulation(RHO_I_MGM)
+        z1, z2  = self.zones(RHO_1, closed = True)
 
         # TmC   = self.T10m - K_TO_C
         TmC   = self.T_mean - K_TO_C
@@ -182,11 +333,11 @@ class FirnPhysics:
         if self.bdot_type == 'instant':
             if self.iii==0:
                 print("It is not recommended to use instant accumulation with Li and Zwally 2011 physics")
-            beta1 = -9.788 + 8.996 * A_instant - 0.6165 * TmC
-            beta2 = beta1 / (-2.0178 + 8.4043 * A_instant - 0.0932 * TmC)
+            beta1 = -9.788 + 8.996 * A - 0.6165 * TmC
+            beta2 = beta1 / (-2.0178 + 8.4043 * A - 0.0932 * TmC)
 
-            dr_dt[self.rho <= RHO_1] = (RHO_I - self.rho[self.rho <= RHO_1]) * A_instant * beta1 * 8.36 * (K_TO_C - self.Tz[self.rho <= RHO_1]) ** -2.061
-            dr_dt[self.rho > RHO_1]  = (RHO_I - self.rho[self.rho > RHO_1]) * A_instant * beta2 * 8.36 * (K_TO_C - self.Tz[self.rho > RHO_1]) ** -2.061
+            dr_dt[z1] = (RHO_I - self.rho[z1]) * self.atZone(A, z1) * self.atZone(beta1, z1) * 8.36 * (K_TO_C - self.Tz[z1]) ** -2.061
+            dr_dt[z2] = (RHO_I - self.rho[z2]) * self.atZone(A, z2) * self.atZone(beta2, z2) * 8.36 * (K_TO_C - self.Tz[z2]) ** -2.061
         
         elif self.bdot_type == 'mean':
 
@@ -195,13 +346,11 @@ class FirnPhysics:
             # beta2 = beta1 / (-2.0178 + 8.4043 * A_mean - 0.0932 * TmC)
 
             ### These lines are for a single value of beta based on long-term accumulation rate
-            beta1a = -9.788 + 8.996 * np.mean(A_mean) - 0.6165 * TmC
-            beta2a = beta1a / (-2.0178 + 8.4043 * np.mean(A_mean) - 0.0932 * TmC)
-            beta1 = np.ones(len(A_mean))*beta1a
-            beta2 = np.ones(len(A_mean))*beta2a
+            beta1 = -9.788 + 8.996 * self.columnMean(A) - 0.6165 * TmC
+            beta2 = beta1 / (-2.0178 + 8.4043 * self.columnMean(A) - 0.0932 * TmC)
 
-            dr_dt[self.rho <= RHO_1] = (RHO_I - self.rho[self.rho <= RHO_1]) * A_mean[self.rho <= RHO_1] * beta1[self.rho <= RHO_1] * 8.36 * (K_TO_C - self.Tz[self.rho <= RHO_1]) ** -2.061
-            dr_dt[self.rho > RHO_1]  = (RHO_I - self.rho[self.rho > RHO_1]) * A_mean[self.rho > RHO_1] * beta2[self.rho > RHO_1] * 8.36 * (K_TO_C - self.Tz[self.rho > RHO_1]) ** -2.061
+            dr_dt[z1] = (RHO_I - self.rho[z1]) * A[z1] * self.atZone(beta1, z1) * 8.36 * (K_TO_C - self.Tz[z1]) ** -2.061
+            dr_dt[z2] = (RHO_I - self.rho[z2]) * A[z2] * self.atZone(beta2, z2) * 8.36 * (K_TO_C - self.Tz[z2]) ** -2.061
 
         drho_dt = dr_dt / S_PER_YEAR
         # self.viscosity = np.ones(self.gridLen)
@@ -210,6 +359,7 @@ class FirnPhysics:
 
         # return drho_dt
 
+    @densification('Arthern2010S', inputs = ['bdot_mean', 'T10m'], batch = True)
     def Arthern_2010S(self):
         '''
         This is the steady-state solution described in the main text of Arthern et al. (2010)
@@ -232,19 +382,18 @@ class FirnPhysics:
         Ec  = 60.0e3
         Eg  = 42.4e3
 
-        A_instant = self.bdotSec[self.iii] * self.steps * S_PER_YEAR * RHO_I_MGM * 1000
-        A_mean_1 = self.bdot_mean[self.rho < RHO_1] * RHO_I_MGM * 1000
-        A_mean_2 = self.bdot_mean[self.rho >= RHO_1] * RHO_I_MGM * 1000
+        A       = self.accumulation(RHO_I_MGM, 1000)
+        z1, z2  = self.zones()
         dr_dt = np.zeros(self.gridLen)
 
         if self.bdot_type == 'instant':
             if self.iii==0:
                 print("It is not recommended to use instant accumulation with Arthern 2010 physics")
-            dr_dt[self.rho < RHO_1]  = (RHO_I - self.rho[self.rho < RHO_1]) * ar1 * A_instant * GRAVITY * np.exp(-Ec / (R * self.Tz[self.rho < RHO_1]) + Eg / (R * self.T10m))
-            dr_dt[self.rho >= RHO_1] = (RHO_I - self.rho[self.rho >= RHO_1]) * ar2 * A_instant * GRAVITY * np.exp(-Ec / (R * self.Tz[self.rho >= RHO_1]) + Eg / (R * self.T10m))
+            dr_dt[z1] = (RHO_I - self.rho[z1]) * ar1 * self.atZone(A, z1) * GRAVITY * np.exp(-Ec / (R * self.Tz[z1]) + Eg / (R * self.atZone(self.T10m, z1)))
+            dr_dt[z2] = (RHO_I - self.rho[z2]) * ar2 * self.atZone(A, z2) * GRAVITY * np.exp(-Ec / (R * self.Tz[z2]) + Eg / (R * self.atZone(self.T10m, z2)))
         elif self.bdot_type == 'mean':
-            dr_dt[self.rho < RHO_1]  = (RHO_I - self.rho[self.rho < RHO_1]) * ar1 * A_mean_1 * GRAVITY * np.exp(-Ec / (R * self.Tz[self.rho < RHO_1]) + Eg / (R * self.T10m))
-            dr_dt[self.rho >= RHO_1] = (RHO_I - self.rho[self.rho >= RHO_1]) * ar2 * A_mean_2 * GRAVITY * np.exp(-Ec / (R * self.Tz[self.rho >= RHO_1]) + Eg / (R * self.T10m))
+            dr_dt[z1] = (RHO_I - self.rho[z1]) * ar1 * A[z1] * GRAVITY * np.exp(-Ec / (R * self.Tz[z1]) + Eg / (R * self.atZone(self.T10m, z1)))
+            dr_dt[z2] = (RHO_I - self.rho[z2]) * ar2 * A[z2] * GRAVITY * np.exp(-Ec / (R * self.Tz[z2]) + Eg / (R * self.atZone(self.T10m, z2)))
 
         drho_dt = dr_dt / S_PER_YEAR
         # self.viscosity = np.ones(self.gridLen)
@@ -252,6 +401,7 @@ class FirnPhysics:
         return self.RD
         # return drho_dt
 
+    @densification('Arthern2010T', inputs = ['sigma'], state = ['r2'])
     def Arthern_2010T(self):
         '''
         This is the transient solution described in the appendix of Arthern et al. (2010)
@@ -280,18 +430,20 @@ class FirnPhysics:
            return
 
 
-        drho_dt = np.zeros(self.gridLen)
+        z1, z2  = self.zones()
+        drho_dt = self.rateBuffer()
         self.viscosity = np.zeros(self.gridLen)
     
-        drho_dt[self.rho < RHO_1]  = kc1 * (RHO_I - self.rho[self.rho < RHO_1]) * np.exp(-Ec / (R * self.Tz[self.rho < RHO_1])) * self.sigma[self.rho < RHO_1] / (self.r2[self.rho < RHO_1])
+        drho_dt[z1] = kc1 * (RHO_I - self.rho[z1]) * self.arrhenius(Ec, z1) * self.sigma[z1] / (self.r2[z1])
         # self.viscosity[self.rho < RHO_1] = ((1 / (2*kc1)) * (self.rho[self.rho < RHO_1] / (RHO_I - self.rho[self.rho < RHO_1])) * np.exp (Ec / (R * self.Tz[self.rho < RHO_1])) * (self.r2[self.rho < RHO_1])) / S_PER_YEAR
         
-        drho_dt[self.rho >= RHO_1] = kc2 * (RHO_I - self.rho[self.rho >= RHO_1]) * np.exp(-Ec / (R * self.Tz[self.rho >= RHO_1])) * self.sigma[self.rho >= RHO_1] / (self.r2[self.rho >= RHO_1])
+        drho_dt[z2] = kc2 * (RHO_I - self.rho[z2]) * self.arrhenius(Ec, z2) * self.sigma[z2] / (self.r2[z2])
         # self.viscosity[self.rho >= RHO_1] = ((1 / (2*kc2)) * (self.rho[self.rho >= RHO_1] / (RHO_I - self.rho[self.rho >= RHO_1])) * np.exp (Ec / (R * self.Tz[self.rho >= RHO_1])) * (self.r2[self.rho >= RHO_1])) / S_PER_YEAR
         self.RD['drho_dt'] = drho_dt
         return self.RD
         # return drho_dt
 
+    @densification('Helsen2008', inputs = ['bdot_mean', 'T_mean'], batch = True)
     def Helsen_2008(self):
         '''
         Accumulation units are m W.E. per year (?)
@@ -310,15 +462,14 @@ class FirnPhysics:
         :return drho_dt:
         '''
 
-        A_instant = self.bdotSec[self.iii] * self.steps * S_PER_YEAR * RHO_I_MGM
-        A_mean = self.bdot_mean * RHO_I_MGM
+        A = self.accumulation(RHO_I_MGM)
 
         if self.bdot_type == 'instant':
             if self.iii==0:
                 print("It is not recommended to use instant accumulation with Helsen 2008 physics")            
-            dr_dt = (RHO_I - self.rho) * A_instant * (76.138 - 0.28965 * self.T_mean) * 8.36 * (K_TO_C - self.Tz) ** -2.061
+            dr_dt = (RHO_I - self.rho) * A * (76.138 - 0.28965 * self.T_mean) * 8.36 * (K_TO_C - self.Tz) ** -2.061
         elif self.bdot_type == 'mean':
-            dr_dt = (RHO_I - self.rho) * A_mean * (76.138 - 0.28965 * self.T_mean) * 8.36 * (K_TO_C - self.Tz) ** -2.061
+            dr_dt = (RHO_I - self.rho) * A * (76.138 - 0.28965 * self.T_mean) * 8.36 * (K_TO_C - self.Tz) ** -2.061
 
         
 
@@ -329,6 +480,7 @@ class FirnPhysics:
 
         # return drho_dt
 
+    @densification('Simonsen2013', inputs = ['bdot_mean', 'T10m'], batch = True)
     def Simonsen_2013(self):
         '''
         Accumulation units are kg/m^2/year
@@ -354,21 +506,20 @@ class FirnPhysics:
         # F1=1.25 # Simonsen's recommended (email correspondence)
 
 
-        A_instant = self.bdotSec[self.iii] * self.steps * S_PER_YEAR * RHO_I_MGM * 1000
-        A_mean_1 = self.bdot_mean[self.rho < RHO_1] * RHO_I_MGM * 1000
-        A_mean_2 = self.bdot_mean[self.rho >= RHO_1]* RHO_I_MGM * 1000
+        A       = self.accumulation(RHO_I_MGM, 1000)
+        z1, z2  = self.zones()
         dr_dt = np.zeros(self.gridLen)
 
         if self.bdot_type == 'instant':
             if self.iii==0:
                 print("It is not recommended to use instant accumulation with Simonsen physics")
-            gamma = 61.7 / (A_instant ** (0.5)) * np.exp(-3800. / (R * self.T10m))
-            dr_dt[self.rho < RHO_1]  = F0 * (RHO_I - self.rho[self.rho < RHO_1]) * ar1 * A_instant * GRAVITY * np.exp(-Ec / (R * self.Tz[self.rho < RHO_1]) + Eg / (R * self.T10m))
-            dr_dt[self.rho >= RHO_1] = F1 * gamma * (RHO_I - self.rho[self.rho >= RHO_1]) * ar2 * A_instant * GRAVITY * np.exp(-Ec / (R * self.Tz[self.rho >= RHO_1]) + Eg / (R * self.T10m))
+            gamma = 61.7 / (A ** (0.5)) * np.exp(-3800. / (R * self.T10m))
+            dr_dt[z1] = F0 * (RHO_I - self.rho[z1]) * ar1 * self.atZone(A, z1) * GRAVITY * np.exp(-Ec / (R * self.Tz[z1]) + Eg / (R * self.atZone(self.T10m, z1)))
+            dr_dt[z2] = F1 * self.atZone(gamma, z2) * (RHO_I - self.rho[z2]) * ar2 * self.atZone(A, z2) * GRAVITY * np.exp(-Ec / (R * self.Tz[z2]) + Eg / (R * self.atZone(self.T10m, z2)))
         elif self.bdot_type == 'mean':
-            gamma = 61.7 / (A_mean_2 ** (0.5)) * np.exp(-3800.0 / (R * self.T10m))
-            dr_dt[self.rho < RHO_1]  = F0 * (RHO_I - self.rho[self.rho < RHO_1]) * ar1 * A_mean_1 * GRAVITY * np.exp(-Ec / (R * self.Tz[self.rho < RHO_1]) + Eg / (R * self.T10m))
-            dr_dt[self.rho >= RHO_1] = F1 * gamma * (RHO_I - self.rho[self.rho >= RHO_1]) * ar2 * A_mean_2 * GRAVITY * np.exp(-Ec / (R * self.Tz[self.rho >= RHO_1]) + Eg / (R * self.T10m))
+            gamma = 61.7 / (A[z2] ** (0.5)) * np.exp(-3800.0 / (R * self.atZone(self.T10m, z2)))
+            dr_dt[z1] = F0 * (RHO_I - self.rho[z1]) * ar1 * A[z1] * GRAVITY * np.exp(-Ec / (R * self.Tz[z1]) + Eg / (R * self.atZone(self.T10m, z1)))
+            dr_dt[z2] = F1 * gamma * (RHO_I - self.rho[z2]) * ar2 * A[z2] * GRAVITY * np.exp(-Ec / (R * self.Tz[z2]) + Eg / (R * self.atZone(self.T10m, z2)))
 
         drho_dt = dr_dt / S_PER_YEAR
         # self.viscosity = np.ones(self.gridLen)
@@ -376,6 +527,7 @@ class FirnPhysics:
         return self.RD
         # return drho_dt
 
+    @densification('Ligtenberg2011', inputs = ['bdot_mean', 'T10m'], batch = True)
     def Ligtenberg_2011(self):
         '''
 
@@ -403,25 +555,26 @@ class FirnPhysics:
 
         dr_dt = np.zeros(self.gridLen)
 
+        z1, z2  = self.zones()
+
         if self.bdot_type == 'instant':
             if self.iii==0:
                 print("It is not recommended to use instant accumulation with Ligtenberg 2011 physics")
-            A_instant = self.bdotSec[self.iii] * self.steps * S_PER_YEAR * RHO_I_MGM * 1000
-            M_0 = 1.435 - 0.151 * np.log(A_instant)
-            M_1 = 2.366 - 0.293 * np.log(A_instant)
-            M_0 = np.max((0.25,M_0))
-            M_1 = np.max((0.25,M_1))
-            dr_dt[self.rho < RHO_1]  = (RHO_I - self.rho[self.rho < RHO_1]) * M_0 * ar1 * A_instant * GRAVITY * np.exp(-Ec / (R * self.Tz[self.rho < RHO_1]) + Eg / (R * self.T10m))
-            dr_dt[self.rho >= RHO_1] = (RHO_I - self.rho[self.rho >= RHO_1]) * M_1 * ar2 * A_instant * GRAVITY * np.exp(-Ec / (R * self.Tz[self.rho >= RHO_1])+ Eg / (R * self.T10m))
+            A = self.accumulation(RHO_I_MGM, 1000)
+            M_0 = 1.435 - 0.151 * np.log(A)
+            M_1 = 2.366 - 0.293 * np.log(A)
+            M_0 = np.maximum(0.25,M_0)
+            M_1 = np.maximum(0.25,M_1)
+            dr_dt[z1] = (RHO_I - self.rho[z1]) * self.atZone(M_0, z1) * ar1 * self.atZone(A, z1) * GRAVITY * np.exp(-Ec / (R * self.Tz[z1]) + Eg / (R * self.atZone(self.T10m, z1)))
+            dr_dt[z2] = (RHO_I - self.rho[z2]) * self.atZone(M_1, z2) * ar2 * self.atZone(A, z2) * GRAVITY * np.exp(-Ec / (R * self.Tz[z2])+ Eg / (R * self.atZone(self.T10m, z2)))
         elif self.bdot_type == 'mean':
-            A_mean_1 = self.bdot_mean[self.rho < RHO_1] * RHO_I
-            A_mean_2 = self.bdot_mean[self.rho >= RHO_1] * RHO_I
-            M_0 = 1.435 - 0.151 * np.log(A_mean_1)
-            M_1 = 2.366 - 0.293 * np.log(A_mean_2)
+            A = self.accumulation(RHO_I)
+            M_0 = 1.435 - 0.151 * np.log(A[z1])
+            M_1 = 2.366 - 0.293 * np.log(A[z2])
             M_0[M_0<0.25]=0.25
             M_1[M_1<0.25]=0.25
-            dr_dt[self.rho < RHO_1]  = (RHO_I - self.rho[self.rho < RHO_1]) * M_0 * ar1 * A_mean_1 * GRAVITY * np.exp(-Ec / (R * self.Tz[self.rho < RHO_1]) + Eg / (R * self.T10m))
-            dr_dt[self.rho >= RHO_1] = (RHO_I - self.rho[self.rho >= RHO_1]) * M_1 * ar2 * A_mean_2 * GRAVITY * np.exp(-Ec / (R * self.Tz[self.rho >= RHO_1]) + Eg / (R * self.T10m))
+            dr_dt[z1] = (RHO_I - self.rho[z1]) * M_0 * ar1 * A[z1] * GRAVITY * np.exp(-Ec / (R * self.Tz[z1]) + Eg / (R * self.atZone(self.T10m, z1)))
+            dr_dt[z2] = (RHO_I - self.rho[z2]) * M_1 * ar2 * A[z2] * GRAVITY * np.exp(-Ec / (R * self.Tz[z2]) + Eg / (R * self.atZone(self.T10m, z2)))
 
 
             # dr_dt[self.rho < RHO_1]  = (RHO_I - self.rho[self.rho < RHO_1]) * M_0 * ar1 * A_mean_1 * GRAVITY * np.exp(-Ec / (R * self.Tz[self.rho < RHO_1]) + Eg / (R * self.Tz[self.rho < RHO_1]))
@@ -434,6 +587,7 @@ class FirnPhysics:
 
         # return drho_dt
 
+    @densification('Barnola1991', inputs = ['bdot_mean', 'sigma'])
     def Barnola_1991(self):
         '''
 
@@ -461,29 +615,31 @@ class FirnPhysics:
         closeOff        = 800.0
 
         self.rho[self.rho > RHO_I] = RHO_I # The Barnola model will go a fraction over the ice density (oself.RDer 10^-3), so this stops that.
-        drho_dt = np.zeros(self.gridLen)
+        drho_dt = self.rateBuffer()
         D = self.rho / RHO_I
         nBa = n * np.ones(self.gridLen)
         A0 = A0b * np.ones(self.gridLen) / 1.e18 #this is for the n=3 region.
 
         sigmaEff = self.sigma
 
+        z1      = self.zones()[0]
+        z2, z3  = self.zones(RHO_2, closed = True)
+
         ### Zone 1 ###
-        A_instant = self.bdotSec[self.iii] * self.steps * S_PER_YEAR * RHO_I_MGM
-        A_mean_1 = self.bdot_mean[self.rho < RHO_1] * RHO_I_MGM
+        A = self.accumulation(RHO_I_MGM)
 
         if self.bdot_type == 'instant':
-            drho_dt[self.rho < RHO_1] = dr_dt = k1 * np.exp(-Q1 / (R * self.Tz[self.rho < RHO_1])) * (RHO_I_MGM - self.rho[self.rho < RHO_1] / 1000) * A_instant ** aHL * 1000 / S_PER_YEAR
+            drho_dt[z1] = dr_dt = k1 * self.arrhenius(Q1, z1) * (RHO_I_MGM - self.rho[z1] / 1000) * A ** aHL * 1000 / S_PER_YEAR
         elif self.bdot_type == 'mean':
-            drho_dt[self.rho < RHO_1] = dr_dt = k1 * np.exp(-Q1 / (R * self.Tz[self.rho < RHO_1])) * (RHO_I_MGM - self.rho[self.rho < RHO_1] / 1000) * A_mean_1 ** aHL * 1000 / S_PER_YEAR
+            drho_dt[z1] = dr_dt = k1 * self.arrhenius(Q1, z1) * (RHO_I_MGM - self.rho[z1] / 1000) * A[z1] ** aHL * 1000 / S_PER_YEAR
 
         ### Zone 2 ###
-        fe = 10.0 ** (alphaBarnola * (self.rho[self.rho <= RHO_2] / 1000) ** 3. + betaBarnola * (self.rho[self.rho <= RHO_2] / 1000) ** 2. + deltaBarnola * self.rho[self.rho <= RHO_2] / 1000 + gammaBarnola)
-        drho_dt[self.rho <= RHO_2] = self.rho[self.rho <= RHO_2] * A0[self.rho <= RHO_2] * np.exp(-QBarnola / (R * self.Tz[self.rho <= RHO_2])) * fe * (sigmaEff[self.rho <= RHO_2] ** nBa[self.rho <= RHO_2])
+        fe = 10.0 ** (alphaBarnola * (self.rho[z2] / 1000) ** 3. + betaBarnola * (self.rho[z2] / 1000) ** 2. + deltaBarnola * self.rho[z2] / 1000 + gammaBarnola)
+        drho_dt[z2] = self.rho[z2] * A0[z2] * self.arrhenius(QBarnola, z2) * fe * (sigmaEff[z2] ** nBa[z2])
 
         # zone 3
-        fs = (3. / 16.) * (1 - self.rho[self.rho > RHO_2] / RHO_I) / (1 - (1 - self.rho[self.rho > RHO_2] / RHO_I) ** (1. / 3.)) ** 3.
-        drho_dt[self.rho > RHO_2] = self.rho[self.rho > RHO_2] * A0[self.rho > RHO_2] * np.exp(-QBarnola / (R * self.Tz[self.rho > RHO_2])) * fs * (sigmaEff[self.rho > RHO_2] ** nBa[self.rho > RHO_2])
+        fs = (3. / 16.) * (1 - self.rho[z3] / RHO_I) / (1 - (1 - self.rho[z3] / RHO_I) ** (1. / 3.)) ** 3.
+        drho_dt[z3] = self.rho[z3] * A0[z3] * self.arrhenius(QBarnola, z3) * fs * (sigmaEff[z3] ** nBa[z3])
         
         # self.viscosity = np.ones(self.gridLen)
         self.RD['drho_dt'] = drho_dt
@@ -491,6 +647,7 @@ class FirnPhysics:
 
         # return drho_dt
     
+    @densification('Morris2014', inputs = ['bdot_mean', 'sigma'], state = ['Hx'])
     def Morris_HL_2014(self):
         '''
 
@@ -522,27 +679,28 @@ class FirnPhysics:
         QMorris = 110.e3
         kMorris = 11.0
 
-        drho_dt = np.zeros(self.gridLen)
+        drho_dt = self.rateBuffer()
         # self.viscosity = np.zeros(self.gridLen)
 
         
-        drho_dt[self.rho < RHO_1] = (kMorris / (RHO_W_KGM * GRAVITY)) * -1 * ((RHO_I - self.rho[self.rho < RHO_1])) * (1 / self.Hx[self.rho < RHO_1]) * np.exp(-QMorris / (R * self.Tz[self.rho < RHO_1])) * self.sigma[self.rho < RHO_1]
+        z1, z2  = self.zones()
+        drho_dt[z1] = (kMorris / (RHO_W_KGM * GRAVITY)) * -1 * ((RHO_I - self.rho[z1])) * (1 / self.Hx[z1]) * self.arrhenius(QMorris)[z1] * self.sigma[z1]
         
         # Use HL Dynamic for zone 2 b/c Morris does not specify zone 2.
         Q2  = 21400.0
         k2  = 575.0
         bHL = 0.5
-        A_instant = self.bdotSec[self.iii] * self.steps * S_PER_YEAR * RHO_I_MGM
-        A_mean_2 = self.bdot_mean[self.rho >= RHO_1] * RHO_I_MGM
+        A = self.accumulation(RHO_I_MGM)
         if self.bdot_type == 'instant':
-            drho_dt[self.rho >= RHO_1]   = k2 * np.exp(-Q2 / (R * self.Tz[self.rho >= RHO_1])) * (RHO_I_MGM - self.rho[self.rho >= RHO_1] / 1000) * A_instant ** bHL * 1000 / S_PER_YEAR
+            drho_dt[z2] = k2 * self.arrhenius(Q2, z2) * (RHO_I_MGM - self.rho[z2] / 1000) * A ** bHL * 1000 / S_PER_YEAR
         elif self.bdot_type == 'mean':
-            drho_dt[self.rho >= RHO_1]   = k2 * np.exp(-Q2 / (R * self.Tz[self.rho >= RHO_1])) * (RHO_I_MGM - self.rho[self.rho >= RHO_1] / 1000) * A_mean_2 ** bHL * 1000 / S_PER_YEAR
+            drho_dt[z2] = k2 * self.arrhenius(Q2, z2) * (RHO_I_MGM - self.rho[z2] / 1000) * A[z2] ** bHL * 1000 / S_PER_YEAR
         
         self.RD['drho_dt'] = drho_dt
         return self.RD
         # return drho_dt
 
+    @densification('KuipersMunneke2015', inputs = ['bdot_mean', 'T10m'])
     def KuipersMunneke_2015(self):
         '''
 
@@ -572,21 +730,22 @@ class FirnPhysics:
         #     A_instant = np.mean(self.bdotSec[self.iii-12*yrmn:self.iii+1]) * self.steps * S_PER_YEAR * RHO_I_MGM * 1000
 
         dr_dt = np.zeros(self.gridLen)
+        z1, z2  = self.zones()
 
         if self.bdot_type == 'instant':
-            A_instant = self.bdotSec[self.iii] * self.steps * S_PER_YEAR * RHO_I_MGM * 1000
+            A_instant = self.accumulation(RHO_I_MGM, 1000)
             if self.iii==0:
                 print("It is not recommended to use instant accumulation with Ligtenberg 2011 physics")
             M_0 = 1.042 - 0.0916 * np.log(A_instant)
             M_1 = 1.734 - 0.2039 * np.log(A_instant)
             M_0 = np.max((0.25,M_0))
             M_1 = np.max((0.25,M_1))
-            dr_dt[self.rho < RHO_1]  = (RHO_I - self.rho[self.rho < RHO_1]) * M_0 * ar1 * A_instant * GRAVITY * np.exp(-Ec / (R * self.Tz[self.rho < RHO_1]) + Eg / (R * self.T10m))
-            dr_dt[self.rho >= RHO_1] = (RHO_I - self.rho[self.rho >= RHO_1]) * M_1 * ar2 * A_instant * GRAVITY * np.exp(-Ec / (R * self.Tz[self.rho >= RHO_1])+ Eg / (R * self.T10m))
+            dr_dt[z1] = (RHO_I - self.rho[z1]) * M_0 * ar1 * A_instant * GRAVITY * np.exp(-Ec / (R * self.Tz[z1]) + Eg / (R * self.T10m))
+            dr_dt[z2] = (RHO_I - self.rho[z2]) * M_1 * ar2 * A_instant * GRAVITY * np.exp(-Ec / (R * self.Tz[z2])+ Eg / (R * self.T10m))
 
         elif self.bdot_type == 'mean':
-            A_mean_1 = self.bdot_mean[self.rho < RHO_1] * RHO_I
-            A_mean_2 = self.bdot_mean[self.rho >= RHO_1] * RHO_I
+            A_mean_1 = self.accumulation(RHO_I)[z1]
+            A_mean_2 = self.accumulation(RHO_I)[z2]
 
             # print "Amean", A_mean_1[0:10]
 
@@ -599,14 +758,14 @@ class FirnPhysics:
             M_0[M_0<0.25]=0.25
             M_1[M_1<0.25]=0.25
 
-            dr_dt[self.rho < RHO_1]  = (RHO_I - self.rho[self.rho < RHO_1]) * M_0 * ar1 * A_mean_1 * GRAVITY * np.exp(-Ec / (R * self.Tz[self.rho < RHO_1]) + Eg / (R * self.T10m))
-            dr_dt[self.rho >= RHO_1] = (RHO_I - self.rho[self.rho >= RHO_1]) * M_1 * ar2 * A_mean_2 * GRAVITY * np.exp(-Ec / (R * self.Tz[self.rho >= RHO_1]) + Eg / (R * self.T10m))
+            dr_dt[z1] = (RHO_I - self.rho[z1]) * M_0 * ar1 * A_mean_1 * GRAVITY * np.exp(-Ec / (R * self.Tz[z1]) + Eg / (R * self.T10m))
+            dr_dt[z2] = (RHO_I - self.rho[z2]) * M_1 * ar2 * A_mean_2 * GRAVITY * np.exp(-Ec / (R * self.Tz[z2]) + Eg / (R * self.T10m))
 
         elif self.bdot_type == 'stress':
             # A_mean_1 = self.bdot_mean[self.rho < RHO_1] * RHO_I
             # A_mean_2 = self.bdot_mean[self.rho >= RHO_1] * RHO_I
-            A_mean_1 = self.mass[self.rho < RHO_1]*10
-            A_mean_2 = self.mass[self.rho >= RHO_1]*10
+            A_mean_1 = self.mass[z1]*10
+            A_mean_2 = self.mass[z2]*10
             # print "Amean", A_mean_1[0:10]
 
             M_0 = 1.042 - 0.0916 * np.log(A_mean_1)
@@ -621,16 +780,17 @@ class FirnPhysics:
             M_0[M_0<0.25]=0.25
             M_1[M_1<0.25]=0.25
 
-            dr_dt[self.rho < RHO_1]  = (RHO_I - self.rho[self.rho < RHO_1]) * M_0 * ar1 * A_mean_1 * GRAVITY * np.exp(-Ec / (R * self.Tz[self.rho < RHO_1]) + Eg / (R * self.T10m))
-            dr_dt[self.rho >= RHO_1] = (RHO_I - self.rho[self.rho >= RHO_1]) * M_1 * ar2 * A_mean_2 * GRAVITY * np.exp(-Ec / (R * self.Tz[self.rho >= RHO_1]) + Eg / (R * self.T10m))
+            dr_dt[z1] = (RHO_I - self.rho[z1]) * M_0 * ar1 * A_mean_1 * GRAVITY * np.exp(-Ec / (R * self.Tz[z1]) + Eg / (R * self.T10m))
+            dr_dt[z2] = (RHO_I - self.rho[z2]) * M_1 * ar2 * A_mean_2 * GRAVITY * np.exp(-Ec / (R * self.Tz[z2]) + Eg / (R * self.T10m))
 
         drho_dt = dr_dt / S_PER_YEAR
-        drho_dt[self.rho>=RHO_I] = 0
+        drho_dt[self.zones(RHO_I)[1]] = 0
         # self.viscosity = np.ones(self.gridLen)
         self.RD['drho_dt'] = drho_dt
         return self.RD
         # return drho_dt
 
+    @densification('Goujon2003', inputs = ['sigma', 'T10m'])
     def Goujon_2003(self):
         '''
 
@@ -639,8 +799,6 @@ class FirnPhysics:
         :return:
         '''
 
-        global Gamma_Gou, Gamma_old_Gou, Gamma_old2_Gou, ind1_old
-
         atmosP = 101325.0 # Atmospheric Pressure
         dDdt        = np.zeros(self.gridLen) # Capital D is change in relative density
 
@@ -671,7 +829,7 @@ class FirnPhysics:
         Dm          = D[ind1] #actual transition relative density. Use this so that the transition falls at a node
         Dmrho      = Dm * rhoi2 #density of first node, zone 2
 
-        A           = 7.89e3 * np.exp(-Qgj/(R * self.Tz)) * 1.0e-3 # A given in MPa^-3 s^-1, Goujon uses bar as pressure unit. Eq. A5 in Goujon
+        A           = 7.89e3 * self.arrhenius(Qgj) * 1.0e-3 # A given in MPa^-3 s^-1, Goujon uses bar as pressure unit. Eq. A5 in Goujon
         ccc         = 15.5 # no units given, equation A7, given as c
         Z0g         = 110.2 * D0 ** 3.-148.594 * D0 ** 2.+87.6166 * D0-17. # from Anais' code           
         lp          = (D/D0) ** (1.0/3.0) # A6
@@ -684,47 +842,40 @@ class FirnPhysics:
 
         gamma_An=(5.3*A[ind1] * (Dms**2*D0)**(1.0/3.0) * (a[ind1]/np.pi)**(1.0/2.0) * (sigmastar[ind1]/3.0)**n) / ((sigma_bar[ind1]/(Dms**2))*(1-(5.0/3.0*Dms))); 
 
-        if self.iii == 0 or ind1 != ind1_old:
-            Gamma_Gou       = 0.5 / S_PER_YEAR
-            Gamma_old_Gou   = Gamma_Gou
-        else:
-            Gamma_Gou       = Gamma_old_Gou
+        ### Gamma_Gou is found so that dDdt is continuous between ind1 (zone 1, proportional to Gamma_Gou)
+        ### and ind1+1 (zone 2, independent of Gamma_Gou); only these two nodes are needed to find it.
+        dDdt_1      = (sigma_bar[ind1])*(1.0-(5.0/3.0)*D[ind1])/((D[ind1])**2.0) # zone 1 rate at ind1 for Gamma_Gou = 1
+        dDdt_2      = 5.3*A[ind1+1]* (((D[ind1+1]**2.0)*D0)**(1/3.)) * (a[ind1+1]/np.pi)**(1.0/2.0) * (sigmastar[ind1+1]/3.0)**n
+        continuity  = lambda Gamma: Gamma * dDdt_1 - dDdt_2
 
-        dDdt[0:ind1+1]=Gamma_Gou*(sigma_bar[0:ind1+1])*(1.0-(5.0/3.0)*D[0:ind1+1])/((D[0:ind1+1])**2.0)
-        dDdt[ind1+1:]=5.3*A[ind1+1:]* (((D[ind1+1:]**2.0)*D0)**(1/3.)) * (a[ind1+1:]/np.pi)**(1.0/2.0) * (sigmastar[ind1+1:]/3.0)**n         
-        gfrac       = 0.03
-        gam_div     = 1 + gfrac #change this if want: making it larger will make the code run faster. Must be >=1.
+        if self.iii == 0 or not hasattr(self, 'Gamma_Gou'):
+            self.Gamma_Gou  = 0.5 / S_PER_YEAR
         
-        ########## iterate to increase gamma first if not in steady state    
-        if self.iii != 0 and dDdt[ind1] <= dDdt[ind1+1] and Gamma_Gou!=Gamma_old2_Gou: #and dDdt_old[ind1]!=dDdt_old[ind1]:
-            cc = 1
-            while dDdt[ind1] < dDdt[ind1 + 1]:
-                Gamma_Gou       = Gamma_Gou * (gam_div)
-                dDdt[0:ind1+1]=Gamma_Gou*(sigma_bar[0:ind1+1])*(1.0-(5.0/3.0)*D[0:ind1+1])/((D[0:ind1+1])**2.0)
-                dDdt[ind1+1:]=5.3*A[ind1+1:]* (((D[ind1+1:]**2.0)*D0)**(1/3.)) * (a[ind1+1:]/np.pi)**(1.0/2.0) * (sigmastar[ind1+1:]/3.0)**n
-
-                cc = cc + 1
-                if cc>10000:
-                    print('Goujon is not converging. exiting')
-                    sys.exit()
-
-        ### then iterate to find the maximum value of gamma that will make a continuous drho/dt
-        counter = 1
-        while dDdt[ind1] >= dDdt[ind1 + 1]:
-            # print 'iterating', counter
-            Gamma_Gou       = Gamma_Gou / (1 + gfrac/2.0)
-            dDdt[0:ind1+1]=Gamma_Gou*(sigma_bar[0:ind1+1])*(1.0-(5.0/3.0)*D[0:ind1+1])/((D[0:ind1+1])**2.0)
-            dDdt[ind1+1:]=5.3*A[ind1+1:]* (((D[ind1+1:]**2.0)*D0)**(1/3.)) * (a[ind1+1:]/np.pi)**(1.0/2.0) * (sigmastar[ind1+1:]/3.0)**n
-            counter = counter +1
-            if counter>10000:
+        ### bracket the root, starting from the Gamma_Gou of the last time step of this column
+        gam_div     = 2.0
+        Gamma_lo    = self.Gamma_Gou
+        Gamma_hi    = self.Gamma_Gou
+        counter     = 1
+        while continuity(Gamma_lo) > 0 or continuity(Gamma_hi) < 0:
+            if continuity(Gamma_lo) > 0:
+                Gamma_lo    = Gamma_lo / gam_div
+            if continuity(Gamma_hi) < 0:
+                Gamma_hi    = Gamma_hi * gam_div
+            counter = counter + 1
+            if counter>1000:
                 print('Goujon is not converging. exiting')
                 sys.exit()
+        if Gamma_lo == Gamma_hi:
+            self.Gamma_Gou  = Gamma_lo
+        else:
+            self.Gamma_Gou  = brentq(continuity, Gamma_lo, Gamma_hi, xtol = 1.0e-12 * Gamma_lo)
+        Gamma_Gou   = self.Gamma_Gou
+
+        dDdt[0:ind1+1]=Gamma_Gou*(sigma_bar[0:ind1+1])*(1.0-(5.0/3.0)*D[0:ind1+1])/((D[0:ind1+1])**2.0)
+        dDdt[ind1+1:]=5.3*A[ind1+1:]* (((D[ind1+1:]**2.0)*D0)**(1/3.)) * (a[ind1+1:]/np.pi)**(1.0/2.0) * (sigmastar[ind1+1:]/3.0)**n
 
         if self.iii<10:
             print('dDdt',dDdt[ind1:ind1+2])
-        Gamma_old2_Gou  = Gamma_old_Gou
-        Gamma_old_Gou  = Gamma_Gou
-        ind1_old = ind1
         #####################
         
         rhoC        = RHO_2 #should be Martinerie density
@@ -744,7 +895,7 @@ class FirnPhysics:
         ind3 = ind2 + 10
 
         dDdt[D>Dm23] = 2.*A[D>Dm23] * ( (D[D>Dm23]*(1-D[D>Dm23])) / (1-(1-D[D>Dm23])**(1/n))**n ) * (2*sigmaEff[D>Dm23]/n)**3.0
-        Ad              = 1.2e3 * np.exp(-Qgj / (R * self.Tz)) * 1.0e-1
+        Ad              = 1.2e3 * self.arrhenius(Qgj) * 1.0e-1
         T34             = 0.98
         dDdt[D>T34] = 9/4*Ad[D>T34]*(1-D[D>T34])*sigmaEff[D>T34]
 
@@ -755,6 +906,7 @@ class FirnPhysics:
         self.RD['drho_dt'] = drho_dt
         return self.RD
 
+    @densification('Crocus', inputs = ['sigma'])
     def Crocus(self):
         '''
 
@@ -792,6 +944,17 @@ class FirnPhysics:
         :return r2:
         '''
 
+        dr2_dt  = self.grainGrowthRate()
+        r2      = self.r2 + dr2_dt * self.dt
+        r2      = np.concatenate(([self.grainSurface()], r2[:-1]))
+
+        return r2, dr2_dt
+
+    def grainGrowthRate(self):
+        '''
+        :return dr2_dt: rate of change of the squared grain radius, m^2/s
+        '''
+
         kgr = 1.3e-7 # grain growth rate from Arthern (2010), m^2/s
         Eg  = 42.4e3 # kJ/mol
 
@@ -803,12 +966,17 @@ class FirnPhysics:
             if self.GrGrowPhysics == 'Katsushima':
                 dr2_dt = 1e-9/(4*(self.r2)**0.5)*np.minimum(2/(np.pi)*(1.28e-8+4.22e-10*(sat*((1000*(RHO_I-self.rho)/(self.rho*RHO_I))*100))**3),6.94e-8)
             elif self.GrGrowPhysics == 'Arthern':
-                dr2_dt = kgr * np.exp(-Eg / (R * self.Tz))
+                dr2_dt = kgr * self.arrhenius(Eg)
 
         else: # no MELT
-            dr2_dt = kgr * np.exp(-Eg / (R * self.Tz)) #Arthern et al., 2010 grain growth, units are m^2/s
+            dr2_dt = kgr * self.arrhenius(Eg) #Arthern et al., 2010 grain growth, units are m^2/s
 
-        r2 = self.r2 + dr2_dt * self.dt
+        return dr2_dt
+
+    def grainSurface(self):
+        '''
+        :return r2_surface: squared grain radius of the new surface node, m^2
+        '''
 
         if self.calcGrainSize: # Apply initial grain size parameterisation from Linow et al., 2012: eqs (11) and (12)
             # uses mean annual T in [C] and mean annual bdot in [m w.e. yr-1]
@@ -817,25 +985,170 @@ class FirnPhysics:
             b1Lnw = 0.0085
             b2Lnw = -0.279
             
-            r2_surface = ((b0Lnw+b1Lnw*(self.Ts[self.iii]-K_TO_C) + b2Lnw*(self.bdot_mean[0]*RHO_I/1000))*10**(-3))**2
-            r2 = np.concatenate(([r2_surface], r2[:-1]))
+            r2_surface = ((b0Lnw+b1Lnw*(self.Ts[self.iii]-K_TO_C) + b2Lnw*(self.bdot_mean[..., 0]*RHO_I/1000))*10**(-3))**2
 
             # r2 = np.concatenate(([-2.42e-9 * self.Ts[self.iii] + 9.46e-7], r2[:-1])) # legacy code. Not sure where this equation is from. Gow 1967ish?
 
         else: # use a fixed surface value, r2s0.
 
-            r2 = np.concatenate(([self.r2s0 ** 2], r2[:-1])) # Rob Arthern's recommended value, personal communication.
+            r2_surface = self.r2s0 ** 2 # Rob Arthern's recommended value, personal communication.
 
-        return r2, dr2_dt
+        return r2_surface
 
     def THistory(self):
-        self.Hx = self.Hx + np.exp(-110.0e3 / (R * self.Tz)) * self.dt
-        Hx_new  = np.exp(-110.0e3 / (R * self.Tz[0])) * self.dt 
-        self.Hx = np.concatenate(([Hx_new],self.Hx[:-1]))
-        return self.Hx
+        Hx      = self.Hx + self.arrhenius(110.0e3) * self.dt
+        Hx_new  = self.arrhenius(110.0e3)[0] * self.dt 
+        Hx      = np.concatenate(([Hx_new],Hx[:-1]))
+        return Hx
+
+### physics with a compiled kernel (kernels.py), used with "kernelBackend": "numba" -> DensificationEngine method
+NUMBA_PHYSICS = {
+    'HLdynamic':            'HL_dynamic_numba',
+    'Arthern2010S':         'Arthern_2010S_numba',
+    'Ligtenberg2011':       'Ligtenberg_2011_numba',
+    'KuipersMunneke2015':   'KuipersMunneke_2015_numba',
+    'Crocus':               'Crocus_numba',
+}
+
+class DensificationEngine(FirnPhysics):
+    '''
+    The densification physics bound to one model run (spin or nospin).
+
+    The physics method is looked up once from 'physRho'. Any parameter that the
+    physics uses and that is not set here (rho, Tz, sigma, bdot_mean, T10m, Hx, ...)
+    is read from the model when it is needed, so the physics always sees the
+    current column without copying it into a dictionary every time step.
+
+    fields is the set of derived fields (DERIVED_FIELDS) that the model has to
+    update every time step: the inputs of the physics, the ones the grain growth
+    reads, and the ones written as outputs. The others keep their initial values.
+    '''
+
+    def __init__(self, model, physRho=None, outputs=()):
+        '''
+        :param model: the FirnDensitySpin or FirnDensityNoSpin instance
+        :param physRho: name of the densification physics; defaults to model.c['physRho']
+        :param outputs: names of the outputs of the run; derived fields in it are kept up to date
+        '''
 
+        self.model          = model
+        self.RD             = {}
+        self.stepCache      = {}
+
+        if physRho is None:
+            physRho         = model.c['physRho']
+        spec                = physics_spec(physRho)
+        self.physics        = getattr(self, spec['method'])
+        self.physRho        = physRho
+
+        self.steps          = 1 / model.t
+        self.bdot_type      = model.c['bdot_type']
+        if model.kernelBackend == 'numba' and physRho in NUMBA_PHYSICS and self.bdot_type in ['instant', 'mean']:
+            self.physics    = getattr(self, NUMBA_PHYSICS[physRho])
+        self.physGrain      = bool(model.c['physGrain'])
+        self.calcGrainSize  = bool(model.c['calcGrainSize'])
+        self.r2s0           = model.c['r2s0']
+        self.GrGrowPhysics  = model.c['GrGrowPhysics']
+
+        if 'r2' in spec['state'] and not self.physGrain:
+            raise ValueError('physRho = %s needs the grain size; set physGrain to true' %physRho)
+
+        self.fields         = set(spec['inputs'])
+        if self.bdot_type != 'mean': # A_instant and the stress do not use bdot_mean
+            self.fields.discard('bdot_mean')
+        if self.physGrain and self.calcGrainSize: # surface grain size from the mean accumulation
+            self.fields.add('bdot_mean')
+        self.fields.update(field for field in outputs if field in DERIVED_FIELDS)
+
+        self.drho_dt        = np.zeros(model.gridLen)
+        self.dr2_dt         = None
+        self.r2_surface     = None
+
+    def __getattr__(self, name):
+        if name == 'model':
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def rateBuffer(self):
+        self.drho_dt.fill(0.0)
+        return self.drho_dt
+
+    ### the physics below give the same rates as the FirnPhysics methods, with the kernels of kernels.py
+
+    def HL_dynamic_numba(self):
+        A = self.accumulation(RHO_I_MGM)
+        if self.bdot_type == 'instant':
+            A = np.full(len(self.rho), A)
+        self.RD['drho_dt'] = hl_rate(self.rho, self.Tz, A, self.rateBuffer())
+        return self.RD
 
+    def Arthern_2010S_numba(self):
+        if self.bdot_type == 'instant':
+            if self.iii==0:
+                print("It is not recommended to use instant accumulation with Arthern 2010 physics")
+            A = np.full(len(self.rho), self.accumulation(RHO_I_MGM, 1000))
+        else:
+            A = self.accumulation(RHO_I_MGM, 1000)
+        self.RD['drho_dt'] = arthern_rate(self.rho, self.Tz, float(self.T10m), A, 1.0, 0.0, 1.0, 0.0, False, False, self.rateBuffer())
+        return self.RD
 
+    def Ligtenberg_2011_numba(self):
+        if self.bdot_type == 'instant':
+            if self.iii==0:
+                print("It is not recommended to use instant accumulation with Ligtenberg 2011 physics")
+            A = np.full(len(self.rho), self.accumulation(RHO_I_MGM, 1000))
+        else:
+            A = self.accumulation(RHO_I)
+        self.RD['drho_dt'] = arthern_rate(self.rho, self.Tz, float(self.T10m), A, 1.435, 0.151, 2.366, 0.293, True, False, self.rateBuffer())
+        return self.RD
 
+    def KuipersMunneke_2015_numba(self):
+        if self.bdot_type == 'instant':
+            if self.iii==0:
+                print("It is not recommended to use instant accumulation with Ligtenberg 2011 physics")
+            A = np.full(len(self.rho), self.accumulation(RHO_I_MGM, 1000))
+        else:
+            A = self.accumulation(RHO_I)
+        self.RD['drho_dt'] = arthern_rate(self.rho, self.Tz, float(self.T10m), A, 1.042, 0.0916, 1.734, 0.2039, True, True, self.rateBuffer())
+        return self.RD
+
+    def Crocus_numba(self):
+        self.RD['drho_dt'] = crocus_rate(self.rho, self.Tz, self.sigma, self.rateBuffer())
+        return self.RD
+
+    def compute(self, iii):
+        '''
+        Densification rate for time step iii, with the column at the start of the step.
+        If physGrain is on, the grain growth rate is found at the same time (see growGrains).
+
+        :param iii: time step
+
+        :return drho_dt: densification rate (kg m^-3 s^-1). This array is reused every step.
+        '''
+
+        self.iii    = iii
+        self.rhos0  = self.model.rhos0[iii]
+        self.stepCache.clear() # the zones, Arrhenius factors and accumulation rates of this step (also used by THistory)
+
+        drho_dt     = self.physics()['drho_dt']
+        if drho_dt is not self.drho_dt:
+            self.drho_dt[:] = drho_dt
+
+        if self.physGrain:
+            self.dr2_dt     = self.grainGrowthRate()
+            self.r2_surface = self.grainSurface()
+
+        return self.drho_dt
+
+    def growGrains(self):
+        '''
+        Apply the grain growth found in compute and add the new surface grain.
+
+        :return r2:
+        :return dr2_dt:
+        '''
 
+        r2 = self.model.r2 + self.dr2_dt * self.dt
+        r2 = np.concatenate(([self.r2_surface], r2[:-1]))
 
+        return r2, self.dr2_dt
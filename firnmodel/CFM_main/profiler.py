@@ -0,0 +1,84 @@
+import numpy as np
+import time
+
+class Profiler:
+    '''
+    Wall-clock time and number of calls of each stage of the time step of a main run
+    (physics, heat, melt, firn air, ...), and a histogram of the number of nodes in the
+    column at each step.
+
+    Turned on with "profile": 1 in the json. The profile is printed at the end of the run
+    and written to the 'profile' group of the results file. When it is off, start and lap
+    do nothing, so the stages can stay timed in the model code.
+
+    Usage in a time step:
+        t0 = self.profiler.start()
+        ... densification ...
+        t0 = self.profiler.lap('physics', t0)
+        ... heat diffusion ...
+        t0 = self.profiler.lap('heat', t0)
+    '''
+
+    def __init__(self, enabled=True):
+        self.enabled    = enabled
+        self.time       = {} # stage -> seconds
+        self.calls      = {} # stage -> number of calls
+        self.nodes      = {} # number of nodes -> number of steps
+
+    def start(self):
+        '''
+        :return t0: time at which the next stage starts
+        '''
+        if not self.enabled:
+            return 0.0
+        return time.perf_counter()
+
+    def lap(self, stage, t0):
+        '''
+        add the time since t0 to a stage
+
+        :param stage: name of the stage
+        :param t0: time at which the stage started (from start or the previous lap)
+
+        :return t1: time at which the next stage starts
+        '''
+        if not self.enabled:
+            return t0
+        t1 = time.perf_counter()
+        self.time[stage]    = self.time.get(stage, 0.0) + (t1 - t0)
+        self.calls[stage]   = self.calls.get(stage, 0) + 1
+        return t1
+
+    def count_nodes(self, n):
+        '''
+        :param n: number of nodes in the column at this step
+        '''
+        if self.enabled:
+            self.nodes[n] = self.nodes.get(n, 0) + 1
+
+    def report(self):
+        '''
+        print the time spent in each stage
+        '''
+        if not self.enabled:
+            return
+        total = sum(self.time.values())
+        print('%-16s %10s %8s %12s %7s' %('stage', 'time (s)', '%', 'calls', 'us/call'))
+        for stage in sorted(self.time, key = self.time.get, reverse = True):
+            print('%-16s %10.3f %8.1f %12d %7.1f' %(stage, self.time[stage], 100 * self.time[stage] / max(total, 1e-12), self.calls[stage], 1e6 * self.time[stage] / self.calls[stage]))
+        print('%-16s %10.3f' %('total', total))
+        if self.nodes:
+            print('nodes in the column: %s to %s' %(min(self.nodes), max(self.nodes)))
+
+    def write(self, f4):
+        '''
+        write the profile to the 'profile' group of an open hdf5 file (or group)
+        '''
+        if not self.enabled:
+            return
+        stages  = list(self.time)
+        prof    = f4.create_group('profile')
+        prof.create_dataset('stage', data = np.array(stages, dtype = 'S'))
+        prof.create_dataset('time', data = np.array([self.time[stage] for stage in stages]))
+        prof.create_dataset('calls', data = np.array([self.calls[stage] for stage in stages]))
+        prof.create_dataset('nodes', data = np.array(sorted(self.nodes.items()), dtype = 'int64').reshape(-1, 2)) # number of nodes, number of steps
@@ -2,13 +2,74 @@ import os
 import numpy as np
 # from string import join
 from constants import *
+import hashlib
+import json
 import h5py
+from climate import ClimateCube, JSON_VARIABLES
 
-def read_input(filename):
+'''
+Forcing cache: if 'forcingCacheFolder' is in the .json, each input csv file is
+parsed once and stored in that folder as a .npy file, under a key that is a hash
+of the path, size and modification time of the csv. Later reads of the same file
+(by any run, spin or not) map the .npy file instead of parsing the text again.
+Changing the csv changes its key, so an old entry is never used for a new file.
+
+For campaigns over many sites, write_forcing_store puts the forcing of many csv
+files into one HDF5 file, and read_forcing_store maps them all from it.
+'''
+
+def forcing_cache(c):
+    '''
+    :param c: dictionary of the json config
+
+    :return cacheFolder: the folder of the forcing cache, or None if the .json does not have one
+    '''
+    try:
+        return c['forcingCacheFolder']
+    except KeyError:
+        return None
+
+def forcing_key(FID):
+    '''
+    :param FID: path of an input csv file
+
+    :return key: hash of the path, size and modification time of the file
+    '''
+    st = os.stat(FID)
+    return hashlib.sha1(json.dumps([os.path.abspath(FID), st.st_size, st.st_mtime_ns]).encode()).hexdigest()
+
+def load_cached(FID, cacheFolder):
+    '''
+    Contents of an input csv file, from the forcing cache if it is there (parsing
+    the file and adding it to the cache if it is not).
+
+    The cached array is memory-mapped copy-on-write: it is not copied when it is
+    read, and changing it does not change the cache.
+
+    :param FID: path of the input csv file
+    :param cacheFolder: folder of the forcing cache
+
+    :return data: (rows x columns) array of the csv
+    '''
+    entry = os.path.join(cacheFolder, forcing_key(FID) + '.npy')
+    if os.path.isfile(entry):
+        return np.load(entry, mmap_mode = 'c')
+
+    data = np.loadtxt(FID, delimiter=',')
+    if not os.path.exists(cacheFolder):
+        os.makedirs(cacheFolder, exist_ok = True)
+    tmp = entry + '.%d.tmp' %os.getpid() # so that a run reading the cache never sees a partly written file
+    with open(tmp, 'wb') as f:
+        np.save(f, data)
+    os.replace(tmp, entry)
+    return data
+
+def read_input(filename, cacheFolder=None):
     '''
     Read in data from csv input files
 
     :param file: name of the file which holds the accumulation rate data
+    :param cacheFolder: folder of the forcing cache (see forcing_cache); if None, the csv is parsed
 
     :return input_bdot: accumulation rate vector from a specified csv file
     :return input_year_bdot: corresponding time vector (in years)
@@ -16,12 +77,105 @@ def read_input(filename):
     spot = os.getcwd()
 
     FID        = os.path.join(spot, filename)
-    data       = np.loadtxt(FID, delimiter=',') #changed 3/6/17 to loadtxt from genfromtxt; much faster
+    if cacheFolder is None:
+        data   = np.loadtxt(FID, delimiter=',') #changed 3/6/17 to loadtxt from genfromtxt; much faster
+    else:
+        data   = np.asarray(load_cached(FID, cacheFolder))
     input_year = data[0, :]
     input_data = data[1, :]
 
     return input_data, input_year
 
+def read_climate(c, variable):
+    '''
+    Temperature or accumulation forcing of a run: from the site 'climateSite' of the
+    climate cube 'climateCube' if the .json has one (see climate.py), otherwise from the
+    csv file InputFileName<variable> in InputFileFolder.
+
+    :param c: dictionary of the json config
+    :param variable: 'Temp' or 'bdot'
+
+    :return input_data, input_year: as read_input
+    '''
+    if 'climateCube' in c:
+        with ClimateCube(c['climateCube']) as cube:
+            return cube.read_input(c['climateSite'], JSON_VARIABLES[variable])
+    return read_input(os.path.join(c['InputFileFolder'], c['InputFileName' + variable]), forcing_cache(c))
+
+def read_forcing(c, variable, inputs=None):
+    '''
+    Forcing of a run, given in memory or read from its input file.
+
+    :param c: dictionary of the json config
+    :param variable: 'Temp', 'bdot', 'melt', 'Iso' or 'srho' (as in InputFileName<variable> in the .json)
+    :param inputs: dictionary of variable -> (input_data, input_year), e.g. from cfm.run;
+                   the variables that are not in it are read from the input files
+
+    :return input_data, input_year: as read_input
+    '''
+    if inputs is not None and variable in inputs:
+        input_data, input_year = inputs[variable]
+        return np.array(input_data, dtype = float), np.array(input_year, dtype = float) # copies; the run changes some of the forcing in place
+    if variable in JSON_VARIABLES:
+        return read_climate(c, variable)
+    if variable == 'melt':
+        return read_input(os.path.join(c['InputFileFolder'], c['InputFileNamemelt']), forcing_cache(c))
+    return read_input(c['InputFileName' + variable], forcing_cache(c))
+
+def write_forcing_store(storeFile, filenames, names=None):
+    '''
+    Put the forcing of many input csv files into one HDF5 file, one contiguous
+    dataset per file, so that read_forcing_store can map them.
+
+    :param storeFile: path of the HDF5 file
+    :param filenames: input csv files
+    :param names: name of the dataset of each file; defaults to the file name without its extension
+    '''
+    if names is None:
+        names = [os.path.splitext(os.path.basename(filename))[0] for filename in filenames]
+    if len(set(names)) != len(names):
+        raise ValueError('the forcing store needs a different name for each file')
+
+    tmp = storeFile + '.%d.tmp' %os.getpid()
+    with h5py.File(tmp, 'w') as f5:
+        for filename, name in zip(filenames, names):
+            data = np.loadtxt(filename, delimiter=',')
+            dset = f5.create_dataset(name, data = data)
+            dset.attrs['source'] = os.path.abspath(filename)
+    os.replace(tmp, storeFile)
+
+def read_forcing_store(storeFile, names=None):
+    '''
+    Read the forcing of many input files from a file written by write_forcing_store.
+    The datasets are memory-mapped copy-on-write, like the forcing cache.
+
+    :param storeFile: path of the HDF5 file
+    :param names: datasets to read; defaults to all of them
+
+    :return forcing: dictionary of name -> (input_data, input_year), as returned by read_input
+    '''
+    layout = {}
+    with h5py.File(storeFile, 'r') as f5:
+        if names is None:
+            names = list(f5.keys())
+        for name in names:
+            dset    = f5[name]
+            offset  = dset.id.get_offset()
+            if offset is None or dset.chunks is not None: # not stored as one block; read it
+                layout[name] = dset[:]
+            else:
+                layout[name] = (offset, dset.dtype, dset.shape)
+
+    forcing = {}
+    for name in names:
+        if isinstance(layout[name], np.ndarray):
+            data = layout[name]
+        else:
+            offset, dtype, shape = layout[name]
+            data = np.asarray(np.memmap(storeFile, dtype = dtype, mode = 'c', offset = offset, shape = shape))
+        forcing[name] = (data[1, :], data[0, :])
+    return forcing
+
 def read_init(folder, resultsFileName, varname):
 
     '''
@@ -36,6 +190,65 @@ def read_init(folder, resultsFileName, varname):
 
     return init_value
 
+### fields of SpinState -> dataset in the spin file
+SPIN_DATASETS = {
+    'depth':    'depthSpin',
+    'age':      'ageSpin',
+    'density':  'densitySpin',
+    'temp':     'tempSpin',
+    'r2':       'r2Spin',
+    'Hx':       'HxSpin',
+    'iso':      'IsoSpin',
+    'grid':     'gridSpin',
+    'residual': 'spinResidual',
+}
+
+class SpinState:
+    '''
+    The column at the end of a spin up, i.e. the contents of the spin file.
+
+    Each field is as in the spin file (the spin up time, then one value per node),
+    or None if the spin up did not write it (e.g. r2 without physGrain). The spin
+    up (firn_density_spin.py) keeps its state as spinState, so a main run in the
+    same process can start from it without reading the spin file (see the spinState
+    argument of FirnDensityNoSpin).
+    '''
+
+    def __init__(self, depth, age, density, temp, r2=None, Hx=None, iso=None, grid=None, residual=None):
+        self.depth      = depth
+        self.age        = age
+        self.density    = density
+        self.temp       = temp
+        self.r2         = r2
+        self.Hx         = Hx
+        self.iso        = iso
+        self.grid       = grid
+        self.residual   = residual
+
+    def need(self, name):
+        '''
+        :param name: field of the state (see SPIN_DATASETS)
+
+        :return value: the field; KeyError if the spin up did not write it
+        '''
+        value = getattr(self, name)
+        if value is None:
+            raise KeyError('the spin up did not write %s; run the spin up with the settings of the main run' %SPIN_DATASETS[name])
+        return value
+
+def read_spin(folder, spinFileName):
+    '''
+    Read the whole spin file, opening it once.
+
+    :param folder: folder of the spin file
+    :param spinFileName: name of the spin file
+
+    :return spinState: SpinState with all of the fields in the file
+    '''
+    with h5py.File(os.path.join(folder, spinFileName), 'r') as f5:
+        fields = dict((name, f5[dataset][:]) for name, dataset in SPIN_DATASETS.items() if dataset in f5)
+    return SpinState(**fields)
+
 
 # def read_snowmelt(file):
 #     '''
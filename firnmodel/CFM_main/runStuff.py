@@ -6,21 +6,34 @@ Created on Fri May 18 11:14:50 2018
 @author: GalinaJonat
 """
 
-# Script to run all models in parallel
-import subprocess
+# Script to run all models in parallel (on a pool of worker processes, see campaign.py)
 from plotDrhoDt import dip100
+from campaign import config_job, run_campaign, report
 import os
-from threading import Thread
+import json
 
 experiments = ['exp'+str(x) for x in range(1,7)]
 models = ["Arthern2010S","HLdynamic","HLSigfus","Li2011","Helsen2008","Goujon2003","Barnola1991","KuipersMunneke2015","Crocus", 'Simonsen2013',"Arthern2010T",]#TODO: ,"Morris2014"
 sites = ['site'+str(x) for x in range(1,4)]
 
 def generatePaperOutput():
+    jobs = [config_job('experimentSetups/'+e+'Setup_'+m+'.json') for e in experiments for m in models]
+    report(run_campaign(jobs))
+
+def generatePaperOutputOnePass():
+    # all models of an experiment in one process, over the same forcing (see multiphysics.py)
+    jobs = []
     for e in experiments:
-        for m in models:
-            cmd = ['python', 'main.py', 'experimentSetups/'+e+'Setup_'+m+'.json']
-            subprocess.Popen(cmd)
+        with open('experimentSetups/'+e+'Setup_'+models[0]+'.json', 'r') as f:
+            c = json.load(f)
+        c['physRho'] = models
+        c['resultsFileName'] = 'CFM'+e+'resultsAll.hdf5'
+        c['spinFileName'] = 'CFM'+e+'spin.hdf5'
+        configName = 'experimentSetups/'+e+'Setup_all.json'
+        with open(configName, 'w') as outfile:
+            outfile.write(json.dumps(c, indent=4))
+        jobs.append((e+'_all', c))
+    report(run_campaign(jobs))
 
 def plotDIPforAll():
     e = 'exp1'
@@ -28,24 +41,21 @@ def plotDIPforAll():
         dip100('CFMexperiments', 'CFM'+e+"results"+m+".hdf5")
 
 def generatePaperOutput15000():
-    for e in experiments:
-        for m in models:
-            cmd = ['python', 'main.py', 'experimentSetups15000/'+e+'Setup_'+m+'.json']
-            subprocess.Popen(cmd)
-
-def call_script(*arg):
-    subprocess.call(arg)           
-
-
-def realExperiment2(setupFolder='setupInput2/', sites=sites):
-    t = {}
-    for s in sites:
-        for m in models:
-            cmd = ['python', 'main.py', os.path.join(setupFolder, s+'_Setup_'+m+'.json')]
-            #subprocess.Popen(cmd)
-            #subprocess.call(cmd)
-            
-            t[s+m] = Thread(target=call_script, args=cmd)
-            t[s+m].start()
-        for m in models:
-            t[s+m].join(timeout=3600)
\ No newline at end of file
+    jobs = [config_job('experimentSetups15000/'+e+'Setup_'+m+'.json') for e in experiments for m in models]
+    report(run_campaign(jobs))
+
+def realExperiment2(setupFolder='setupInput2/', sites=sites, pool=None):
+    '''
+    run all models at the sites
+
+    :param pool: CampaignPool to run on (e.g. one pool for many calls, see autoRun.py); a new pool if None
+
+    :return results: result of each run (see campaign.py)
+    '''
+    jobs = [config_job(os.path.join(setupFolder, s+'_Setup_'+m+'.json')) for s in sites for m in models]
+    if pool is None:
+        results = run_campaign(jobs, timeout=3600)
+    else:
+        results = pool.run(jobs)
+    report(results)
+    return results
@@ -1,14 +1,20 @@
 import numpy as np
 from scipy import interpolate
 import scipy.integrate
-from scipy.sparse import spdiags
-import scipy.sparse.linalg as splin
+from scipy.linalg import solve_banded
+from scipy.linalg.lapack import dgttrf, dgttrs
+from kernels import diffusion_solve
 from constants import *
 
 
 def solver(a_U, a_D, a_P, b):
     '''
     function for solving matrix problem
+    a_U[i] * phi[i-1] - a_P[i] * phi[i] + a_D[i] * phi[i+1] = -b[i]
+
+    The matrix is tridiagonal, so it is solved directly with tridiag_solve
+    (LAPACK gtsv) instead of building a sparse matrix and factorizing it.
+    2-D arrays (systems x nodes) solve a batch of systems in one call.
 
     :param a_U:
     :param a_D:
@@ -18,194 +24,337 @@ def solver(a_U, a_D, a_P, b):
     :return phi_t:
     '''
 
-    nz = np.size(b)
-
-    diags = (np.append([a_U, -a_P], [a_D], axis = 0))
-    cols = np.array([1, 0, -1])
-
-    big_A = spdiags(diags, cols, nz, nz, format = 'csc')
-    big_A = big_A.T
-
-    rhs = -b
-    phi_t = splin.spsolve(big_A, rhs)
+    phi_t = tridiag_solve(a_U, -np.asarray(a_P), a_D, -np.asarray(b))
 
     return phi_t
 
-def transient_solve_TR(z_edges, z_P_vec, nt, dt, Gamma_P, phi_0, nz_P, nz_fv, phi_s, tot_rho, airdict=None):
+class GridGeometry:
     '''
-    transient 1-d diffusion finite volume method
+    Finite-volume geometry of a grid: the nodes, the edges of the volumes, the
+    spacings and the interpolation weights of the volume faces (Patankar, 1980).
 
-    :param z_edges:
-    :param z_P_vec:
-    :param nt:
-    :param dt:
-    :param Gamma_P:
-    :param phi_0:
-    :param nz_P:
-    :param nz_fv:
-    :param phi_s:
+    It only depends on the node depths, so it is computed once per grid and shared
+    by every diffusion problem (heat, enthalpy, isotopes, each gas) that is solved
+    on that grid. The nodes run along the last axis, so a 2-D array of node depths
+    (columns x nodes, see ensemble.py) gives the geometry of a batch of columns.
 
-    :return phi_t:
+    :param z: depth of the nodes
     '''
 
-    phi_t = phi_0
+    def __init__(self, z):
+        self.z          = z
+        self.z_P        = z
+        self.nz_P       = np.shape(z)[-1]
+        self.nz_fv      = self.nz_P - 2
 
-    for i_time in range(nt):
-        Z_P = z_P_vec
-        # print(len(Z_P))
-        # dZ = np.concatenate(([1], np.diff(z_edges), [1]))
+        z_edges1        = z[..., 0:-1] + np.diff(z) / 2
+        self.z_edges    = np.concatenate((z[..., 0:1], z_edges1, z[..., -1:]), axis = -1)
 
-        # dzev = np.diff(z_edges)
-        # dZ = np.concatenate(([dzev[0]], dzev, [dzev[-1]]))
+        self.dZ         = np.diff(self.z_edges)
+        dZ_P            = np.diff(z)
+        self.dZ_u       = np.concatenate((dZ_P[..., 0:1], dZ_P), axis = -1)
+        self.dZ_d       = np.concatenate((dZ_P, dZ_P[..., -1:]), axis = -1)
 
-        dZ = np.diff(z_edges)
-        # print('dZ:', dZ)
-        # print('len dZ:', len(dZ))
+        self.f_u        = 1 - (z - self.z_edges[..., 0:-1]) / self.dZ_u
+        self.f_d        = 1 - (self.z_edges[..., 1:] - z) / self.dZ_d
+        self.g_u        = 1 - self.f_u
+        self.g_d        = 1 - self.f_d
 
+    def interface(self, Gamma_P):
+        '''
+        diffusivity at the upper and lower faces of the volumes (harmonic mean, Patankar eq. 4.9)
 
-        # if (dZ<=0).any():
-        #   ind10 = np.where(dZ<=0)[0]
-        #   print('!!!!!!')
-        #   print('ind10:',ind10)
-        #   print('z ind', Z_P[0:ind10[0]+3])
-        #   print('z z_edges', z_edges[0:ind10[0]+3])
-        #   print('dz ind', dZ[0:ind10[0]+3])
-        #   input('enter to continue')
+        :param Gamma_P: diffusivity at the nodes
 
-        dZ_u = np.diff(Z_P)
-        dZ_u = np.append(dZ_u[0], dZ_u)
-        
-        dZ_d = np.diff(Z_P)
-        dZ_d = np.append(dZ_d, dZ_d[-1])
+        :return Gamma_u:
+        :return Gamma_d:
+        '''
+        Gamma_U = np.concatenate((Gamma_P[..., 0:1], Gamma_P[..., 0:-1]), axis = -1)
+        Gamma_D = np.concatenate((Gamma_P[..., 1:], Gamma_P[..., -1:]), axis = -1)
 
-        # f_u = np.append(0, (1 - (z_P_vec[1:] - z_edges) / dZ_u[1:]))
-        # f_d = np.append(1 - (z_edges - z_P_vec[0: -1]) / dZ_d[0: -1], 0)
+        Gamma_u = 1 / (self.g_u / Gamma_P + self.f_u / Gamma_U)
+        Gamma_d = 1 / (self.g_d / Gamma_P + self.f_d / Gamma_D)
+        return Gamma_u, Gamma_d
 
-        f_u = 1 - (z_P_vec[:] - z_edges[0:-1]) / dZ_u[:]
-        f_d = 1 - (z_edges[1:] - z_P_vec[:]) / dZ_d[:]
+def grid_geometry(self):
+    '''
+    GridGeometry of the current grid of a model (self.z). It is only recomputed
+    when self.z has been replaced, i.e. after compaction, accretion, melt or
+    regridding, so all of the diffusion solves of a time step share it.
+    The grid is always replaced by a new array, never changed in place.
 
-        # Gamma_U = np.append(Gamma_P[0], Gamma_P[0: -1] )
-        # Gamma_D = np.append(Gamma_P[1:], Gamma_P[-1])
+    :return geom:
+    '''
+    geom = getattr(self, 'geometry', None)
+    if geom is None or geom.z is not self.z:
+        geom = GridGeometry(self.z)
+        self.geometry = geom
+    return geom
 
-        # Gamma_u =  1 / ((1 - f_u) / Gamma_P + f_u / Gamma_U)
-        # Gamma_d =  1 / ((1 - f_d) / Gamma_P + f_d / Gamma_D)
+def transient_solve_TR(geom, nt, dt, Gamma_P, phi_0, phi_s, tot_rho, airdict=None, backend='numpy'):
+    '''
+    transient 1-d diffusion finite volume method
 
-        ##################
-        if airdict!=None: # this part for gas diffusion, which takes a bit more physics
-            Gamma_Po    = Gamma_P * airdict['por_op']
-            
-            Gamma_U     = np.append(Gamma_Po[0], Gamma_Po[0: -1] )
-            Gamma_D     = np.append(Gamma_Po[1:], Gamma_Po[-1])
-            Gamma_u     =  1 / ((1 - f_u) / Gamma_Po + f_u / Gamma_U)
-            Gamma_d     =  1 / ((1 - f_d) / Gamma_Po + f_d / Gamma_D)
-
-            d_eddy_P    = airdict['d_eddy'] * airdict['por_op']
-            d_eddy_U    = np.append(d_eddy_P[0], d_eddy_P[0:-1] )
-            d_eddy_D    = np.append(d_eddy_P[1:], d_eddy_P[-1])
-            d_eddy_u    =  1/ ( (1 - f_u)/d_eddy_P + f_u/d_eddy_U )
-            d_eddy_d    =  1/ ( (1 - f_d)/d_eddy_P + f_d/d_eddy_D )
-            
-            if airdict['gravity']=="off" and airdict['thermal']=="off":
-                S_C_0   = 0.0
+    :param geom: GridGeometry of the grid
+    :param nt: number of sub-steps; the coefficients are frozen over the call, so the matrix is only factorized once
+    :param dt: length of a sub-step
+    :param Gamma_P: (nodes), or (problems x nodes) for a batch
+    :param phi_0: (nodes), or (problems x nodes) for a batch
+    :param phi_s: surface value (one per problem for a batch)
+    :param tot_rho:
+    :param backend: 'numba' solves the heat and isotope case (one column) with kernels.diffusion_solve
 
-            elif airdict['gravity']=='on' and airdict['thermal']=='off':
-                S_C_0   = (-Gamma_d + Gamma_u) * (airdict['deltaM'] * GRAVITY / (R * airdict['Tz'])) / airdict['dz'] #S_C is independent source term in Patankar
+    :return phi_t:
+    '''
 
-            elif airdict['gravity']=='on' and airdict['thermal']=='on':
-                dTdz    = np.gradient(airdict['Tz'])/airdict['dz']
-                S_C_0   = (Gamma_d-Gamma_u) * ((-airdict['deltaM'] * GRAVITY / (R * airdict['Tz'])) + (airdict['omega'] * dTdz)) / airdict['dz'] # should thermal still work in LIZ? if so use d_eddy+diffu
-            
-            S_C         = S_C_0 * phi_t # Should this be phi_0 instead?
-            b_0         = S_C * dZ
+    if backend == 'numba' and airdict is None and np.ndim(phi_0) == 1:
+        return diffusion_solve(geom.dZ, geom.dZ_u, geom.dZ_d, geom.f_u, geom.f_d, geom.g_u, geom.g_d, Gamma_P, tot_rho, phi_0, phi_s, dt, nt)
 
-            rho_edges = np.interp(z_edges,Z_P,airdict['rho'])
-            
-            w_edges = w(airdict, z_edges, rho_edges, Z_P, dZ) # advection term (upward relative motion due to porosity changing)
+    phi_t   = phi_0
 
-            w_p = np.interp(Z_P,z_edges,w_edges) # Units m/s
-            w_edges[z_edges>airdict['z_co']] = 0.0          
-            w_u = w_edges[0:-1]
-            w_d = w_edges[1:]
+    Z_P     = geom.z_P
+    z_edges = geom.z_edges
+    dZ      = geom.dZ
+    dZ_u    = geom.dZ_u
+    dZ_d    = geom.dZ_d
 
-            D_u = ((Gamma_u+d_eddy_u) / dZ_u) # Units m/s
-            D_d = ((Gamma_d+d_eddy_d) / dZ_d)   
-            F_u =  w_u * airdict['por_op'] # Units m/s
-            F_d =  w_d * airdict['por_op']
-            
-            P_u = F_u / D_u
-            P_d = F_d / D_d
-            
-            a_U = D_u * A( P_u ) + F_upwind(  F_u )
-            a_D = D_d * A( P_d ) + F_upwind( -F_d )
+    ### the operator is assembled and factorized once; the sub-steps only update the right-hand side
+    ##################
+    if airdict!=None: # this part for gas diffusion, which takes a bit more physics
+        Gamma_Po    = Gamma_P * airdict['por_op']
+        Gamma_u, Gamma_d    = geom.interface(Gamma_Po)
 
-            # a_U = D_u # 8/14/17: use this for now - check on Lagrangian need for upwinding.
-            # a_D = D_d 
+        d_eddy_P    = airdict['d_eddy'] * airdict['por_op']
+        d_eddy_u, d_eddy_d  = geom.interface(d_eddy_P)
         
-            a_P_0 = airdict['por_op'] * dZ / dt
-        #######################################
+        if airdict['gravity']=="off" and airdict['thermal']=="off":
+            S_C_0   = 0.0
 
-        else: #just for heat, isotope diffusion
-            Gamma_U = np.append(Gamma_P[0], Gamma_P[0: -1] )
-            Gamma_D = np.append(Gamma_P[1:], Gamma_P[-1])
+        elif airdict['gravity']=='on' and airdict['thermal']=='off':
+            S_C_0   = (-Gamma_d + Gamma_u) * (airdict['deltaM'] * GRAVITY / (R * airdict['Tz'])) / airdict['dz'] #S_C is independent source term in Patankar
 
-            Gamma_u =  1 / ((1 - f_u) / Gamma_P + f_u / Gamma_U) # Patankar eq. 4.9
-            Gamma_d =  1 / ((1 - f_d) / Gamma_P + f_d / Gamma_D)
+        elif airdict['gravity']=='on' and airdict['thermal']=='on':
+            dTdz    = np.gradient(airdict['Tz'])/airdict['dz']
+            S_C_0   = (Gamma_d-Gamma_u) * ((-airdict['deltaM'] * GRAVITY / (R * airdict['Tz'])) + (airdict['omega'] * dTdz)) / airdict['dz'] # should thermal still work in LIZ? if so use d_eddy+diffu
 
-            S_C = 0
-            S_C = S_C * np.ones(nz_P)
-            
-            #print('-----Solver-------') #TODO
-            #print(Gamma_P)
-            #print(Gamma_U)
-            #print(str((1 - f_u) / Gamma_P + f_u / Gamma_U))
-            #print('--------------')
+        rho_edges = np.interp(z_edges,Z_P,airdict['rho'])
+        
+        w_edges = w(airdict, z_edges, rho_edges, Z_P, dZ) # advection term (upward relative motion due to porosity changing)
 
-            D_u = (Gamma_u / dZ_u)
-            D_d = (Gamma_d / dZ_d)
+        w_p = np.interp(Z_P,z_edges,w_edges) # Units m/s
+        w_edges[z_edges>airdict['z_co']] = 0.0          
+        w_u = w_edges[0:-1]
+        w_d = w_edges[1:]
+
+        D_u = ((Gamma_u+d_eddy_u) / dZ_u) # Units m/s
+        D_d = ((Gamma_d+d_eddy_d) / dZ_d)   
+        F_u =  w_u * airdict['por_op'] # Units m/s
+        F_d =  w_d * airdict['por_op']
+        
+        P_u = F_u / D_u
+        P_d = F_d / D_d
+        
+        a_U = D_u * A( P_u ) + F_upwind(  F_u )
+        a_D = D_d * A( P_d ) + F_upwind( -F_d )
 
-            b_0 = S_C * dZ
+        # a_U = D_u # 8/14/17: use this for now - check on Lagrangian need for upwinding.
+        # a_D = D_d 
+    
+        a_P_0 = airdict['por_op'] * dZ / dt
+    #######################################
 
-            a_U = D_u 
-            a_D = D_d 
+    else: #just for heat, isotope diffusion
+        Gamma_u, Gamma_d = geom.interface(Gamma_P) # Patankar eq. 4.9
 
-            # a_P_0 = dZ / dt
-            a_P_0 = tot_rho * dZ / dt
-            # a_P_0 = RHO_I * c_firn * dZ / dt
-            
+        S_C_0 = 0
+        S_C_0 = S_C_0 * np.ones(geom.nz_P)
+        
+        #print('-----Solver-------') #TODO
+        #print(Gamma_P)
+        #print(Gamma_U)
+        #print(str((1 - f_u) / Gamma_P + f_u / Gamma_U))
+        #print('--------------')
 
-        S_P     = 0.0
-        a_P     = a_U + a_D + a_P_0 - S_P*dZ
+        D_u = (Gamma_u / dZ_u)
+        D_d = (Gamma_d / dZ_d)
 
-        bc_u_0  = phi_s # need to pay attention for gas
-        bc_type = 1
-        bc_u    = np.concatenate(([ bc_u_0], [bc_type]))
+        a_U = D_u 
+        a_D = D_d 
 
-        bc_d_0  = 0
-        bc_type = 2
-        bc_d    = np.concatenate(([ bc_d_0 ], [ bc_type ]))
+        # a_P_0 = dZ / dt
+        a_P_0 = tot_rho * dZ / dt
+        # a_P_0 = RHO_I * c_firn * dZ / dt
+        
 
-        b       = b_0 + a_P_0 * phi_t
+    S_P     = 0.0
+    a_P     = a_U + a_D + a_P_0 - S_P*dZ
 
-        #Upper boundary
-        a_P[0]  = 1
-        a_U[0]  = 0
-        a_D[0]  = 0
-        b[0]    = bc_u[0]
+    bc_u_0  = phi_s # need to pay attention for gas
+    bc_type = 1
 
-        #Down boundary
-        a_P[-1] = 1
-        a_D[-1] = 0
-        a_U[-1] = 1
-        b[-1]   = dZ_u[-1] * bc_d[0]
+    bc_d_0  = 0
+    bc_type = 2
 
-        phi_t = solver(a_U, a_D, a_P, b)
-        a_P = a_U + a_D + a_P_0
+    ### the nodes run along the last axis, so a batch of problems on the same grid (e.g. all of the gases) is solved at once
+    #Upper boundary
+    a_P[..., 0]  = 1
+    a_U[..., 0]  = 0
+    a_D[..., 0]  = 0
+
+    #Down boundary
+    a_P[..., -1] = 1
+    a_D[..., -1] = 0
+    a_U[..., -1] = 1
+
+    ### same system as solver(): a_U * phi[i-1] - a_P * phi[i] + a_D * phi[i+1] = -b
+    lu = tridiag_lu(a_U, -a_P, a_D)
+
+    for i_time in range(nt):
+        S_C         = S_C_0 * phi_t # Should this be phi_0 instead?
+        b_0         = S_C * dZ
+        b           = b_0 + a_P_0 * phi_t
+
+        b[..., 0]   = bc_u_0
+        b[..., -1]  = dZ_u[-1] * bc_d_0
+
+        phi_t = tridiag_lu_solve(lu, -b)
 
     if airdict!=None:
         return phi_t, w_p
     else:
         return phi_t
 
+def tridiag_solve(a_L, a_C, a_R, rhs):
+    '''
+    solves tridiagonal systems:
+    a_L[i] * x[i-1] + a_C[i] * x[i] + a_R[i] * x[i+1] = rhs[i]
+    a_L[0] and a_R[-1] are not used.
+
+    The system runs along the last axis, so 2-D arrays (systems x nodes)
+    solve one system per row; the coefficients are broadcast against each
+    other, so one matrix can be solved for several right-hand sides. The
+    systems are independent, so they are put end to end into one banded
+    matrix and solved in a single LAPACK call.
+
+    :param a_L: sub-diagonal
+    :param a_C: diagonal
+    :param a_R: super-diagonal
+    :param rhs: right-hand side
+
+    :return x:
+    '''
+
+    a_L, a_C, a_R, rhs = np.broadcast_arrays(a_L, a_C, a_R, rhs)
+    a_L = np.array(a_L, dtype=float)
+    a_R = np.array(a_R, dtype=float)
+    a_L[..., 0]     = 0 # decouple the systems from each other
+    a_R[..., -1]    = 0
+
+    nz              = np.size(a_C)
+    ab              = np.zeros((3, nz))
+    ab[0, 1:]       = a_R.ravel()[:-1]
+    ab[1, :]        = np.ravel(a_C)
+    ab[2, :-1]      = a_L.ravel()[1:]
+
+    x = solve_banded((1, 1), ab, np.ravel(rhs), check_finite = False)
+
+    return x.reshape(np.shape(a_C))
+
+def tridiag_lu(a_L, a_C, a_R):
+    '''
+    LU factorization (LAPACK gttrf) of the tridiagonal systems of tridiag_solve,
+    so that they can be solved for one right-hand side after the other with
+    tridiag_lu_solve (e.g. the sub-steps of transient_solve_TR).
+
+    :param a_L: sub-diagonal
+    :param a_C: diagonal
+    :param a_R: super-diagonal
+
+    :return lu:
+    '''
+
+    a_L, a_C, a_R = np.broadcast_arrays(a_L, a_C, a_R)
+    a_L = np.array(a_L, dtype=float)
+    a_R = np.array(a_R, dtype=float)
+    a_L[..., 0]     = 0 # decouple the systems from each other
+    a_R[..., -1]    = 0
+
+    dl, d, du, du2, ipiv, info = dgttrf(a_L.ravel()[1:], np.array(a_C, dtype=float).ravel(), a_R.ravel()[:-1])
+    if info > 0:
+        raise np.linalg.LinAlgError('singular tridiagonal matrix')
+
+    return dl, d, du, du2, ipiv, np.shape(a_C)
+
+def tridiag_lu_solve(lu, rhs):
+    '''
+    :param lu: factorization from tridiag_lu
+    :param rhs: right-hand side, with the shape of the diagonal
+
+    :return x:
+    '''
+
+    dl, d, du, du2, ipiv, shape = lu
+    x, info = dgttrs(dl, d, du, du2, ipiv, np.ravel(rhs))
+
+    return x.reshape(shape)
+
+def transient_solve_batch(geom, dt, Gamma_P, phi_0, phi_s, tot_rho, nz_P):
+    '''
+    transient_solve_TR (heat/isotope case, one time step) for a batch of columns.
+    The columns are rows of 2-D arrays padded to a common length; column j uses
+    nodes 0..nz_P[j]-1 and the padding nodes are left unchanged.
+
+    :param geom: GridGeometry of the (columns x nodes) grid
+    :param dt:
+    :param Gamma_P: (columns x nodes)
+    :param phi_0: (columns x nodes)
+    :param phi_s: (columns)
+    :param tot_rho: (columns x nodes)
+    :param nz_P: number of nodes in each column
+
+    :return phi_t:
+    '''
+
+    dZ      = geom.dZ
+    dZ_u    = geom.dZ_u
+    dZ_d    = geom.dZ_d
+    z_P     = geom.z_P
+
+    Gamma_u, Gamma_d = geom.interface(Gamma_P) # Patankar eq. 4.9
+
+    a_U     = Gamma_u / dZ_u
+    a_D     = Gamma_d / dZ_d
+    a_P_0   = tot_rho * dZ / dt
+    a_P     = a_U + a_D + a_P_0
+    b       = a_P_0 * phi_0
+
+    node    = np.arange(z_P.shape[1])
+    bottom  = node[None, :] == (np.asarray(nz_P) - 1)[:, None]
+    pad     = node[None, :] > (np.asarray(nz_P) - 1)[:, None]
+
+    #Upper boundary
+    a_P[:, 0]   = 1
+    a_U[:, 0]   = 0
+    a_D[:, 0]   = 0
+    b[:, 0]     = phi_s
+
+    #Down boundary (zero gradient)
+    a_P[bottom] = 1
+    a_D[bottom] = 0
+    a_U[bottom] = 1
+    b[bottom]   = 0
+
+    #Padding nodes keep their values
+    a_P[pad]    = 1
+    a_U[pad]    = 0
+    a_D[pad]    = 0
+    b[pad]      = phi_0[pad]
+
+    ### same system as solver(): a_U * phi[i-1] - a_P * phi[i] + a_D * phi[i+1] = -b
+    phi_t = tridiag_solve(a_U, -a_P, a_D, -b)
+
+    return phi_t
+
 '''
 Functions below are for firn air
 '''
@@ -236,36 +385,17 @@ def w(airdict, z_edges, rho_edges, Z_P, dZ): # Function for downward advection o
         dscl                = np.gradient(por_cl_edges,z_edges)
         C                   = np.exp(M_AIR*GRAVITY*z_edges/(R*T_edges))
 
-        # m1 = np.tile(por_op_edges,(len(por_op_edges),1))
-        # Xi_up = m1/m1.T
-        # m2 = np.tile(w_firn_edges, (len(w_firn_edges),1))
-        # Xi_down = 1 + np.log(m2.T / m2)
-        # Xi = Xi_up / Xi_down
-
         op_ind              = np.where(z_edges<=airdict['z_co'])[0]
         co_ind              = op_ind[-1]
-        cl_ind              = np.where(z_edges>airdict['z_co'])[0]
-
-        Xi                  = np.zeros((len(op_ind),len(op_ind)))
-        Xi_up               = por_op_edges[op_ind]/np.reshape(por_op_edges[op_ind], (-1,1))
-        Xi_down             = (1 + np.log( np.reshape(w_firn_edges[op_ind], (-1,1))/ w_firn_edges[op_ind] ))
-        Xi                  = Xi_up / Xi_down # Equation 5.10 in Christo's thesis; Xi[i,j] is the pressure increase (ratio) for bubbles at depth[i] that were trapped at depth[j]
-
-        # Xi                  = np.zeros((len(z_edges),len(z_edges)))
-        # Xi_up               = por_op_edges/np.reshape(por_op_edges, (-1,1))
-        # Xi_down             = (1 + np.log( np.reshape(w_firn_edges, (-1,1))/ w_firn_edges ))
-        # Xi                  = Xi_up / Xi_down # Equation 5.10 in Christo's thesis; Xi[i,j] is the pressure increase (ratio) for bubbles at depth[i] that were trapped at depth[j]
-
-        integral_matrix     = (Xi.T*dscl[op_ind]*C[op_ind]).T 
-        integral_matrix_sum = integral_matrix.sum(axis=1)
 
-        p_ratio             = np.zeros_like(z_edges)
+        ### Equation 5.10 in Christo's thesis: Xi[i,j] = (por_op[j] / por_op[i]) / (1 + log(w_firn[i] / w_firn[j])) is the pressure
+        ### increase (ratio) for bubbles at depth[i] that were trapped at depth[j]. Only the pressure at the close-off depth enters the
+        ### flux, so only the row i = co_ind of Xi is needed; building the whole (open nodes x open nodes) matrix was O(n^2).
+        Xi_co               = (por_op_edges[op_ind] / por_op_edges[co_ind]) / (1 + np.log(w_firn_edges[co_ind] / w_firn_edges[op_ind]))
 
-        p_ratio[op_ind]     = integral_matrix_sum#[op_ind]   #5.11
-        # p_ratio[cl_ind]     = p_ratio[co_ind]*Xi[cl_ind, co_ind] # 5.12
-        p_ratio[cl_ind]     = integral_matrix_sum[-1] #*Xi[cl_ind, co_ind] # 5.12
+        p_ratio_co          = np.sum(Xi_co * dscl[co_ind] * C[co_ind]) # 5.11 at the close-off depth; 5.12 below it
 
-        flux                = w_firn_edges[co_ind] * p_ratio[co_ind] * por_cl_edges[co_ind]
+        flux                = w_firn_edges[co_ind] * p_ratio_co * por_cl_edges[co_ind]
         # velocity            = np.minimum(w_firn_edges ,((flux + 1e-10 - w_firn_edges * p_ratio * por_cl_edges) / ((por_op_edges + 1e-10 * C))/airdict['dt']))
         # velocity            = (flux + 1e-10 - w_firn_edges * p_ratio * por_cl_edges) / ((por_op_edges + 1e-10 * C))/airdict['dt']
         # velocity = np.minimum(w_firn_edges, (flux / p_star / airdict['dt']))
@@ -286,7 +416,7 @@ def w(airdict, z_edges, rho_edges, Z_P, dZ): # Function for downward advection o
 
 
 def A(P): # Power-law scheme, Patankar eq. 5.34
-    A = np.maximum( (1 - 0.1 * np.abs( P ) )**5, np.zeros(np.size(P) ) )
+    A = np.maximum( (1 - 0.1 * np.abs( P ) )**5, 0.0 )
     return A    
 
 def F_upwind(F): # Upwinding scheme
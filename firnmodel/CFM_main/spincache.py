@@ -0,0 +1,182 @@
+from firn_density_spin import FirnDensitySpin
+from reader import read_forcing
+import hashlib
+import fcntl
+import json
+import os
+import shutil
+import time
+
+'''
+Spin-up cache shared by all runs.
+
+If 'spinCacheFolder' is in the .json, each spin file is also stored in that
+folder under a key that is a hash of everything that the spin up depends on
+(SPIN_KEYS and the climate it is forced with). A run whose key is already in the
+cache gets a copy of the cached spin file instead of spinning up again, whatever
+its spinFileName, experiment or results folder.
+
+The cache is kept under 'spinCacheSize' MB (default 2000) by deleting the least
+recently used spin files.
+
+A process that spins up a key holds a lock (flock) on the file <key>.hdf5.lock
+while it runs, so runs in other processes with the same key (e.g. the jobs of a
+campaign, see campaign.py) wait for its spin file instead of spinning up again.
+The lock is released by the operating system when the process ends, also if it
+is killed, so a crashed run does not block the key. A run waits for a lock at
+most 'spinLockTimeout' seconds (default LOCK_TIMEOUT), then raises a TimeoutError.
+The (empty) lock files are left in the cache folder.
+'''
+
+LOCK_POLL       = 1.0 # s, between attempts to take the lock of a key that another process is spinning up
+LOCK_TIMEOUT    = 86400.0 # s, longest wait for the lock of a key
+
+SPIN_CACHE_VERSION = 1 # change when the spin up itself changes, so old spin files are not reused
+
+### the .json entries that the spin up depends on
+SPIN_KEYS = ['physRho', 'H', 'HbaseSpin', 'stpsPerYearSpin', 'stpsPerYear', 'AutoSpinUpTime', 'yearSpin',
+            'rhos0', 'r2s0', 'physGrain', 'calcGrainSize', 'GrGrowPhysics', 'bdot_type', 'heatDiff', 'SeasonalTcycle', 'TAmp',
+            'heatSubSteps', 'isoDiff', 'iso', 'strain', 'du_dx', 'doublegrid', 'nodestocombine', 'grid1bottom', 'MELT',
+            'spinUpSolver', 'yearSpinPolish', 'spinTol', 'spinCheckInt']
+
+def spin_key(c, inputs=None):
+    '''
+    :param c: dictionary of the json config
+    :param inputs: forcing given in memory (see reader.read_forcing)
+
+    :return key: hash of the inputs of the spin up
+    '''
+
+    spinInputs = dict((k, c[k]) for k in SPIN_KEYS if k in c)
+    if 'spinPhysRho' in c:
+        spinInputs['physRho'] = c['spinPhysRho']
+
+    ### the spin up is forced with the first value of the climate files
+    input_temp, input_year_temp = read_forcing(c, 'Temp', inputs)
+    input_bdot, input_year_bdot = read_forcing(c, 'bdot', inputs)
+    spinInputs['temp0'] = float(input_temp[0])
+    spinInputs['bdot0'] = float(input_bdot[0])
+    if bool(c['isoDiff']):
+        try:
+            input_iso, input_year_iso = read_forcing(c, 'Iso', inputs)
+            spinInputs['del_s0'] = float(input_iso[0])
+        except:
+            spinInputs['del_s0'] = None
+    spinInputs['version'] = SPIN_CACHE_VERSION
+
+    return hashlib.sha1(json.dumps(spinInputs, sort_keys = True).encode()).hexdigest()
+
+def evict(folder, maxBytes, keep=None):
+    '''
+    delete the least recently used spin files until the cache is smaller than maxBytes
+
+    :param keep: path of a spin file that is not deleted
+    '''
+
+    entries = [os.path.join(folder, f) for f in os.listdir(folder) if f.endswith('.hdf5')]
+    entries.sort(key = os.path.getmtime)
+    size    = sum(os.path.getsize(f) for f in entries)
+    for f in entries:
+        if size <= maxBytes:
+            break
+        if f == keep:
+            continue
+        size -= os.path.getsize(f)
+        os.remove(f)
+        print('removed', f, 'from the spin cache')
+
+def lock_key(lock, timeout=LOCK_TIMEOUT):
+    '''
+    Take the lock of a key of the cache, waiting while another process holds it.
+
+    :param lock: path of the lock file of the key
+    :param timeout: s, longest wait
+
+    :return fd: open file descriptor of the lock file; the lock is released with unlock_key (or when the process ends)
+    '''
+
+    fd          = os.open(lock, os.O_CREAT | os.O_RDWR)
+    deadline    = time.time() + timeout
+    waiting     = False
+    while True:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except BlockingIOError: # another process is spinning up the same key
+            if time.time() >= deadline:
+                os.close(fd)
+                raise TimeoutError('waited %g s for the lock %s of the spin cache; another run is still spinning up the same key' %(timeout, lock))
+            if not waiting:
+                print('Waiting for the spin up that holds', lock)
+                waiting = True
+            time.sleep(min(LOCK_POLL, max(deadline - time.time(), 0.0)))
+
+def unlock_key(fd):
+    '''
+    release a lock taken with lock_key
+    '''
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+def spin_up(c, force=False, inputs=None):
+    '''
+    Makes sure that the spin file of a run exists. Without 'spinCacheFolder' in the
+    .json, the spin up is run if the spin file does not exist yet (or if force is True).
+    Otherwise the spin file comes from the cache if it is there, and is added to the
+    cache if it is not.
+
+    :param c: dictionary of the json config
+    :param force: if True, always run the spin up
+    :param inputs: forcing given in memory (see reader.read_forcing)
+
+    :return spun: True if the spin up was run, False if an existing spin file was used
+    '''
+
+    spinFile = os.path.join(c['resultsFolder'], c['spinFileName'])
+
+    if 'spinCacheFolder' not in c:
+        if os.path.isfile(spinFile) and not force:
+            print('Skipping Spin-Up run;', spinFile, 'exists already')
+            return False
+        firnS = FirnDensitySpin(c, inputs)
+        firnS.time_evolve()
+        return True
+
+    folder = c['spinCacheFolder']
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    entry = os.path.join(folder, spin_key(c, inputs) + '.hdf5')
+
+    if force or not os.path.isfile(entry):
+        fd = lock_key(entry + '.lock', c.get('spinLockTimeout', LOCK_TIMEOUT))
+        try:
+            spun = force or not os.path.isfile(entry) # False if the process that held the lock spun it up
+            if spun:
+                firnS = FirnDensitySpin(c, inputs)
+                firnS.time_evolve()
+
+                tmp = entry + '.tmp' # so that a run reading the cache never sees a partly copied file
+                shutil.copyfile(spinFile, tmp)
+                os.replace(tmp, entry)
+        finally:
+            unlock_key(fd)
+        if spun:
+            try:
+                maxBytes = c['spinCacheSize'] * 1.0e6
+            except:
+                maxBytes = 2000.0e6
+            evict(folder, maxBytes, keep = entry)
+            return True
+
+    print('Skipping Spin-Up run; using', entry, 'from the spin cache')
+    if not os.path.exists(c['resultsFolder']):
+        os.makedirs(c['resultsFolder'])
+    shutil.copyfile(entry, spinFile)
+    os.utime(entry) # most recently used
+    return False
+    try:
+        maxBytes = c['spinCacheSize'] * 1.0e6
+    except:
+        maxBytes = 2000.0e6
+    evict(folder, maxBytes, keep = entry)
+    return True
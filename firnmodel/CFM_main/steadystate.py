@@ -0,0 +1,160 @@
+from constants import *
+import numpy as np
+from scipy.linalg import solve_banded
+
+'''
+Steady-state spin up.
+
+Under the constant forcing of the spin up, the column reaches a state in which
+every step only moves each node one place down: node k+1 at the end of a step is
+node k at the end of the step before, densified for one time step. The steady
+density profile therefore satisfies
+
+    rho[0]   = rhos0
+    rho[k+1] = rho[k] + dt * drho_dt[k](rho)
+
+which is solved here with Newton's method instead of time stepping the spin up
+for yearSpin years. The mass, age, stress, temperature, grain size and
+temperature history of the nodes do not depend on the density in the steady
+state, so they are set directly.
+
+Set "spinUpSolver": "steady" in the .json to use it; "yearSpinPolish" (years,
+default 0) then time steps the steady column before the spin file is written.
+'''
+
+STEADY_TOL     = 1.0e-6    # kg m^-3, largest allowed residual of the steady profile
+STEADY_MAXITER = 100
+
+def steady_supported(self):
+    '''
+    The steady state only exists (and is only found here) for a column without
+    seasonal forcing, strain or regridding, and for physics without a memory
+    of their own.
+
+    :return reason: None if the steady solver can be used, otherwise why not
+    '''
+
+    if bool(self.c['SeasonalTcycle']):
+        return 'the seasonal temperature cycle has no steady state'
+    if bool(self.c['strain']):
+        return 'strain is not supported'
+    if self.doublegrid:
+        return 'doublegrid is not supported'
+    if self.c['physRho'] == 'Goujon2003':
+        return 'Goujon2003 physics reset the density of the top meter'
+    if self.MELT and bool(self.c['physGrain']) and self.c['GrGrowPhysics'] == 'Katsushima':
+        return 'Katsushima grain growth depends on the grain size'
+    return None
+
+def steady_residual(self):
+    '''
+    The forcing of the spin up is constant, so the rates are found for its last time step.
+
+    :return F: residual of the steady profile for the density in self.rho
+    :return drho_dt: densification rate of self.rho (a copy)
+    '''
+
+    drho_dt = self.densification.compute(self.stp - 1).copy()
+    F       = np.empty(self.gridLen)
+    F[0]    = self.rho[0] - self.rhos0[0]
+    F[1:]   = self.rho[1:] - self.rho[:-1] - self.dt * drho_dt[:-1]
+    return F, drho_dt
+
+def steady_spin(self):
+    '''
+    Put the spin-up column in its steady state.
+
+    The densification rate of a node only depends on its own density for almost
+    all of the physics, so the Jacobian of the residual is lower bidiagonal; its
+    diagonal derivative is found by finite differences. A backtracking line
+    search keeps the profile where the physics are defined.
+
+    :return converged: False if no steady state was found. The column is then
+        left as it was and the spin up should be time stepped instead.
+    '''
+
+    reason = steady_supported(self)
+    if reason is not None:
+        print('steady spin up is not used:', reason)
+        return False
+
+    n       = self.gridLen
+    dt      = self.dt
+    massNew = self.bdotSec[0] * S_PER_YEAR * RHO_I
+    Ts0     = self.Ts[0]
+
+    age_init, rho_init = self.age.copy(), self.rho.copy()
+    saved   = dict((name, np.copy(getattr(self, name))) for name in ['age', 'rho', 'Tz', 'mass', 'dz', 'z', 'sigma', 'mass_sum', 'bdot_mean', 'r2', 'Hx'] if getattr(self, name, None) is not None)
+    saved.update(T_mean = self.T_mean, T10m = self.T10m)
+
+    ### fields that do not depend on the density
+    self.age        = (np.arange(n) + 1) * dt
+    self.mass       = massNew * np.ones(n)
+    self.Tz         = Ts0 * np.ones(n)
+    self.T_mean     = Ts0
+    self.T10m       = Ts0
+    self.sigma      = (self.mass * self.dx * GRAVITY).cumsum(axis = 0)
+    self.mass_sum   = self.mass.cumsum(axis = 0)
+    self.bdot_mean  = (np.concatenate(([self.mass_sum[0] / (RHO_I * S_PER_YEAR)], self.mass_sum[1:] * self.t / (self.age[1:] * RHO_I))))*self.c['stpsPerYear']*S_PER_YEAR
+
+    if self.THist:
+        self.Hx     = np.exp(-110.0e3 / (R * Ts0)) * self.age
+
+    ### initial guess: the H&L analytic profile, at the age of each node
+    self.rho        = np.interp(self.age, age_init, rho_init)
+    self.rho[0]     = self.rhos0[0]
+
+    if bool(self.c['physGrain']): # grain growth only depends on temperature here
+        self.densification.compute(self.stp - 1)
+        r2_surface  = self.densification.r2_surface
+        self.dr2_dt = self.densification.dr2_dt
+        self.r2     = r2_surface + np.concatenate(([0], np.cumsum(self.dr2_dt * dt)[:-1]))
+
+    ab          = np.zeros((2, n))
+    ab[0, :]    = 1.0
+    F, drho_dt  = steady_residual(self)
+    Fmax        = np.max(np.abs(F))
+    converged   = Fmax < STEADY_TOL
+
+    for it in range(STEADY_MAXITER):
+        if converged:
+            break
+        rho         = self.rho.copy()
+
+        ### diagonal of the Jacobian
+        h           = 1.0e-6 * rho
+        self.rho    = rho + h
+        dfdrho      = (self.densification.compute(self.stp - 1) - drho_dt) / h
+        ab[1, :-1]  = -(1.0 + dt * dfdrho[:-1])
+        if not np.all(np.isfinite(ab)):
+            break
+        delta       = solve_banded((1, 0), ab, -F)
+
+        ### line search
+        alpha = 1.0
+        while alpha > 1.0e-4:
+            self.rho = rho + alpha * delta
+            F_try, drho_try = steady_residual(self)
+            Fmax_try = np.max(np.abs(F_try))
+            if np.isfinite(Fmax_try) and Fmax_try < Fmax:
+                break
+            alpha = alpha / 2
+        else:
+            break
+        F, drho_dt, Fmax = F_try, drho_try, Fmax_try
+        converged   = Fmax < STEADY_TOL
+
+    if not converged:
+        print('steady spin up did not converge (residual %.3g kg m^-3); time stepping instead' %Fmax)
+        for name, value in saved.items():
+            setattr(self, name, value)
+        return False
+
+    print('steady spin up converged in %d iterations' %it)
+
+    self.dz     = self.mass / self.rho * self.dx
+    self.z      = np.concatenate(([0], self.dz.cumsum(axis = 0)[:-1]))
+    if bool(self.c['isoDiff']):
+        self.del_z = self.del_s[0] * np.ones(n)
+
+    return True
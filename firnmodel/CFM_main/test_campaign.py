@@ -0,0 +1,41 @@
+from campaign import CampaignPool
+from spincache import spin_key, lock_key, unlock_key
+import numpy as np
+import os
+
+'''
+Checks of the campaign pool (campaign.py) with the spin cache.
+'''
+
+def slow_spin_config(folder):
+    '''
+    config of a run whose spin up takes much longer than the timeout of the test
+    '''
+    years = np.array([1900.0, 1950.0])
+    np.savetxt(os.path.join(folder, 'temp.csv'), np.vstack((years, [245.0, 245.0])), delimiter = ',')
+    np.savetxt(os.path.join(folder, 'bdot.csv'), np.vstack((years, [0.25, 0.25])), delimiter = ',')
+    return {
+        "InputFileFolder": folder, "InputFileNameTemp": "temp.csv", "InputFileNamebdot": "bdot.csv",
+        "resultsFolder": os.path.join(folder, 'results'), "spinCacheFolder": os.path.join(folder, 'spinCache'),
+        "physRho": "HLdynamic", "MELT": 0, "FirnAir": 0, "TWriteInt": 1, "int_type": "nearest", "SeasonalTcycle": 0,
+        "TAmp": 10.0, "physGrain": 0, "calcGrainSize": 0, "heatDiff": 1, "variable_srho": 0, "rhos0": 360.0,
+        "r2s0": 1.0e-8, "AutoSpinUpTime": 0, "yearSpin": 1000000, "stpsPerYearSpin": 1.0, "H": 3000,
+        "HbaseSpin": 2750.0, "stpsPerYear": 1.0, "D_surf": 1.0, "GrGrowPhysics": "Arthern", "bdot_type": "mean",
+        "isoDiff": 0, "iso": "NoDiffusion", "spacewriteint": 1, "strain": 0, "du_dx": 1e-5, "outputs": ["density"],
+        "resultsFileName": "results.hdf5", "spinFileName": "spin.hdf5", "doublegrid": 0, "nodestocombine": 50,
+        "grid1bottom": 10.0,
+    }
+
+def test_timeout_releases_spin_lock(tmp_path):
+    '''
+    a job that is killed during its spin up does not leave the lock of its key taken
+    '''
+    c = slow_spin_config(str(tmp_path))
+    with CampaignPool(processes = 1, timeout = 3, retries = 1, logFolder = str(tmp_path / 'logs')) as pool:
+        result = pool.run([('slow', c)])[0]
+    assert result['status'] == 'timeout' and result['attempts'] == 2
+
+    ### the retry took the lock (it was not waiting for the killed attempt), and it is free again
+    with open(str(tmp_path / 'logs' / 'slow.log')) as f:
+        assert 'Waiting for the spin up' not in f.read()
+    unlock_key(lock_key(os.path.join(c['spinCacheFolder'], spin_key(c) + '.hdf5.lock'), timeout = 0))
@@ -0,0 +1,97 @@
+from constants import *
+from kernels import hl_rate, arthern_rate, crocus_rate, diffusion_solve
+from physics import FirnPhysics
+from solver import GridGeometry, transient_solve_TR
+from melt import percolation_bucket
+from types import SimpleNamespace
+import numpy as np
+import pytest
+
+'''
+Checks that the kernels of kernels.py give the same results as the NumPy code
+that they replace (run with pytest). Each kernel is checked as it is used by the
+model runs (compiled if Numba is installed) and as the plain Python function.
+'''
+
+RTOL = 1e-12
+
+def variants(kernel):
+    '''
+    :return kernels: the kernel, and its plain Python function if it is compiled
+    '''
+    return [kernel] + ([kernel.py_func] if hasattr(kernel, 'py_func') else [])
+
+def column(nz=500, sort=True):
+    '''
+    synthetic firn column; with sort False, the density has an ice lens near the surface
+    '''
+    z           = np.linspace(0, 150, nz)
+    rho         = RHO_I - (RHO_I - 350.0) * np.exp(-z / 30.0)
+    rho[-5:]    = RHO_I
+    if not sort:
+        rho[10:15] = 800.0
+    Tz          = 240.0 + 5.0 * np.exp(-z / 3.0)
+    dz          = np.concatenate((np.diff(z), [z[-1] - z[-2]]))
+    mass        = rho * dz
+    return SimpleNamespace(z = z, rho = rho, Tz = Tz, dz = dz, mass = mass, sigma = (mass * GRAVITY).cumsum(),
+                           bdot_mean = 0.25 + 0.05 * np.sin(z / 10.0))
+
+def physics(col):
+    params = dict(iii = 0, steps = 1.0, gridLen = len(col.z), bdotSec = np.array([0.25 / S_PER_YEAR]), bdot_mean = col.bdot_mean,
+                  bdot_type = 'mean', Tz = col.Tz, T10m = 242.0, T_mean = 242.0, rho = col.rho, sigma = col.sigma, mass = col.mass)
+    return FirnPhysics(params)
+
+@pytest.mark.parametrize('sort', [True, False])
+@pytest.mark.parametrize('kernel', variants(hl_rate))
+def test_hl_rate(kernel, sort):
+    col = column(sort = sort)
+    np.testing.assert_allclose(kernel(col.rho, col.Tz, col.bdot_mean * RHO_I_MGM, np.zeros(len(col.z))),
+                               physics(col).HL_dynamic()['drho_dt'], rtol = RTOL)
+
+@pytest.mark.parametrize('sort', [True, False])
+@pytest.mark.parametrize('kernel', variants(arthern_rate))
+@pytest.mark.parametrize('method, A, M, withM, capIce', [
+    ('Arthern_2010S',       RHO_I_MGM * 1000,   (1.0, 0.0, 1.0, 0.0),           False,  False),
+    ('Ligtenberg_2011',     RHO_I,              (1.435, 0.151, 2.366, 0.293),   True,   False),
+    ('KuipersMunneke_2015', RHO_I,              (1.042, 0.0916, 1.734, 0.2039), True,   True),
+])
+def test_arthern_rate(kernel, method, A, M, withM, capIce, sort):
+    col = column(sort = sort)
+    np.testing.assert_allclose(kernel(col.rho, col.Tz, 242.0, col.bdot_mean * A, *M, withM, capIce, np.zeros(len(col.z))),
+                               getattr(physics(col), method)()['drho_dt'], rtol = RTOL)
+
+@pytest.mark.parametrize('kernel', variants(crocus_rate))
+def test_crocus_rate(kernel):
+    col = column()
+    np.testing.assert_allclose(kernel(col.rho, col.Tz, col.sigma, np.zeros(len(col.z))),
+                               physics(col).Crocus()['drho_dt'], rtol = RTOL)
+
+@pytest.mark.parametrize('nt', [1, 8])
+@pytest.mark.parametrize('kernel', variants(diffusion_solve))
+def test_diffusion_solve(kernel, nt):
+    col     = column()
+    geom    = GridGeometry(col.z)
+    Gamma_P = 9.828 * np.exp(-0.0057 * col.Tz) * (col.rho / 1000) ** (2 - 0.5 * (col.rho / 1000)) / (152.5 + 7.122 * col.Tz)
+    np.testing.assert_allclose(kernel(geom.dZ, geom.dZ_u, geom.dZ_d, geom.f_u, geom.f_d, geom.g_u, geom.g_d, Gamma_P, col.rho, col.Tz, 250.0, S_PER_YEAR / nt, nt),
+                               transient_solve_TR(geom, nt, S_PER_YEAR / nt, Gamma_P, col.Tz, 250.0, col.rho, backend = 'numpy'), rtol = RTOL)
+
+def melt_column(sort, backend):
+    '''
+    model stub with the fields that percolation_bucket reads
+    '''
+    col = column(sort = sort)
+    return SimpleNamespace(rho = col.rho, dz = col.dz, Tz = col.Tz, z = col.z, mass = col.mass, mass_sum = col.mass.cumsum(),
+                           age = col.z * 10 * S_PER_YEAR, LWC = np.zeros(len(col.z)), Dcon = np.zeros(len(col.z)),
+                           bdot_mean = col.bdot_mean, compboxes = 100, snowmeltSec = np.array([0.05, 0.5]) / S_PER_YEAR,
+                           kernelBackend = backend)
+
+@pytest.mark.parametrize('iii', [0, 1])
+@pytest.mark.parametrize('sort', [True, False])
+def test_bucket_potentials(sort, iii):
+    '''
+    the numba branch of percolation_bucket (kernels.bucket_potentials) against its numpy branch
+    '''
+    kernel  = percolation_bucket(melt_column(sort, 'numba'), iii)
+    numpy   = percolation_bucket(melt_column(sort, 'numpy'), iii)
+    for a, b in zip(kernel, numpy):
+        np.testing.assert_allclose(a, b, rtol = RTOL)
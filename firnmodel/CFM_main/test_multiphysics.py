@@ -0,0 +1,53 @@
+from multiphysics import model_configs
+from spincache import spin_key
+from firn_density_spin import FirnDensitySpin
+import numpy as np
+import contextlib
+import io
+import pytest
+
+'''
+Checks that each model of a multi-physics run (multiphysics.py) is spun up with
+its own physics, also when the .json was written for one model and has
+'spinPhysRho' (as the setups of createJsonSetupFiles.py do).
+'''
+
+MODELS = ['HLdynamic', 'Li2011', 'Arthern2010S', 'Arthern2010T', 'Ligtenberg2011']
+SPIN   = {'HLdynamic': 'HLdynamic', 'Li2011': 'Li2011', 'Arthern2010S': 'Arthern2010S', 'Arthern2010T': 'Arthern2010S', 'Ligtenberg2011': 'Ligtenberg2011'}
+
+### forcing given in memory, so that no input files are read (see reader.read_forcing)
+INPUTS = {'Temp': ([245.0, 245.0], [1900.0, 1950.0]), 'bdot': ([0.25, 0.25], [1900.0, 1950.0])}
+
+def setup(physRho):
+    '''
+    a setup for physRho with the entries of createJsonSetupFiles.generateDataFile
+    '''
+    return {
+        "InputFileFolder": "CFMexp2", "InputFileNameTemp": "tskin_const.csv", "InputFileNamebdot": "bDot_const.csv",
+        "resultsFolder": "./CFMexperiments", "physRho": physRho, "MELT": 0, "FirnAir": 0, "TWriteInt": 1,
+        "int_type": "nearest", "SeasonalTcycle": 0, "TAmp": 10.0, "physGrain": 1, "calcGrainSize": 0, "heatDiff": 1,
+        "variable_srho": 0, "rhos0": 360.0, "r2s0": 1.0e-8, "AutoSpinUpTime": 0, "yearSpin": 100, "stpsPerYearSpin": 1.0,
+        "H": 3000, "HbaseSpin": 2750.0, "stpsPerYear": 1.0, "D_surf": 1.0, "GrGrowPhysics": "Arthern", "bdot_type": "mean",
+        "isoDiff": 0, "iso": "NoDiffusion", "spacewriteint": 1, "strain": 0, "du_dx": 1e-5, "outputs": ["density", "depth"],
+        "resultsFileName": "CFMexp1resultsAll.hdf5", "spinFileName": "CFMexp1spin.hdf5",
+        "spinPhysRho": "Arthern2010S" if physRho == 'Arthern2010T' else physRho,
+        "doublegrid": 0, "nodestocombine": 50, "grid1bottom": 10.0,
+    }
+
+@pytest.mark.parametrize('base', ['Arthern2010S', 'Arthern2010T'])
+def test_spin_physics(base):
+    c               = setup(base)
+    c['physRho']    = MODELS
+    configs         = model_configs(c)
+    for physRho, cm in configs.items():
+        with contextlib.redirect_stdout(io.StringIO()):
+            firnS = FirnDensitySpin(cm, INPUTS)
+        assert firnS.c['physRho'] == SPIN[physRho] # physics of the spin up
+        assert spin_key(cm, INPUTS) == spin_key(setup(physRho), INPUTS)
+
+def test_spin_keys():
+    c               = setup('Arthern2010S')
+    c['physRho']    = MODELS
+    keys            = dict((physRho, spin_key(cm, INPUTS)) for physRho, cm in model_configs(c).items())
+    assert keys['Arthern2010T'] == keys['Arthern2010S'] # the same spin up
+    assert len(set(keys.values())) == len(MODELS) - 1
@@ -0,0 +1,46 @@
+from spincache import lock_key, unlock_key
+import multiprocessing
+import os
+import time
+import pytest
+
+'''
+Checks of the locks of the spin cache (spincache.py) between processes.
+'''
+
+def hold(lock, seconds, taken):
+    '''
+    process that takes the lock of a key and keeps it for seconds
+    '''
+    fd = lock_key(lock)
+    taken.set()
+    time.sleep(seconds)
+    unlock_key(fd)
+
+def holder(lock, seconds):
+    '''
+    :return process: a process that holds the lock
+    '''
+    taken   = multiprocessing.Event()
+    process = multiprocessing.Process(target = hold, args = (lock, seconds, taken))
+    process.start()
+    assert taken.wait(10)
+    return process
+
+def test_lock_timeout(tmp_path):
+    lock    = str(tmp_path / 'key.hdf5.lock')
+    process = holder(lock, 30)
+    try:
+        with pytest.raises(TimeoutError, match = 'key.hdf5.lock'):
+            lock_key(lock, timeout = 0.5)
+    finally:
+        process.kill()
+        process.join()
+
+def test_lock_wait(tmp_path):
+    lock    = str(tmp_path / 'key.hdf5.lock')
+    process = holder(lock, 1)
+    t0      = time.time()
+    unlock_key(lock_key(lock, timeout = 30))
+    assert time.time() - t0 > 0.5 # waited for the holder
+    process.join()
@@ -3,55 +3,240 @@ import os
 import numpy as np
 import h5py
 
-def write_nospin_hdf5(self):
+def results_file(c):
+    '''
+    :param c: dictionary of the json config
 
-    f4 = h5py.File(os.path.join(self.c['resultsFolder'], self.c['resultsFileName']),'w')
-    
+    :return f4: the results file named in the json, opened for writing (the results folder is created if needed)
+    '''
+    if not os.path.exists(c['resultsFolder']):
+        os.makedirs(c['resultsFolder'])
+    return h5py.File(os.path.join(c['resultsFolder'], c['resultsFileName']),'w')
+
+def nospin_outputs(self):
+    '''
+    the outputs of a main run that are kept in memory (i.e. with streamOutput off)
+
+    :return outputs: dictionary of dataset name in the results file -> array
+    '''
+
+    outputs = {}
     if 'density' in self.output_list:
-        f4.create_dataset('density',data = self.rho_out)
+        outputs['density']          = self.rho_out
     if 'temperature' in self.output_list:
-        f4.create_dataset('temperature',data = self.Tz_out)
+        outputs['temperature']      = self.Tz_out
     if 'age' in self.output_list:
-        f4.create_dataset('age',data = self.age_out[-1,:])
+        outputs['age']              = self.age_out[-1,:]
     if 'depth' in self.output_list:    
-        f4.create_dataset('depth',data = self.z_out)
+        outputs['depth']            = self.z_out
     if 'dcon' in self.output_list:    
-        f4.create_dataset('Dcon',data = self.D_out)
+        outputs['Dcon']             = self.D_out
     if 'bdot_mean' in self.output_list:    
-        f4.create_dataset('bdot',data = self.bdot_out)
+        outputs['bdot']             = self.bdot_out
     if 'climate' in self.output_list:    
-        f4.create_dataset('Modelclimate',data = self.Clim_out)
+        outputs['Modelclimate']     = self.Clim_out
     if 'compaction' in self.output_list:    
-        f4.create_dataset('compaction_rate', data = self.crate_out)
+        outputs['compaction_rate']  = self.crate_out
     if bool(self.c['FirnAir']):
         if "gasses" in self.cg['outputs']:
             for gas in self.cg['gaschoice']:       
-                f4.create_dataset(gas, data = self.gas_out[gas])
+                outputs[gas]        = self.gas_out[gas]
         if "diffusivity" in self.cg['outputs']:
-            f4.create_dataset('diffusivity', data = self.diffu_out)
+            outputs['diffusivity']  = self.diffu_out
         if "advection_rate" in self.cg['outputs']:
-            f4.create_dataset('w_air', data = self.w_air_out)
-            f4.create_dataset('w_firn', data = self.w_firn_out)
+            outputs['w_air']        = self.w_air_out
+            outputs['w_firn']       = self.w_firn_out
     if 'grainsize' in self.output_list:
-        f4.create_dataset('r2', data = self.r2_out)
-        f4.create_dataset('dr2_dt', data = self.dr2_dt_out)
+        outputs['r2']               = self.r2_out
+        outputs['dr2_dt']           = self.dr2_dt_out
     if 'temp_Hx' in self.output_list:    
-        f4.create_dataset('Hx',data = self.Hx_out)
+        outputs['Hx']               = self.Hx_out
     if 'isotopes' in self.output_list:    
-        f4.create_dataset('isotopes',data = self.iso_out)
+        outputs['isotopes']         = self.iso_out
     if 'LWC' in self.output_list:
-        f4.create_dataset('LWC',data = self.LWC_out)
+        outputs['LWC']              = self.LWC_out
     if 'DIP' in self.output_list:
-        f4.create_dataset('DIP',data = self.DIP_out)
-        f4.create_dataset('DIPc', data = self.DIPc_out)
+        outputs['DIP']              = self.DIP_out
+        outputs['DIPc']             = self.DIPc_out
     if 'BCO' in self.output_list:
-        f4.create_dataset('BCO',data = self.BCO_out) 
+        outputs['BCO']              = self.BCO_out
     if 'LIZ' in self.output_list:
-        f4.create_dataset('LIZ',data = self.LIZ_out)
+        outputs['LIZ']              = self.LIZ_out
+    return outputs
+
+def write_nospin_hdf5(self, f4=None):
+    '''
+    writes the outputs of a main run
+
+    :param f4: open hdf5 file or group to write to (e.g. one group per physics, see multiphysics.py);
+               if None, the results file named in the json is created
+    '''
+
+    if self.stream: # the outputs are already in the file; write what is left in the buffers
+        for out in self.streams:
+            out.close()
+        self.profiler.write(self.f4)
+        if self.closeFile:
+            self.f4.close()
+        return
+
+    closeFile = f4 is None
+    if closeFile:
+        f4 = results_file(self.c)
+
+    for name, data in nospin_outputs(self).items():
+        f4.create_dataset(name, data = data)
+    self.profiler.write(f4)
+
+    if closeFile:
+        f4.close()
+
+class WriteSchedule:
+    '''
+    The time steps at which each output of a main run is written, as integer step indices.
+
+    By default all of the outputs are written every TWriteInt steps from the first step
+    after -25000 years. "outputSchedule" in the json can give outputs their own start
+    year and interval, e.g. {"DIP": {"TWriteInt": 1}, "BCO": {"TWriteInt": 1, "TWriteStart": 1958.0}}
+    writes DIP and BCO every step (BCO from 1958) and the profiles every TWriteInt steps.
+    Row 0 of every output is the initial state; row k is its k-th write time.
+    '''
+
+    def __init__(self, modeltime, TWriteInt, outputSchedule=None, TWriteStart=-25000):
+        '''
+        :param modeltime: time of each model step
+        :param TWriteInt: steps between writes
+        :param outputSchedule: dictionary of output name -> {"TWriteInt": steps, "TWriteStart": year}
+        :param TWriteStart: year of the first write
+        '''
+
+        self.stp        = len(modeltime)
+        self.main       = self.stream(modeltime, TWriteStart, TWriteInt)
+        self.streams    = {} # output name -> (first step, steps between writes)
+        if outputSchedule:
+            for output, sched in outputSchedule.items():
+                self.streams[output] = self.stream(modeltime, sched.get('TWriteStart', TWriteStart), sched.get('TWriteInt', TWriteInt))
+        self.outputs    = [] # outputs that are written (see add)
+
+        ### steps at which anything is written
+        self.due        = np.zeros(self.stp, dtype = bool)
+        for start, interval in [self.main] + list(self.streams.values()):
+            self.due[start::interval] = True
+
+    def stream(self, modeltime, TWriteStart, TWriteInt):
+        '''
+        :return (start, interval): first step and number of steps between writes
+        '''
+        start = np.nonzero(modeltime >= TWriteStart)[0][0]
+        return (int(start), int(TWriteInt))
 
-    f4.close()
+    def nrows(self, output=None):
+        '''
+        :param output: name of the output; None for the outputs without a schedule of their own
 
-def write_spin_hdf5(folder, spinFileName, physGrain, THist, isoDiff, doublegrid, rho_time, Tz_time, age_time, z_time, r2_time, Hx_time, iso_time, grid_time):
+        :return nrows: number of rows of the output (the initial state and each write time)
+        '''
+        start, interval = self.streams.get(output, self.main)
+        return len(range(start, self.stp, interval)) + 1
+
+    def add(self, output):
+        '''
+        :param output: name of an output that is written
+
+        :return nrows: number of rows of the output
+        '''
+        if output not in self.outputs:
+            self.outputs.append(output)
+        return self.nrows(output)
+
+    def row(self, iii, output=None):
+        '''
+        :return row: row of the output at step iii, or None if it is not written at step iii
+        '''
+        start, interval = self.streams.get(output, self.main)
+        if iii >= start and (iii - start) % interval == 0:
+            return (iii - start) // interval + 1
+        return None
+
+    def rows(self, iii):
+        '''
+        :return rows: dictionary of output name -> row, for the outputs that are written at step iii
+        '''
+        rows = {}
+        if self.due[iii]:
+            for output in self.outputs:
+                row = self.row(iii, output)
+                if row is not None:
+                    rows[output] = row
+        return rows
+
+class OutputStream:
+    '''
+    One output of a main run that is written to the results file while the model runs
+    (if "streamOutput" is on in the json), instead of being kept in memory until the end.
+
+    Rows are set like the rows of the in-memory output arrays (out[WTracker,:] = row),
+    kept in a small buffer and appended to an extendable, chunked dataset when the
+    buffer is full, so the memory used does not depend on the length of the run.
+    '''
+
+    def __init__(self, f4, name, ncol, bufRows=64, compression=None, lastOnly=False):
+        '''
+        :param f4: open hdf5 file or group
+        :param name: name of the dataset
+        :param ncol: length of a row (including the model time)
+        :param bufRows: number of rows kept in memory between writes
+        :param compression: hdf5 compression filter of the dataset (e.g. 'gzip'), or None
+        :param lastOnly: only the last row is written, as a 1-D dataset when the stream is closed (e.g. age)
+        '''
+
+        self.f4         = f4
+        self.name       = name
+        self.lastOnly   = lastOnly
+        if lastOnly:
+            bufRows     = 1
+        else:
+            chunkRows   = max(1, min(bufRows, 2**18 // ncol)) # chunks of at most 1 MB
+            self.dset   = f4.create_dataset(name, (0, ncol), maxshape = (None, ncol), dtype = 'float32', chunks = (chunkRows, ncol), compression = compression)
+        self.buf        = np.zeros((bufRows, ncol), dtype = 'float32')
+        self.start      = 0 # row of the dataset of the first row in the buffer
+        self.nbuf       = 0
+        self.nbytes     = self.buf.nbytes
+
+    def __setitem__(self, index, row):
+        if isinstance(index, tuple):
+            index = index[0]
+        if self.lastOnly:
+            self.buf[0, :] = row
+            self.nbuf = 1
+            return
+        if index != self.start + self.nbuf:
+            raise IndexError('rows of %s must be written in order' %self.name)
+        self.buf[self.nbuf, :] = row
+        self.nbuf += 1
+        if self.nbuf == len(self.buf):
+            self.flush()
+
+    def flush(self):
+        '''
+        append the rows in the buffer to the dataset
+        '''
+        if self.lastOnly or self.nbuf == 0:
+            return
+        end = self.start + self.nbuf
+        self.dset.resize(end, axis = 0)
+        self.dset[self.start:end, :] = self.buf[:self.nbuf]
+        self.start  = end
+        self.nbuf   = 0
+        self.f4.file.flush()
+
+    def close(self):
+        if self.lastOnly:
+            self.f4.create_dataset(self.name, data = self.buf[0])
+        else:
+            self.flush()
+
+def write_spin_hdf5(folder, spinFileName, physGrain, THist, isoDiff, doublegrid, rho_time, Tz_time, age_time, z_time, r2_time, Hx_time, iso_time, grid_time, residual_time=None):
 
     f5 = h5py.File(os.path.join(folder, spinFileName), 'w')
 
@@ -67,4 +252,31 @@ def write_spin_hdf5(folder, spinFileName, physGrain, THist, isoDiff, doublegrid,
         f5.create_dataset('IsoSpin', data = iso_time)
     if doublegrid:
         f5.create_dataset('gridSpin', data = grid_time)
+    if residual_time is not None:
+        f5.create_dataset('spinResidual', data = residual_time)
     f5.close()
+
+def write_ensemble_hdf5(f4, WTracker, nWrite, mtime, fields, valid):
+    '''
+    writes one output time of an ensemble run (ensemble.py) to an open hdf5 file.
+    Each output is a (write times x columns x values+1) dataset; the first value of each row is the model time.
+    Per-node outputs are NaN below the bottom of each column.
+
+    :param f4: hdf5 file
+    :param WTracker: index of this output time
+    :param nWrite: total number of output times
+    :param mtime: model time
+    :param fields: dictionary of output name -> (columns x values) array
+    :param valid: (columns x nodes) mask of the nodes in each column
+    '''
+
+    for name, data in fields.items():
+        ncol, nval = data.shape
+        if name not in f4:
+            f4.create_dataset(name, (nWrite, ncol, nval + 1), dtype = 'float32', chunks = (1, min(ncol, 1024), nval + 1), fillvalue = np.nan)
+        out             = np.empty((ncol, nval + 1), dtype = 'float32')
+        out[:, 0]       = mtime
+        out[:, 1:]      = data
+        if data.shape == valid.shape:
+            out[:, 1:][~valid] = np.nan
+        f4[name][WTracker] = out